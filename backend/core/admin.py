@@ -1,8 +1,11 @@
 from django.contrib import admin
+from django.db.models import Count
 from django.utils.html import format_html
+from .moderation import moderate_items
+from .stats import add_counts, apply_stats_changes
 from .models import (
     UserProfile, Category, ClothingItem, ItemImage, SwapRequest,
-    PointsTransaction, PointsRedemption, Notification, UserInteraction
+    PointsTransaction, PointsRedemption, Notification, UserInteraction, UserStats
 )
 
 
@@ -14,15 +17,33 @@ class UserProfileAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at']
 
 
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'total_items', 'pending_swap_requests', 'unread_notifications', 'updated_at']
+    search_fields = ['user__username']
+    readonly_fields = ['updated_at']
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'description', 'items_count', 'created_at']
+    list_display = ['name', 'description', 'items_count', 'available_items_count', 'created_at']
     search_fields = ['name', 'description']
-    readonly_fields = ['created_at']
+    readonly_fields = ['available_items_count', 'created_at']
+
+    actions = ['recount_available_items']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(total_items=Count('items'))
 
     def items_count(self, obj):
-        return obj.items.count()
+        return obj.total_items
     items_count.short_description = 'Items Count'
+    items_count.admin_order_field = 'total_items'
+
+    def recount_available_items(self, request, queryset):
+        updated = queryset.recount_available_items()
+        self.message_user(request, f'{updated} category counters were recomputed.')
+    recount_available_items.short_description = "Recount available items"
 
 
 class ItemImageInline(admin.TabularInline):
@@ -34,26 +55,23 @@ class ItemImageInline(admin.TabularInline):
 @admin.register(ClothingItem)
 class ClothingItemAdmin(admin.ModelAdmin):
     list_display = ['title', 'owner', 'category', 'type', 'size', 'condition', 
-                   'status', 'points_value', 'created_at']
-    list_filter = ['status', 'category', 'type', 'size', 'condition', 'created_at']
+                   'status', 'triage_status', 'triage_priority', 'points_value', 'created_at']
+    list_filter = ['status', 'triage_status', 'category', 'type', 'size', 'condition', 'created_at']
     search_fields = ['title', 'description', 'owner__username', 'tags']
-    readonly_fields = ['created_at', 'updated_at', 'approved_at']
+    readonly_fields = ['created_at', 'updated_at', 'approved_at', 'triage_status', 'triage_priority', 'triage_reasons']
     inlines = [ItemImageInline]
     
     actions = ['approve_items', 'reject_items']
 
     def approve_items(self, request, queryset):
-        from django.utils import timezone
-        updated = queryset.filter(status='pending').update(
-            status='available',
-            approved_at=timezone.now(),
-            approved_by=request.user
-        )
+        results = moderate_items(request.user, queryset.values_list('pk', flat=True), 'approve')
+        updated = sum(result == 'approved' for result in results.values())
         self.message_user(request, f'{updated} items were approved.')
     approve_items.short_description = "Approve selected items"
 
     def reject_items(self, request, queryset):
-        updated = queryset.filter(status='pending').update(status='rejected')
+        results = moderate_items(request.user, queryset.values_list('pk', flat=True), 'reject')
+        updated = sum(result == 'rejected' for result in results.values())
         self.message_user(request, f'{updated} items were rejected.')
     reject_items.short_description = "Reject selected items"
 
@@ -107,15 +125,26 @@ class NotificationAdmin(admin.ModelAdmin):
     actions = ['mark_as_read', 'mark_as_unread']
 
     def mark_as_read(self, request, queryset):
+        changes = self.unread_changes(queryset.filter(is_read=False), -1)
         updated = queryset.update(is_read=True)
+        apply_stats_changes(changes)
         self.message_user(request, f'{updated} notifications marked as read.')
     mark_as_read.short_description = "Mark selected notifications as read"
 
     def mark_as_unread(self, request, queryset):
+        changes = self.unread_changes(queryset.filter(is_read=True), 1)
         updated = queryset.update(is_read=False)
+        apply_stats_changes(changes)
         self.message_user(request, f'{updated} notifications marked as unread.')
     mark_as_unread.short_description = "Mark selected notifications as unread"
 
+    def unread_changes(self, queryset, sign):
+        # update() skips the signals that keep the unread counters up to date
+        changes = {}
+        for row in queryset.order_by().values('user_id').annotate(count=Count('pk')):
+            add_counts(changes, row['user_id'], {'unread_notifications': row['count']}, sign)
+        return changes
+
 
 @admin.register(UserInteraction)
 class UserInteractionAdmin(admin.ModelAdmin):
@@ -0,0 +1,262 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db.models import Max
+from django.http import Http404, HttpResponse
+from django.urls import path
+from rest_framework import exceptions
+
+from . import views
+from .cache import (
+    aget_response_version, get_response_config, response_cache_entry, response_cache_key, serve_cached_response
+)
+from .events import (
+    AsyncSubscription, get_broker, get_config as get_events_config, last_event_id, notification_messages, sse
+)
+from .fastpath import FastItemListMixin, item_rows
+from .interactions import record_interaction
+from .models import ClothingItem, UserProfile
+from .pagination import ItemPagination
+from .serializers import ClothingItemSerializer, DashboardStatsSerializer, NotificationSerializer
+from .stats import aget_dashboard_stats
+
+
+DEFAULTS = {
+    # Route the read endpoints below to these views, wear_project.asgi turns it on
+    'ENABLED': False,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_ASYNC_VIEWS', {})}
+
+
+async def run_inline(function, *args, **kwargs):
+    """Call function on the event loop, or on a worker thread if it turns out to need the database.
+
+    Only for functions that change nothing before their first query, which is
+    where Django raises SynchronousOnlyOperation.
+    """
+    try:
+        return function(*args, **kwargs)
+    except SynchronousOnlyOperation:
+        return await sync_to_async(function)(*args, **kwargs)
+
+
+class AsyncAPIView:
+    """Async GET counterpart of the DRF view in sync_view.
+
+    Authentication, permissions, filters, pagination and serializers all come
+    from sync_view, so both return the same payload. Rows are fetched through
+    the async ORM and serialized on the event loop; a blocking step such as a
+    session login or a token not cached yet moves to a worker thread.
+    """
+    sync_view = None
+    # Served through the shared public response cache like PublicResponseCacheMixin
+    public_cache = False
+
+    @classmethod
+    def as_view(cls):
+        async def view(request, *args, **kwargs):
+            return await cls().dispatch(request, *args, **kwargs)
+
+        view.view_class = cls
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        view = self.sync_view()
+        view.args = args
+        view.kwargs = kwargs
+        view.format_kwarg = None
+        request = view.initialize_request(request, *args, **kwargs)
+        view.request = request
+        view.headers = view.default_response_headers
+        try:
+            if request.method not in ('GET', 'HEAD'):
+                raise exceptions.MethodNotAllowed(request.method)
+            request.accepted_renderer, request.accepted_media_type = view.perform_content_negotiation(request)
+            await run_inline(getattr, request, 'user')
+            view.check_permissions(request)
+            await self.load_profile(request.user)
+            response = await self.respond(request, view)
+        except Http404 as exc:
+            response = self.handle_exception(view, exceptions.NotFound(*exc.args))
+        except exceptions.APIException as exc:
+            response = self.handle_exception(view, exc)
+        for name, value in view.headers.items():
+            response.setdefault(name, value)
+        return response
+
+    async def load_profile(self, user):
+        # Serializers read the viewer's balance, which must not be a lazy query here
+        if user.is_authenticated and not User.profile.related.is_cached(user):
+            profile = await UserProfile.objects.filter(user_id=user.pk).afirst()
+            User.profile.related.set_cached_value(user, profile)
+
+    async def respond(self, request, view):
+        if not self.public_cache or not get_response_config()['ENABLED']:
+            return self.render(request, await self.get_data(request, view))
+
+        version = await aget_response_version()
+        key = response_cache_key(request, version)
+        entry = await cache.aget(key)
+        if entry is None:
+            entry = response_cache_entry(await self.get_data(request, view))
+            await cache.aset(key, entry, timeout=get_response_config()['TIMEOUT'])
+        return serve_cached_response(request, entry, version, lambda data: self.render(request, data))
+
+    async def get_data(self, request, view):
+        queryset = await run_inline(view.filter_queryset, view.get_queryset())
+        rows = item_rows(request) if isinstance(view, FastItemListMixin) else None
+        if rows is not None:
+            return await self.paginate(request, rows.values(queryset), view.paginator, rows.aserialize)
+        return await self.paginate(request, queryset, view.paginator, serialize_with(view.get_serializer))
+
+    async def paginate(self, request, queryset, paginator, serialize):
+        page = await paginator.apaginate_queryset(queryset, request)
+        if page is None:
+            return await serialize([row async for row in queryset])
+        return paginator.get_paginated_response(await serialize(page)).data
+
+    def render(self, request, data, status=200, headers=None):
+        content = request.accepted_renderer.render(data, request.accepted_media_type, {'request': request})
+        return HttpResponse(content, status=status, content_type=request.accepted_media_type, headers=headers)
+
+    def handle_exception(self, view, exc):
+        # DRF's handling gives the same status, WWW-Authenticate header and body
+        if not hasattr(view.request, 'accepted_renderer'):
+            # As APIView.finalize_response does when negotiation never ran or failed
+            negotiated = view.perform_content_negotiation(view.request, force=True)
+            view.request.accepted_renderer, view.request.accepted_media_type = negotiated
+        response = view.handle_exception(exc)
+        headers = {name: value for name, value in response.items() if name != 'Content-Type'}
+        return self.render(view.request, response.data, response.status_code, headers)
+
+
+def serialize_with(get_serializer):
+    """Async serialize callable for AsyncAPIView.paginate from a serializer factory"""
+    async def serialize(instances):
+        return get_serializer(instances, many=True).data
+    return serialize
+
+
+class ItemListView(AsyncAPIView):
+    sync_view = views.ClothingItemListView
+    public_cache = True
+
+
+class ItemDetailView(AsyncAPIView):
+    sync_view = views.ClothingItemDetailView
+    public_cache = True
+
+    async def respond(self, request, view):
+        response = await super().respond(request, view)
+        # Track user interaction if authenticated, cached and 304 responses included
+        if request.user.is_authenticated and response.status_code in (200, 304):
+            await run_inline(record_interaction, request.user, 'view', item_id=view.kwargs['pk'])
+        return response
+
+    async def get_data(self, request, view):
+        queryset = view.filter_queryset(view.get_queryset()).select_related(
+            'owner', 'category'
+        ).prefetch_related('images')
+        try:
+            item = await queryset.aget(pk=view.kwargs['pk'])
+        except ClothingItem.DoesNotExist:
+            raise Http404(f'No {ClothingItem._meta.object_name} matches the given query.')
+        view.check_object_permissions(request, item)
+        return view.get_serializer(item).data
+
+
+class FeaturedItemsView(AsyncAPIView):
+    sync_view = views.FeaturedItemsView
+    public_cache = True
+
+
+class SearchView(AsyncAPIView):
+    sync_view = views.search_items.cls
+
+    async def get_data(self, request, view):
+        query = request.GET.get('q', '')
+        queryset = views.get_search_queryset(request.GET)
+
+        # Track search interaction
+        if query and request.user.is_authenticated:
+            await run_inline(record_interaction, request.user, 'search', search_query=query)
+
+        rows = item_rows(request)
+        if rows is not None:
+            return await self.paginate(request, rows.values(queryset), ItemPagination(), rows.aserialize)
+
+        def get_serializer(instances, many):
+            return ClothingItemSerializer(instances, many=many, context={'request': request})
+        return await self.paginate(request, queryset, ItemPagination(), serialize_with(get_serializer))
+
+
+class NotificationListView(AsyncAPIView):
+    sync_view = views.NotificationListView
+
+
+class NotificationStreamView(AsyncAPIView):
+    """views.NotificationStreamView with each open stream a coroutine rather than a thread"""
+    sync_view = views.NotificationStreamView
+
+    async def respond(self, request, view):
+        after = last_event_id(request)
+        if after is None:
+            after = (await request.user.notifications.aaggregate(last=Max('pk')))['last'] or 0
+        return views.event_stream_response(self.stream(request, after))
+
+    async def stream(self, request, after):
+        config = get_events_config()
+        broker = get_broker()
+        subscription = AsyncSubscription(request.user.id)
+        broker.subscribe(subscription)
+        try:
+            yield sse(retry=config['RETRY'])
+            deadline = time.monotonic() + config['MAX_DURATION']
+            woken = True
+            while True:
+                while woken:
+                    queryset = views.notifications_for(request.user).filter(pk__gt=after).order_by('pk')
+                    rows = [row async for row in queryset[:config['BATCH_SIZE']]]
+                    if not rows:
+                        break
+                    after = rows[-1].pk
+                    unread = await request.user.notifications.filter(is_read=False).acount()
+                    data = NotificationSerializer(rows, many=True, context={'request': request}).data
+                    yield b''.join(notification_messages(data, unread))
+                    woken = len(rows) == config['BATCH_SIZE']
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                woken = await subscription.wait(min(config['HEARTBEAT'], remaining))
+                if not woken:
+                    yield sse(comment='keep-alive')
+        finally:
+            broker.unsubscribe(subscription)
+
+
+class DashboardStatsView(AsyncAPIView):
+    sync_view = views.DashboardStatsView
+
+    async def get_data(self, request, view):
+        return DashboardStatsSerializer(await aget_dashboard_stats(request.user)).data
+
+
+# Placed in front of core.urls when enabled, same paths and names as the sync views
+urlpatterns = [
+    path('dashboard/stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
+    path('items/', ItemListView.as_view(), name='items-list'),
+    path('items/<int:pk>/', ItemDetailView.as_view(), name='items-detail'),
+    path('items/featured/', FeaturedItemsView.as_view(), name='items-featured'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('notifications/', NotificationListView.as_view(), name='notifications'),
+    path('notifications/stream/', NotificationStreamView.as_view(), name='notifications-stream'),
+]
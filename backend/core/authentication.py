@@ -1,12 +1,237 @@
-from rest_framework.authentication import TokenAuthentication
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from .models import UserProfile
+
+
+DEFAULTS = {
+    # Tokens remembered per process, least recently used dropped first
+    'CACHE_SIZE': 10000,
+    # Seconds a cached token is trusted. Invalidation is per process, so this
+    # bounds how long another worker may accept a deleted token.
+    'CACHE_TTL': 60,
+    # Accept 'Authorization: Signed <token>' headers, checked against the
+    # cached user so deactivation, password changes and logout revoke them
+    'SIGNED_TOKENS': False,
+    'SIGNED_TOKEN_MAX_AGE': 60 * 60,
+}
+
+SIGNED_TOKEN_SALT = 'core.authentication.signed-token'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_AUTH', {})}
 
 
 class CsrfExemptTokenAuthentication(TokenAuthentication):
     """Token authentication that exempts CSRF verification"""
-    
+
     def authenticate(self, request):
         result = super().authenticate(request)
         if result:
             # If token authentication succeeds, mark the view as CSRF exempt
             setattr(request, '_dont_enforce_csrf_checks', True)
         return result
+
+
+def field_values(instance):
+    return tuple(getattr(instance, field.attname) for field in instance._meta.concrete_fields)
+
+
+def from_values(model, db, values):
+    return model.from_db(db, [field.attname for field in model._meta.concrete_fields], values)
+
+
+class TokenCache:
+    """Bounded LRU of token key to (expiry, user id, db, token, user and profile field values).
+
+    Plain field values are cached rather than model instances, so every
+    request gets its own objects to modify.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.user_keys = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[2:]
+
+    def set(self, key, user_id, db, token, user, profile):
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, user_id, db, token, user, profile)
+            self.user_keys.setdefault(user_id, set()).add(key)
+            while len(self.entries) > self.size:
+                self._drop(next(iter(self.entries)))
+
+    def forget_token(self, key):
+        with self.lock:
+            self._drop(key)
+
+    def forget_user(self, user_id):
+        with self.lock:
+            for key in list(self.user_keys.get(user_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.user_keys.clear()
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.user_keys[entry[1]]
+            keys.discard(key)
+            if not keys:
+                del self.user_keys[entry[1]]
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                config = get_config()
+                _token_cache = TokenCache(config['CACHE_SIZE'], config['CACHE_TTL'])
+    return _token_cache
+
+
+def forget_user(user_id):
+    """Drop the cached tokens of a user whose account, profile or balance changed"""
+    if _token_cache is not None:
+        _token_cache.forget_user(user_id)
+
+
+def forget_token(key):
+    if _token_cache is not None:
+        _token_cache.forget_token(key)
+
+
+def load_token(cache_key, **lookup):
+    """(user, token) of the token matching lookup, kept in the token cache under cache_key; None without one"""
+    cache = get_token_cache()
+    cached = cache.get(cache_key)
+    if cached is None:
+        token = Token.objects.select_related('user__profile').filter(**lookup).first()
+        if token is None:
+            return None
+        user = token.user
+        try:
+            profile = field_values(user.profile)
+        except UserProfile.DoesNotExist:
+            profile = None
+        cached = (token._state.db, field_values(token), field_values(user), profile)
+        cache.set(cache_key, user.pk, *cached)
+
+    db, token_values, user_values, profile_values = cached
+    token = from_values(Token, db, token_values)
+    user = from_values(User, db, user_values)
+    profile = from_values(UserProfile, db, profile_values) if profile_values else None
+    User.profile.related.set_cached_value(user, profile)
+    if profile is not None:
+        UserProfile.user.field.set_cached_value(profile, user)
+    Token.user.field.set_cached_value(token, user)
+    User.auth_token.related.set_cached_value(user, token)
+    return user, token
+
+
+class CachedTokenAuthentication(CsrfExemptTokenAuthentication):
+    """Token authentication that serves token, user and profile from a per-process LRU.
+
+    A cache hit costs no query, and request.user.profile is loaded with the
+    user so serializers do not fetch it lazily. Signals drop entries when the
+    token, user or profile changes and the points module when a balance moves.
+    """
+
+    def authenticate_credentials(self, key):
+        loaded = load_token(key, key=key)
+        if loaded is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        user, token = loaded
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, token
+
+
+class QueryTokenAuthentication(CachedTokenAuthentication):
+    """Token from the ?token= query parameter, for EventSource which cannot send headers"""
+
+    def authenticate(self, request):
+        key = request.query_params.get('token')
+        if not key:
+            return None
+        return self.authenticate_credentials(key)
+
+
+def signed_token_version(user, token):
+    """Changes when the user's auth token is deleted or their password changes"""
+    return salted_hmac(SIGNED_TOKEN_SALT, f'{token.key}:{user.password}').hexdigest()[:16]
+
+
+def issue_signed_token(user, token):
+    """Token carrying the user's id and version, valid for SIGNED_TOKEN_MAX_AGE seconds"""
+    return signing.dumps([user.pk, signed_token_version(user, token)], salt=SIGNED_TOKEN_SALT, compress=True)
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """'Authorization: Signed <token>' checked by signature and the cached user.
+
+    The user, profile and auth token come from the token cache like
+    CachedTokenAuthentication, so a hit costs no query. A token stops working
+    once its version no longer matches: logout deletes the auth token and a
+    password change alters the hash. Deactivated users are refused. Other
+    workers notice within CACHE_TTL seconds.
+    """
+    keyword = 'Signed'
+
+    def authenticate(self, request):
+        config = get_config()
+        auth = get_authorization_header(request).split()
+        if not config['SIGNED_TOKENS'] or not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid signed token header.')
+        try:
+            user_id, version = signing.loads(
+                auth[1].decode(), salt=SIGNED_TOKEN_SALT, max_age=config['SIGNED_TOKEN_MAX_AGE']
+            )
+        except (signing.BadSignature, UnicodeError, ValueError, TypeError):
+            raise exceptions.AuthenticationFailed('Invalid or expired signed token.')
+
+        # Real token keys are hex, so this cache key cannot collide with one
+        loaded = load_token(f'signed:{user_id}', user_id=user_id)
+        if loaded is None or not constant_time_compare(signed_token_version(*loaded), str(version)):
+            raise exceptions.AuthenticationFailed('Invalid or expired signed token.')
+        user = loaded[0]
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        setattr(request._request, '_dont_enforce_csrf_checks', True)
+        return user, None
+
+    def authenticate_header(self, request):
+        return self.keyword
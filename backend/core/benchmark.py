@@ -0,0 +1,379 @@
+import json
+import math
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from rest_framework.authtoken.models import Token
+
+from .models import Category, ClothingItem, Notification, SwapRequest, UserProfile
+from .matching import rebuild_match_index
+from .recommendations import refresh_model
+
+
+# Statements that only manage the transaction each request runs in
+TRANSACTION_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT')
+
+PASSWORD = 'password123'
+
+# Pending items approved by one batch moderation request
+MODERATION_BATCH = 100
+
+
+class Scenario:
+    """One request against a core route, with its expected status and default budgets.
+
+    kwargs, data and optionally query are callables taking the fixtures dict,
+    so scenarios can refer to rows of whatever data set the run uses.
+    """
+
+    def __init__(self, name, method='get', user='member', kwargs=None, query='', data=None,
+                 multipart=False, status=200, queries=None, memory_kb=None, p95_ms=None):
+        self.name = name
+        self.method = method
+        self.user = user
+        self.kwargs = kwargs
+        self.query = query
+        self.data = data
+        self.multipart = multipart
+        self.status = status
+        self.budgets = {
+            key: value for key, value in
+            (('queries', queries), ('memory_kb', memory_kb), ('p95_ms', p95_ms)) if value is not None
+        }
+
+    def path(self, fixtures):
+        path = reverse(self.name, kwargs=self.kwargs(fixtures) if self.kwargs else None)
+        query = self.query(fixtures) if callable(self.query) else self.query
+        return f'{path}?{query}' if query else path
+
+
+def import_file(fixtures):
+    rows = ['title,description,category,type,size,condition,points_value'] + [
+        f'Imported shirt {n},Plain cotton shirt,{fixtures["category"]},unisex,m,good,12' for n in range(50)
+    ]
+    return {'file': SimpleUploadedFile('items.csv', '\n'.join(rows).encode(), content_type='text/csv')}
+
+
+# Query budgets are the current counts, so a new N+1 or any extra query fails
+# the run. Memory budgets, in KiB of peak allocation, and p95 latency budgets,
+# in milliseconds, are calibrated on the benchmark command's default data set
+# with room for data set and machine differences. Latency budgets are at least
+# 100 ms so a collector pause cannot fail a short run; registration and login
+# pay for password hashing.
+SCENARIOS = [
+    Scenario('hello', user=None, queries=0, memory_kb=64, p95_ms=100),
+    Scenario('register', 'post', user=None, status=201, data=lambda f: {
+        'username': 'benchmark_new', 'email': 'new@example.com', 'password': PASSWORD,
+        'password_confirm': PASSWORD, 'first_name': 'New', 'last_name': 'User',
+    }, queries=5, memory_kb=128, p95_ms=1500),
+    Scenario('login', 'post', user=None, data=lambda f: {
+        'username': f['username'], 'password': PASSWORD,
+    }, queries=8, memory_kb=512, p95_ms=1500),
+    Scenario('logout', 'post', queries=2, memory_kb=128, p95_ms=100),
+    Scenario('profile', queries=2, memory_kb=128, p95_ms=100),
+    Scenario('dashboard-stats', queries=3, memory_kb=128, p95_ms=100),
+    Scenario('categories', user=None, queries=1, memory_kb=128, p95_ms=100),
+    Scenario('items-list', user=None, queries=3, memory_kb=768, p95_ms=100),
+    Scenario('items-create', 'post', status=201, data=lambda f: {
+        'title': 'Benchmark jacket', 'description': 'Warm wool jacket', 'category': f['category'],
+        'type': 'unisex', 'size': 'm', 'condition': 'good', 'points_value': 20, 'tags': 'wool, warm',
+    }, queries=6, memory_kb=256, p95_ms=100),
+    Scenario('items-import', 'post', status=201, multipart=True, data=import_file,
+             queries=6, memory_kb=1024, p95_ms=200),
+    Scenario('items-export', query='as=jsonl', queries=2, memory_kb=4096, p95_ms=500),
+    Scenario('items-detail', user=None, kwargs=lambda f: {'pk': f['item']}, queries=4, memory_kb=192, p95_ms=100),
+    Scenario('items-update', kwargs=lambda f: {'pk': f['own_item']}, queries=3, memory_kb=256, p95_ms=100),
+    Scenario('items-featured', user=None, queries=3, memory_kb=512, p95_ms=100),
+    Scenario('my-items', queries=3, memory_kb=768, p95_ms=100),
+    Scenario('search', user=None, query='q=cotton', queries=3, memory_kb=768, p95_ms=1000),
+    Scenario('recommendations', queries=2, memory_kb=768, p95_ms=100),
+    Scenario('swaps-list', queries=4, memory_kb=1536, p95_ms=100),
+    Scenario('swaps-create', 'post', status=201, data=lambda f: {
+        'requester_item_id': f['own_item'], 'requested_item_id': f['item'], 'message': 'Swap?',
+    }, queries=10, memory_kb=384, p95_ms=100),
+    Scenario('swaps-matches', queries=2, memory_kb=768, p95_ms=100),
+    Scenario('swaps-detail', kwargs=lambda f: {'pk': f['swap']}, queries=11, memory_kb=384, p95_ms=100),
+    Scenario('points-transactions', queries=3, memory_kb=1024, p95_ms=100),
+    Scenario('points-redeem', 'post', status=201, data=lambda f: {'item_id': f['item']},
+             queries=12, memory_kb=256, p95_ms=100),
+    Scenario('points-redemptions', queries=1, memory_kb=128, p95_ms=100),
+    Scenario('notifications', queries=2, memory_kb=256, p95_ms=100),
+    # Catches up on the fixture notification and ends instead of waiting, see run_benchmarks
+    Scenario('notifications-stream', query=lambda f: f'last_event_id={f["notification"] - 1}',
+             queries=2, memory_kb=256, p95_ms=100),
+    Scenario('notification-read', 'post', kwargs=lambda f: {'notification_id': f['notification']},
+             queries=2, memory_kb=128, p95_ms=100),
+    Scenario('notifications-read-all', 'post', queries=1, memory_kb=128, p95_ms=100),
+    Scenario('metrics', user='admin', queries=0, memory_kb=1024, p95_ms=100),
+    Scenario('admin-items-pending', user='admin', queries=3, memory_kb=768, p95_ms=100),
+    Scenario('admin-moderate-item', 'post', user='admin', kwargs=lambda f: {'item_id': f['pending_item']},
+             data=lambda f: {'action': 'approve'}, queries=10, memory_kb=256, p95_ms=100),
+    Scenario('admin-moderate-items', 'post', user='admin',
+             data=lambda f: {'action': 'approve', 'ids': f['pending_items']},
+             queries=7, memory_kb=1024, p95_ms=200),
+]
+
+
+# Large item pages timed with and without the item fast path by compare_fast_path
+FAST_PATH_SCENARIOS = [
+    Scenario('items-list', user=None, query='page_size=100'),
+    Scenario('items-featured', user=None),
+    Scenario('my-items', query='page_size=100'),
+    Scenario('search', user=None, query='page_size=100'),
+]
+
+
+def core_route_names():
+    """Names of every route in core/urls.py"""
+    from . import urls
+    return [pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)]
+
+
+def load_fixtures():
+    """Rows the scenarios act on: the busiest seller as 'member', a staff user and their targets.
+
+    The member gets an available item to offer, a pending swap and a
+    notification; the item they act on belongs to someone else and is
+    cheap enough to redeem. The admin gets MODERATION_BATCH pending items.
+    """
+    member = User.objects.filter(
+        owned_items__status='available', profile__isnull=False
+    ).annotate(listed=Count('owned_items')).order_by('-listed', 'pk').first()
+    if member is None:
+        raise ValueError('The benchmark needs users with available items, generate a data set first')
+    # Rolled back with the run, like everything else done here
+    member.set_password(PASSWORD)
+    member.save(update_fields=['password'])
+    UserProfile.objects.filter(user=member).update(points_balance=10000)
+
+    admin, _ = User.objects.get_or_create(
+        username='benchmark_admin', defaults={'is_staff': True, 'email': 'admin@example.com'}
+    )
+    UserProfile.objects.get_or_create(user=admin)
+
+    own_item = member.owned_items.filter(status='available').order_by('pk').first()
+    item = ClothingItem.objects.filter(
+        status='available', is_available_for_points=True
+    ).exclude(owner=member).order_by('pk').first()
+    pending_items = list(ClothingItem.objects.filter(status='pending').order_by('pk')[:MODERATION_BATCH])
+    pending_items += ClothingItem.objects.bulk_create(
+        ClothingItem(
+            title='Pending coat', description='Awaiting moderation', category=item.category, type='unisex',
+            size='m', condition='good', owner=item.owner
+        )
+        for _ in range(MODERATION_BATCH - len(pending_items))
+    )
+
+    swap = SwapRequest.objects.filter(owner=member, status='pending').order_by('pk').first()
+    if swap is None:
+        requester_item = ClothingItem.objects.filter(status='available').exclude(owner=member).order_by('-pk').first()
+        swap = SwapRequest.objects.create(
+            requester_item=requester_item, requested_item=own_item, requester=requester_item.owner,
+            owner=member, message='Swap?'
+        )
+    # The latest one, so the stream catches up on a single notification whatever the data set
+    notification = Notification.objects.filter(user=member).order_by('-pk').first()
+    if notification is None:
+        notification = Notification.objects.create(
+            user=member, notification_type='general', title='Hello', message='Welcome'
+        )
+
+    return {
+        'member': member, 'admin': admin, 'username': member.username,
+        'item': item.pk, 'own_item': own_item.pk, 'pending_item': pending_items[0].pk,
+        'pending_items': [pending.pk for pending in pending_items],
+        'swap': swap.pk, 'notification': notification.pk,
+        'category': Category.objects.order_by('pk').values_list('pk', flat=True).first(),
+        'tokens': {
+            'member': Token.objects.get_or_create(user=member)[0].key,
+            'admin': Token.objects.get_or_create(user=admin)[0].key,
+        },
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def send(client, scenario, fixtures):
+    """One request, read to the end so streamed bodies are timed too"""
+    headers = {}
+    if scenario.user:
+        headers['HTTP_AUTHORIZATION'] = f'Token {fixtures["tokens"][scenario.user]}'
+    data = scenario.data(fixtures) if scenario.data else None
+    method = getattr(client, scenario.method)
+    path = scenario.path(fixtures)
+    if scenario.method == 'get':
+        response = method(path, **headers)
+    elif scenario.multipart:
+        response = method(path, data, **headers)
+    else:
+        response = method(path, json.dumps(data or {}), content_type='application/json', **headers)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    else:
+        response.content
+    return response
+
+
+def measure(client, scenario, fixtures, warm_cache=False):
+    """(status, seconds, queries, peak allocated bytes) of one request, rolled back afterwards"""
+    if not warm_cache:
+        cache.clear()
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = send(client, scenario, fixtures)
+            elapsed = time.perf_counter() - started
+        transaction.set_rollback(True)
+    # Read now, the next request_started signal clears the query log
+    statements = sum(
+        1 for query in queries.captured_queries
+        if not query['sql'].lstrip().upper().startswith(TRANSACTION_STATEMENTS)
+    )
+
+    if not warm_cache:
+        cache.clear()
+    tracemalloc.start()
+    try:
+        with transaction.atomic():
+            baseline = tracemalloc.get_traced_memory()[0]
+            send(client, scenario, fixtures)
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            transaction.set_rollback(True)
+    finally:
+        tracemalloc.stop()
+
+    return response.status_code, elapsed, statements, peak
+
+
+def run_benchmarks(iterations=20, names=None, warm_cache=False):
+    """Time every scenario against the current database, {name: result}.
+
+    The whole run, fixtures included, is rolled back at the end and each
+    request is rolled back on its own, so writes never change what the next
+    iteration sees. Interactions are written inline, inside those
+    transactions, and count towards the queries of the request recording
+    them. Notification streams end once they have caught up, and models that
+    processes refresh in the background are built once, inside the run.
+    Latency is measured without tracemalloc, which slows allocation down;
+    memory is the peak of a separate traced request.
+    """
+    interactions = {**getattr(settings, 'REWEAR_INTERACTIONS', {}), 'BACKEND': 'sync'}
+    events = {**getattr(settings, 'REWEAR_EVENTS', {}), 'MAX_DURATION': 0}
+    recommendations = {**getattr(settings, 'REWEAR_RECOMMENDATIONS', {}), 'REFRESH_INTERVAL': math.inf}
+    matching = {**getattr(settings, 'REWEAR_MATCHING', {}), 'MAX_AGE': math.inf}
+    client = Client()
+    results = {}
+    with override_settings(
+        REWEAR_INTERACTIONS=interactions, REWEAR_EVENTS=events, REWEAR_RECOMMENDATIONS=recommendations,
+        REWEAR_MATCHING=matching,
+    ), transaction.atomic():
+        fixtures = load_fixtures()
+        refresh_model()
+        rebuild_match_index()
+        for scenario in SCENARIOS:
+            if names and scenario.name not in names:
+                continue
+            # Warm up lazily built models and indexes before timing
+            with transaction.atomic():
+                send(client, scenario, fixtures)
+                transaction.set_rollback(True)
+
+            timings, query_counts, peaks, statuses = [], [], [], set()
+            for _ in range(iterations):
+                status, elapsed, queries, peak = measure(client, scenario, fixtures, warm_cache)
+                statuses.add(status)
+                timings.append(elapsed * 1000)
+                query_counts.append(queries)
+                peaks.append(peak)
+
+            results[scenario.name] = {
+                'method': scenario.method.upper(),
+                'path': scenario.path(fixtures),
+                'status': sorted(statuses),
+                'p50_ms': round(percentile(timings, 0.5), 2),
+                'p95_ms': round(percentile(timings, 0.95), 2),
+                'p99_ms': round(percentile(timings, 0.99), 2),
+                'max_ms': round(max(timings), 2),
+                'queries': max(query_counts),
+                'memory_kb': round(max(peaks) / 1024, 1),
+            }
+        transaction.set_rollback(True)
+    return results
+
+
+def compare_fast_path(iterations=20):
+    """Latency and throughput of item pages built by core.fastpath against ClothingItemSerializer.
+
+    Requests alternate between the two so both see the same database and
+    process state. The response cache is cleared before each one, cached
+    responses skip serialization either way. Throughput is requests per
+    second of one client, one request after another.
+    """
+    interactions = {**getattr(settings, 'REWEAR_INTERACTIONS', {}), 'BACKEND': 'sync'}
+    client = Client()
+    results = {}
+    with override_settings(REWEAR_INTERACTIONS=interactions), transaction.atomic():
+        fixtures = load_fixtures()
+        for scenario in FAST_PATH_SCENARIOS:
+            timings = {False: [], True: []}
+            for iteration in range(iterations + 1):
+                for enabled in (False, True):
+                    with override_settings(REWEAR_FAST_PATH={'ENABLED': enabled}):
+                        cache.clear()
+                        started = time.perf_counter()
+                        send(client, scenario, fixtures)
+                        elapsed = time.perf_counter() - started
+                    # The first round only warms up
+                    if iteration:
+                        timings[enabled].append(elapsed * 1000)
+
+            serializer, fast_path = timings[False], timings[True]
+            results[scenario.name] = {
+                'path': scenario.path(fixtures),
+                'serializer_p50_ms': round(percentile(serializer, 0.5), 2),
+                'fast_path_p50_ms': round(percentile(fast_path, 0.5), 2),
+                'serializer_rps': round(1000 * len(serializer) / sum(serializer), 1),
+                'fast_path_rps': round(1000 * len(fast_path) / sum(fast_path), 1),
+                'speedup': round(sum(serializer) / sum(fast_path), 2),
+            }
+        transaction.set_rollback(True)
+    return results
+
+
+def default_budgets():
+    return {scenario.name: dict(scenario.budgets) for scenario in SCENARIOS}
+
+
+def check_budgets(results, budgets):
+    """Messages for every unexpected status and every measurement over its budget"""
+    expected = {scenario.name: scenario.status for scenario in SCENARIOS}
+    failures = []
+    for name, result in results.items():
+        if result['status'] != [expected[name]]:
+            failures.append(f'{name}: status {result["status"]}, expected {expected[name]}')
+        for metric, limit in budgets.get(name, {}).items():
+            if result[metric] > limit:
+                failures.append(f'{name}: {metric} {result[metric]} over budget {limit}')
+    return failures
+
+
+def load_budgets(path=None):
+    """Default budgets, overridden per route and metric by a JSON file"""
+    budgets = default_budgets()
+    if path:
+        with open(path, encoding='utf-8') as source:
+            for name, limits in json.load(source).items():
+                budgets.setdefault(name, {}).update(limits)
+    return budgets
@@ -0,0 +1,237 @@
+import codecs
+import csv
+import json
+import posixpath
+import zipfile
+from functools import partial
+from itertools import islice
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image
+from rest_framework import serializers
+
+from .cache import invalidate_public_responses
+from .images import enqueue_image_processing
+from .models import Category, ClothingItem, ItemImage
+from .points import LISTING_POINTS, credit_points_in_bulk
+from .stats import apply_stats_changes, count_item
+from .triage import enqueue_triage
+
+
+FORMATS = ('csv', 'jsonl')
+
+IMPORT_FIELDS = [
+    'title', 'description', 'category', 'type', 'size', 'condition', 'points_value',
+    'is_available_for_swap', 'is_available_for_points', 'tags', 'images',
+]
+
+EXPORT_FIELDS = ['id'] + IMPORT_FIELDS[:-1] + ['status', 'created_at', 'images']
+
+# Separates image names in a CSV cell, tags already use commas
+IMAGE_SEPARATOR = ';'
+
+# Errors kept in an import report, the failed count covers the rest
+MAX_REPORTED_ERRORS = 1000
+
+
+def detect_format(name, requested=None):
+    """'csv' or 'jsonl' from an explicit choice or the file extension, else None"""
+    if requested:
+        return requested if requested in FORMATS else None
+    extension = posixpath.splitext(name or '')[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension)
+
+
+class InvalidArchive(ValueError):
+    """The image archive is not a readable zip file"""
+
+
+class ImageArchive:
+    """Images referenced by name from an uploaded zip file"""
+
+    def __init__(self, fileobj):
+        try:
+            self.zip = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile as exc:
+            raise InvalidArchive(str(exc))
+        # Rows name images by file name, wherever they sit in the archive
+        self.names = {}
+        for info in self.zip.infolist():
+            if not info.is_dir():
+                self.names.setdefault(posixpath.basename(info.filename), info.filename)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def save(self, name):
+        """Copy an image into media storage and return its storage name"""
+        field = ItemImage._meta.get_field('image')
+        data = self.zip.read(self.names[name])
+        return field.storage.save(field.generate_filename(None, name), ContentFile(data))
+
+    def verify(self, name):
+        with self.zip.open(self.names[name]) as source:
+            with Image.open(source) as img:
+                img.verify()
+
+
+class BulkItemSerializer(serializers.Serializer):
+    """Validates one import row, the category given by id or name"""
+    title = serializers.CharField(max_length=200)
+    description = serializers.CharField()
+    category = serializers.CharField()
+    type = serializers.ChoiceField(choices=ClothingItem.TYPE_CHOICES)
+    size = serializers.ChoiceField(choices=ClothingItem.SIZE_CHOICES)
+    condition = serializers.ChoiceField(choices=ClothingItem.CONDITION_CHOICES)
+    points_value = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    is_available_for_swap = serializers.BooleanField(default=True)
+    is_available_for_points = serializers.BooleanField(default=True)
+    tags = serializers.CharField(max_length=200, allow_blank=True, default='')
+    images = serializers.ListField(child=serializers.CharField(), default=list)
+
+    def validate_category(self, value):
+        categories = self.context['categories']
+        category = categories.get(value.strip().lower())
+        if category is None:
+            raise serializers.ValidationError(f'Unknown category "{value}"')
+        return category
+
+    def validate_images(self, value):
+        archive = self.context.get('archive')
+        for name in value:
+            if archive is None:
+                raise serializers.ValidationError('Images need an image archive')
+            if name not in archive:
+                raise serializers.ValidationError(f'"{name}" is not in the image archive')
+            try:
+                archive.verify(name)
+            except Exception:
+                raise serializers.ValidationError(f'"{name}" is not a valid image')
+        return value
+
+
+def read_rows(stream, file_format):
+    """Yield (row number, data, error) from a CSV or JSONL byte stream, one line at a time"""
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Empty cells fall back to the field defaults
+            data = {key: value for key, value in row.items() if key and value not in ('', None)}
+            if 'images' in data:
+                data['images'] = [name.strip() for name in data['images'].split(IMAGE_SEPARATOR) if name.strip()]
+            yield reader.line_num, data, None
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            yield number, None, {'non_field_errors': [f'Invalid JSON: {exc}']}
+            continue
+        if not isinstance(data, dict):
+            yield number, None, {'non_field_errors': ['Expected a JSON object']}
+            continue
+        if isinstance(data.get('images'), str):
+            data['images'] = [name for name in data['images'].split(IMAGE_SEPARATOR) if name]
+        yield number, data, None
+
+
+def category_lookup():
+    """Categories keyed by lower-cased name and by id"""
+    lookup = {}
+    for category in Category.objects.all():
+        lookup[category.name.lower()] = category
+        lookup[str(category.pk)] = category
+    return lookup
+
+
+def create_items(owner, rows, archive=None):
+    """Insert validated rows with their images and listing points, a few queries per chunk"""
+    with transaction.atomic():
+        items = ClothingItem.objects.bulk_create([
+            ClothingItem(owner=owner, **{key: value for key, value in data.items() if key != 'images'})
+            for data in rows
+        ])
+        images = [
+            ItemImage(item=item, image=archive.save(name), is_primary=position == 0)
+            for item, data in zip(items, rows)
+            for position, name in enumerate(data['images'])
+        ]
+        ItemImage.objects.bulk_create(images)
+        credit_points_in_bulk(owner, [
+            (LISTING_POINTS, 'earned', 'Points earned for listing an item', item) for item in items
+        ])
+        # bulk_create skips the signals that update the owner's stats
+        changes = {}
+        for item in items:
+            count_item(changes, owner.pk, item.status)
+        apply_stats_changes(changes)
+        if images:
+            transaction.on_commit(partial(enqueue_image_processing, *[image.pk for image in images]))
+        transaction.on_commit(partial(enqueue_triage, *[item.pk for item in items]))
+    return items
+
+
+def import_items(owner, stream, file_format, archive=None, chunk_size=500):
+    """Validate and insert items chunk by chunk, returning a report of per-row errors.
+
+    Each chunk commits on its own, so a bad row only rejects itself and a
+    large file never sits in memory as a whole.
+    """
+    context = {'categories': category_lookup(), 'archive': archive}
+    report = {'created': 0, 'failed': 0, 'errors': []}
+
+    def fail(number, errors):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': number, 'errors': errors})
+
+    rows = read_rows(stream, file_format)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        valid = []
+        for number, data, error in chunk:
+            if error:
+                fail(number, error)
+                continue
+            serializer = BulkItemSerializer(data=data, context=context)
+            if serializer.is_valid():
+                valid.append(serializer.validated_data)
+            else:
+                fail(number, serializer.errors)
+        if valid:
+            report['created'] += len(create_items(owner, valid, archive))
+
+    # bulk_create skips the signals that keep these up to date
+    if report['created']:
+        invalidate_public_responses()
+    return report
+
+
+def export_rows(queryset, file_format):
+    """Yield a CSV or JSONL export of the items line by line, reading them in chunks"""
+    queryset = queryset.select_related('category').prefetch_related('images').order_by('pk')
+
+    class Echo:
+        def write(self, value):
+            return value
+
+    writer = csv.writer(Echo())
+    if file_format == 'csv':
+        yield writer.writerow(EXPORT_FIELDS)
+
+    for item in queryset.iterator(chunk_size=2000):
+        images = [posixpath.basename(image.image.name) for image in item.images.all()]
+        values = {'category': item.category.name, 'created_at': item.created_at.isoformat(), 'images': images}
+        row = {field: values[field] if field in values else getattr(item, field) for field in EXPORT_FIELDS}
+        if file_format == 'csv':
+            row['images'] = IMAGE_SEPARATOR.join(images)
+            yield writer.writerow(row.values())
+        else:
+            yield json.dumps(row) + '\n'
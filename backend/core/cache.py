@@ -0,0 +1,188 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+CATEGORY_VERSION_KEY = 'core:categories:version'
+CATEGORY_DATA_KEY = 'core:categories:{version}'
+
+CATEGORY_DATA_TIMEOUT = 60 * 60 * 24
+
+RESPONSE_VERSION_KEY = 'core:responses:version'
+RESPONSE_DATA_KEY = 'core:responses:{version}:{digest}'
+
+RESPONSE_DEFAULTS = {
+    'ENABLED': True,
+    # Bounds staleness from changes no signal sees, such as a renamed owner
+    'TIMEOUT': 60 * 5,
+}
+
+# Per-process (version, data) copy of the catalogue, trusted while the shared version matches
+_local_catalogue = (None, None)
+
+
+def get_category_catalogue():
+    """Serialized category list, served from process memory or the shared cache.
+
+    The shared cache only holds a version number and the serialized list, so
+    a steady-state request costs one cache lookup and no database queries.
+    """
+    version = cache.get(CATEGORY_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(CATEGORY_VERSION_KEY, version, timeout=None):
+            version = cache.get(CATEGORY_VERSION_KEY, version)
+
+    global _local_catalogue
+    local_version, local_data = _local_catalogue
+    if local_version == version:
+        return local_data
+
+    key = CATEGORY_DATA_KEY.format(version=version)
+    data = cache.get(key)
+    if data is None:
+        from .models import Category
+        from .serializers import CategorySerializer
+
+        data = CategorySerializer(Category.objects.order_by('pk'), many=True).data
+        data = [dict(row) for row in data]
+        cache.set(key, data, timeout=CATEGORY_DATA_TIMEOUT)
+
+    _local_catalogue = (version, data)
+    return data
+
+
+def _bump_category_version():
+    cache.set(CATEGORY_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_category_catalogue():
+    """Drop the cached catalogue now and again once the current transaction commits.
+
+    The second bump covers a request that re-cached the old rows in between.
+    Items embed their category, so cached item responses are dropped as well.
+    """
+    _bump_category_version()
+    transaction.on_commit(_bump_category_version)
+    invalidate_public_responses()
+
+
+# Public item responses
+
+def get_response_config():
+    return {**RESPONSE_DEFAULTS, **getattr(settings, 'REWEAR_RESPONSE_CACHE', {})}
+
+
+def get_response_version():
+    """Current version of the public responses, a time_ns of their last invalidation"""
+    version = cache.get(RESPONSE_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(RESPONSE_VERSION_KEY, version, timeout=None):
+            version = cache.get(RESPONSE_VERSION_KEY, version)
+    return version
+
+
+async def aget_response_version():
+    version = await cache.aget(RESPONSE_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        if not await cache.aadd(RESPONSE_VERSION_KEY, version, timeout=None):
+            version = await cache.aget(RESPONSE_VERSION_KEY, version)
+    return version
+
+
+def _bump_response_version():
+    cache.set(RESPONSE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_public_responses():
+    """Drop every cached public response, now and once the current transaction commits"""
+    _bump_response_version()
+    transaction.on_commit(_bump_response_version)
+
+
+def response_cache_key(request, version):
+    """Cache key of a request: view URL plus its non-empty query params in sorted order"""
+    params = sorted(
+        (name, value) for name, values in request.query_params.lists()
+        for value in values if value != ''
+    )
+    raw = json.dumps([request.build_absolute_uri(request.path), params])
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return RESPONSE_DATA_KEY.format(version=version, digest=digest)
+
+
+def _digest(data):
+    raw = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+class PublicResponseCacheMixin:
+    """Read-through cache for GET responses of public item endpoints.
+
+    Entries are shared by all viewers: the per-user can_swap/can_redeem flags
+    are recomputed on every hit. core.signals invalidates them whenever an
+    item, image or category changes. Responses carry an ETag and a
+    Last-Modified date (the last invalidation), so clients can revalidate
+    and get a 304.
+    """
+
+    def get(self, request, *args, **kwargs):
+        config = get_response_config()
+        if not config['ENABLED'] or request.accepted_renderer.format != 'json':
+            return super().get(request, *args, **kwargs)
+
+        version = get_response_version()
+        key = response_cache_key(request, version)
+        entry = cache.get(key)
+        if entry is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            entry = response_cache_entry(response.data)
+            cache.set(key, entry, timeout=config['TIMEOUT'])
+        return serve_cached_response(request, entry, version, Response)
+
+
+def response_cache_entry(data):
+    return {'data': data, 'etag': _digest(data)}
+
+
+def copy_item_dicts(data):
+    """Copy of cached data with fresh item dicts, all apply_viewer_fields writes to"""
+    def copy_item(item):
+        return dict(item) if isinstance(item, dict) else item
+
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return {**data, 'results': [copy_item(item) for item in data['results']]}
+    if isinstance(data, list):
+        return [copy_item(item) for item in data]
+    return copy_item(data)
+
+
+def serve_cached_response(request, entry, version, response_class):
+    """Response for a cached entry with the viewer's flags, or a 304 when the client's copy is current"""
+    from .serializers import apply_viewer_fields
+
+    data = copy_item_dicts(entry['data'])
+    items = apply_viewer_fields(data, request)
+    flags = [(item.get('can_swap'), item.get('can_redeem')) for item in items]
+    etag = '"%s-%s"' % (entry['etag'], _digest(flags)[:8])
+    last_modified = version // 10 ** 9
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = response_class(data)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ['Authorization', 'Cookie'])
+    return response
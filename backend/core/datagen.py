@@ -0,0 +1,386 @@
+import random
+from array import array
+from bisect import bisect
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import AutoField, DateTimeField, JSONField, Max
+from django.utils import timezone
+
+from .cache import invalidate_public_responses
+from .models import (
+    UserProfile, Category, ClothingItem, SwapRequest, PointsTransaction, Notification, UserInteraction
+)
+from .notifications import build_notification
+from .points import LISTING_POINTS, reconcile_balances
+from .stats import materialized_stats_enabled, rebuild_user_stats
+
+
+WELCOME_POINTS = 50
+
+# Share of the generated users who list items
+SELLER_SHARE = 0.3
+
+# Same catalogue as populate_db
+CATEGORIES = [
+    ('Shirts', 'T-shirts, dress shirts, blouses, and tops'),
+    ('Pants', 'Jeans, trousers, leggings, and pants'),
+    ('Dresses', 'Casual dresses, formal dresses, and gowns'),
+    ('Outerwear', 'Jackets, coats, sweaters, and hoodies'),
+    ('Shoes', 'Sneakers, boots, sandals, and formal shoes'),
+    ('Accessories', 'Bags, belts, hats, and jewelry'),
+    ('Sportswear', 'Athletic wear, gym clothes, and activewear'),
+    ('Formal Wear', 'Business attire, suits, and formal clothing'),
+]
+
+# (value, relative weight) pairs
+TYPES = [('women', 40), ('men', 30), ('unisex', 20), ('kids', 10)]
+SIZES = [('xs', 5), ('s', 20), ('m', 32), ('l', 25), ('xl', 12), ('xxl', 4), ('xxxl', 2)]
+CONDITIONS = [('excellent', 25), ('good', 40), ('fair', 25), ('poor', 10)]
+ITEM_STATUSES = [('available', 70), ('pending', 10), ('in_swap', 5), ('swapped', 10), ('rejected', 5)]
+SWAP_STATUSES = [('pending', 45), ('accepted', 10), ('rejected', 20), ('completed', 20), ('cancelled', 5)]
+INTERACTIONS = [('view', 85), ('like', 10), ('search', 5)]
+CONDITION_POINTS = {'excellent': 30, 'good': 20, 'fair': 12, 'poor': 6}
+
+COLOURS = ['black', 'white', 'navy', 'red', 'green', 'beige', 'grey', 'blue', 'pink', 'olive']
+MATERIALS = ['cotton', 'denim', 'linen', 'wool', 'leather', 'silk', 'polyester', 'cashmere']
+STYLES = ['vintage', 'casual', 'formal', 'sporty', 'classic', 'oversized', 'slim', 'summer']
+GARMENTS = {
+    'Shirts': ['t-shirt', 'blouse', 'shirt', 'tank top'],
+    'Pants': ['jeans', 'trousers', 'chinos', 'leggings'],
+    'Dresses': ['dress', 'maxi dress', 'sundress'],
+    'Outerwear': ['jacket', 'coat', 'hoodie', 'sweater'],
+    'Shoes': ['sneakers', 'boots', 'sandals', 'loafers'],
+    'Accessories': ['handbag', 'belt', 'scarf', 'hat'],
+    'Sportswear': ['running top', 'track pants', 'sports bra'],
+    'Formal Wear': ['blazer', 'suit', 'evening gown'],
+}
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Patel', 'Okafor', 'Novak', 'Silva', 'Kim', 'Murphy', 'Rossi']
+CITIES = ['New York, NY', 'Austin, TX', 'Seattle, WA', 'Chicago, IL', 'Denver, CO', 'Boston, MA']
+
+
+class Sampler:
+    """Draws from a fixed discrete distribution in O(log n)"""
+
+    def __init__(self, rng, pairs):
+        self.rng = rng
+        self.values = [value for value, _ in pairs]
+        self.cumulative = list(accumulate(weight for _, weight in pairs))
+
+    def __call__(self):
+        return self.values[bisect(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+
+def power_law(rng, count, exponent=1.2):
+    """Sampler over range(count) where low indexes are picked far more often, like sellers or bestsellers"""
+    weights = [1 / (rank + 1) ** exponent for rank in range(count)]
+    rng.shuffle(weights)
+    return Sampler(rng, list(zip(range(count), weights)))
+
+
+def seller_count(users, seller_share=SELLER_SHARE):
+    return max(1, int(users * seller_share)) if users else 0
+
+
+def next_id(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+def insert_rows(model, rows):
+    """INSERT dicts of field values with a single executemany.
+
+    Skips model instances and per-value field preparation, which is where
+    bulk_create spends most of its time. Missing fields get their defaults,
+    so rows only name what varies. An auto-incremented primary key the rows
+    leave out is left to the database.
+    """
+    if not rows:
+        return
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not (isinstance(field, AutoField) and field.attname not in rows[0])
+    ]
+    defaults = [field.get_default() for field in fields]
+    names = [field.attname for field in fields]
+    adapt = connection.ops.adapt_datetimefield_value
+    datetimes = {index for index, field in enumerate(fields) if isinstance(field, DateTimeField)}
+    jsons = {index for index, field in enumerate(fields) if isinstance(field, JSONField)}
+
+    def adapt_value(index, value):
+        if index in datetimes and isinstance(value, datetime):
+            return adapt(value)
+        if index in jsons:
+            return fields[index].get_db_prep_value(value, connection)
+        return value
+
+    def values(row):
+        return tuple(
+            adapt_value(index, value)
+            for index, value in enumerate(row.get(name, default) for name, default in zip(names, defaults))
+        )
+
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [values(row) for row in rows])
+
+
+class DataGenerator:
+    """Deterministic synthetic data set written in batches with executemany.
+
+    The same seed and counts produce the same rows. Item owners, item
+    popularity and user activity follow power laws, so a few power sellers
+    and bestsellers dominate as in production. Primary keys are allocated
+    here, which keeps every id in compact arrays for the later passes.
+    """
+
+    def __init__(self, seed=0, batch_size=5000, days=365, seller_share=SELLER_SHARE, log=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.days = days
+        self.seller_share = seller_share
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+        self.user_ids = array('q')
+        self.item_ids = array('q')
+        self.item_owners = array('q')
+        self.available = array('q')
+        # Swaps written, fewer than asked for when the available items ran out of pairs
+        self.swap_count = 0
+
+    def pick(self, pairs):
+        return Sampler(self.rng, pairs)
+
+    def timestamp(self):
+        # Newer rows are more common, the catalogue keeps growing
+        age = self.days * (1 - self.rng.random() ** 0.5)
+        return self.now - timedelta(days=age)
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield start, min(self.batch_size, total - start)
+
+    def categories(self):
+        for name, description in CATEGORIES:
+            Category.objects.get_or_create(name=name, defaults={'description': description})
+        return list(Category.objects.order_by('pk').values_list('pk', 'name'))
+
+    def users(self, count, prefix='user', password='password123'):
+        # Hashing once keeps a million users from costing a million hashes
+        password = make_password(password)
+        first_id = next_id(User)
+        for offset, size in self.batches(count):
+            users, profiles, bonuses = [], [], []
+            for user_id in range(first_id + offset, first_id + offset + size):
+                joined = self.timestamp()
+                users.append({
+                    'id': user_id, 'username': f'{prefix}{user_id}', 'email': f'{prefix}{user_id}@example.com',
+                    'password': password, 'first_name': self.rng.choice(FIRST_NAMES),
+                    'last_name': self.rng.choice(LAST_NAMES), 'date_joined': joined,
+                })
+                profiles.append({
+                    'user_id': user_id, 'location': self.rng.choice(CITIES), 'points_balance': WELCOME_POINTS,
+                    'created_at': joined, 'updated_at': joined,
+                })
+                bonuses.append({
+                    'user_id': user_id, 'transaction_type': 'bonus', 'amount': WELCOME_POINTS,
+                    'description': 'Welcome bonus points', 'created_at': joined,
+                })
+            with transaction.atomic():
+                insert_rows(User, users)
+                insert_rows(UserProfile, profiles)
+                insert_rows(PointsTransaction, bonuses)
+            self.user_ids.extend(range(first_id + offset, first_id + offset + size))
+            self.log(f'Users: {offset + size}/{count}')
+
+    def items(self, count):
+        categories = self.categories()
+        sellers = self.user_ids[:seller_count(len(self.user_ids), self.seller_share)]
+        seller = power_law(self.rng, len(sellers), exponent=0.7)
+        category = power_law(self.rng, len(categories), exponent=0.8)
+        item_type, size, condition, status = (
+            self.pick(TYPES), self.pick(SIZES), self.pick(CONDITIONS), self.pick(ITEM_STATUSES)
+        )
+
+        first_id = next_id(ClothingItem)
+        for offset, batch_size in self.batches(count):
+            items, points = [], []
+            for item_id in range(first_id + offset, first_id + offset + batch_size):
+                category_id, category_name = categories[category()]
+                item_condition, item_status, owner_id = condition(), status(), sellers[seller()]
+                colour, material, style = (
+                    self.rng.choice(COLOURS), self.rng.choice(MATERIALS), self.rng.choice(STYLES)
+                )
+                garment = self.rng.choice(GARMENTS.get(category_name, ['piece']))
+                created_at = self.timestamp()
+                items.append({
+                    'id': item_id, 'title': f'{style.title()} {colour} {material} {garment}',
+                    'description': f'{style.title()} {material} {garment} in {colour}, '
+                                   f'{item_condition} condition. Barely worn, from a smoke-free home.',
+                    'category_id': category_id, 'type': item_type(), 'size': size(),
+                    'condition': item_condition, 'owner_id': owner_id, 'status': item_status,
+                    'points_value': max(1, min(100, CONDITION_POINTS[item_condition] + self.rng.randint(-5, 10))),
+                    'is_available_for_swap': self.rng.random() < 0.9,
+                    'is_available_for_points': self.rng.random() < 0.8,
+                    'tags': ', '.join(self.rng.sample([colour, material, style, garment], 3)),
+                    'created_at': created_at, 'updated_at': created_at,
+                    'approved_at': created_at if item_status != 'pending' else None,
+                })
+                points.append({
+                    'user_id': owner_id, 'transaction_type': 'earned', 'amount': LISTING_POINTS,
+                    'description': 'Points earned for listing an item', 'related_item_id': item_id,
+                    'created_at': created_at,
+                })
+                self.item_ids.append(item_id)
+                self.item_owners.append(owner_id)
+                if item_status == 'available':
+                    self.available.append(len(self.item_ids) - 1)
+            with transaction.atomic():
+                insert_rows(ClothingItem, items)
+                insert_rows(PointsTransaction, points)
+            self.log(f'Items: {offset + batch_size}/{count}')
+
+    def swaps(self, count):
+        """Propose up to count swaps between available items of different owners.
+
+        A pair of items is proposed once, so fewer swaps are written when the
+        available items run out of pairs. Returns how many were written.
+        """
+        owners = Counter(self.item_owners[index] for index in self.available)
+        total = len(self.available)
+        possible = total * (total - 1) - sum(items * (items - 1) for items in owners.values())
+        count = min(count, possible)
+        if not count:
+            return 0
+        status = self.pick(SWAP_STATUSES)
+
+        if count * 2 > possible:
+            # Most pairs are wanted, draw them from the full list rather than retrying collisions
+            chosen = iter(self.rng.sample([
+                (offered, wanted) for wanted in self.available for offered in self.available
+                if self.item_owners[wanted] != self.item_owners[offered]
+            ], count))
+            draw = partial(next, chosen)
+        else:
+            popular = power_law(self.rng, total, exponent=0.9)
+            proposed = set()
+
+            def draw():
+                # At least half of the pairs are still free, so this ends quickly
+                while True:
+                    wanted, offered = self.available[popular()], self.rng.choice(self.available)
+                    if self.item_owners[wanted] != self.item_owners[offered] and (offered, wanted) not in proposed:
+                        proposed.add((offered, wanted))
+                        return offered, wanted
+
+        first_id = next_id(SwapRequest)
+        for offset, size in self.batches(count):
+            swaps = []
+            for swap_id in range(first_id + offset, first_id + offset + size):
+                offered, wanted = draw()
+                created_at, swap_status = self.timestamp(), status()
+                swaps.append({
+                    'id': swap_id, 'requester_item_id': self.item_ids[offered],
+                    'requested_item_id': self.item_ids[wanted], 'requester_id': self.item_owners[offered],
+                    'owner_id': self.item_owners[wanted], 'status': swap_status,
+                    'message': 'Would you swap for this?', 'created_at': created_at, 'updated_at': created_at,
+                    'completed_at': created_at + timedelta(days=3) if swap_status == 'completed' else None,
+                })
+            notifications = self.swap_notifications(swaps)
+            with transaction.atomic():
+                insert_rows(SwapRequest, swaps)
+                insert_rows(Notification, notifications)
+            self.log(f'Swaps: {offset + size}/{count}')
+        return count
+
+    def swap_notifications(self, swaps):
+        """Owner notifications of a batch of swaps, with the payload and group key send_notifications stores"""
+        item_ids = {swap[key] for swap in swaps for key in ('requester_item_id', 'requested_item_id')}
+        user_ids = {swap[key] for swap in swaps for key in ('requester_id', 'owner_id')}
+        # Titles and usernames are not kept in memory, one query each per batch
+        titles = dict(ClothingItem.objects.filter(pk__in=item_ids).values_list('pk', 'title'))
+        usernames = dict(User.objects.filter(pk__in=user_ids).values_list('pk', 'username'))
+
+        notifications = []
+        for swap in swaps:
+            summary = {
+                'id': swap['id'],
+                'requester': {'id': swap['requester_id'], 'username': usernames[swap['requester_id']]},
+                'owner': {'id': swap['owner_id'], 'username': usernames[swap['owner_id']]},
+                'requester_item': {'id': swap['requester_item_id'], 'title': titles[swap['requester_item_id']]},
+                'requested_item': {'id': swap['requested_item_id'], 'title': titles[swap['requested_item_id']]},
+            }
+            notification = build_notification(
+                swap['owner_id'], 'swap_request', 'New Swap Request', 'You have a new swap request', swap=summary
+            )
+            notifications.append({
+                'user_id': notification.user_id, 'notification_type': notification.notification_type,
+                'title': notification.title, 'message': notification.message,
+                'related_swap_id': swap['id'], 'payload': notification.payload, 'group_key': notification.group_key,
+                'is_read': swap['status'] != 'pending', 'created_at': swap['created_at'],
+            })
+        return notifications
+
+    def interactions(self, count):
+        if not self.user_ids or not self.item_ids:
+            return
+        kind = self.pick(INTERACTIONS)
+        user = power_law(self.rng, len(self.user_ids), exponent=0.8)
+        item = power_law(self.rng, len(self.item_ids), exponent=1.0)
+
+        for offset, size in self.batches(count):
+            rows = []
+            for _ in range(size):
+                interaction_type = kind()
+                row = {'user_id': self.user_ids[user()], 'interaction_type': interaction_type,
+                       'created_at': self.timestamp()}
+                if interaction_type == 'search':
+                    row['search_query'] = f'{self.rng.choice(COLOURS)} {self.rng.choice(MATERIALS)}'
+                else:
+                    row['item_id'] = self.item_ids[item()]
+                rows.append(row)
+            # One commit per batch, autocommit would sync every row
+            with transaction.atomic():
+                insert_rows(UserInteraction, rows)
+            self.log(f'Interactions: {offset + size}/{count}')
+
+    def finish(self):
+        """Rebuild what the raw inserts skipped: sequences, balances, counters, stats and cached responses"""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [
+                User, UserProfile, ClothingItem, SwapRequest, PointsTransaction, Notification, UserInteraction,
+            ]):
+                cursor.execute(sql)
+
+        stats_enabled = materialized_stats_enabled()
+        for start in range(0, len(self.user_ids), self.batch_size):
+            batch = self.user_ids[start:start + self.batch_size]
+            # Listing points went straight into the ledger
+            reconcile_balances(batch)
+            if stats_enabled:
+                rebuild_user_stats(batch)
+        Category.objects.all().recount_available_items()
+        invalidate_public_responses()
+
+
+def generate(users=0, items=0, swaps=0, interactions=0, prefix='user', **kwargs):
+    """Generate a data set and return the DataGenerator holding the new ids"""
+    generator = DataGenerator(**kwargs)
+    generator.users(users, prefix=prefix)
+    generator.items(items)
+    generator.swap_count = generator.swaps(swaps)
+    generator.interactions(interactions)
+    generator.finish()
+    return generator
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .models import Notification
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # 'memory' wakes streams of this process only, 'database' also polls for
+    # notifications created by other processes; or a dotted path to a Broker
+    'BACKEND': 'memory',
+    # Seconds between the database backend's polls, one query per process
+    'POLL_INTERVAL': 1.0,
+    # Seconds of silence before a keep-alive comment, so proxies keep the stream open
+    'HEARTBEAT': 15,
+    # Seconds before a stream ends, EventSource reconnects with Last-Event-ID
+    'MAX_DURATION': 300,
+    # Milliseconds EventSource waits before reconnecting
+    'RETRY': 3000,
+    # Notifications read per query when catching up
+    'BATCH_SIZE': 50,
+}
+
+BACKENDS = {
+    'memory': 'core.events.Broker',
+    'database': 'core.events.DatabaseBroker',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_EVENTS', {})}
+
+
+class ThreadSubscription:
+    """Wake-up flag of a stream served by a worker thread"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+
+    def notify(self):
+        self.event.set()
+
+    def wait(self, timeout):
+        woken = self.event.wait(timeout)
+        self.event.clear()
+        return woken
+
+
+class AsyncSubscription:
+    """Wake-up flag of a stream served on an event loop, set from any thread"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # The loop closed under a stream that had not unsubscribed yet
+            pass
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        self.event.clear()
+        return woken
+
+
+class Broker:
+    """In-process fan-out telling a user's open streams that they have new notifications.
+
+    Only the user id travels, streams read the rows themselves after their
+    last delivered id, so a missed or repeated wake-up loses nothing.
+    """
+
+    def __init__(self, config):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, subscription):
+        with self.lock:
+            self.subscriptions[subscription.user_id].add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.user_id]
+
+    def publish(self, user_id):
+        self.deliver(user_id)
+
+    def deliver(self, user_id):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def shutdown(self):
+        pass
+
+
+class DatabaseBroker(Broker):
+    """Broker for several processes: one thread per process polls for new notification rows.
+
+    The thread runs while the process has open streams and costs one indexed
+    query per POLL_INTERVAL however many streams that is. Notifications made
+    by this process still wake streams at once.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.interval = config['POLL_INTERVAL']
+        self.last_id = None
+        self.thread = None
+        self.stopped = False
+
+    def subscribe(self, subscription):
+        super().subscribe(subscription)
+        with self.lock:
+            if self.thread is None and not self.stopped:
+                self.thread = threading.Thread(target=self._run, name='notification-poller', daemon=True)
+                self.thread.start()
+
+    def poll(self):
+        if self.last_id is None:
+            self.last_id = Notification.objects.aggregate(last=Max('pk'))['last'] or 0
+            return
+        rows = list(
+            Notification.objects.filter(pk__gt=self.last_id).order_by('pk').values_list('pk', 'user_id')
+        )
+        if rows:
+            self.last_id = rows[-1][0]
+        for user_id in {user_id for _, user_id in rows}:
+            self.deliver(user_id)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if self.stopped or not self.subscriptions:
+                    self.thread = None
+                    self.last_id = None
+                    break
+            close_old_connections()
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Polling for new notifications failed')
+            time.sleep(self.interval)
+        close_old_connections()
+
+    def shutdown(self):
+        self.stopped = True
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                config = get_config()
+                _broker = import_string(BACKENDS.get(config['BACKEND'], config['BACKEND']))(config)
+    return _broker
+
+
+def reset_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is not None:
+            _broker.shutdown()
+        _broker = None
+
+
+def publish(user_id):
+    """Wake the user's open notification streams, call once the row is committed"""
+    get_broker().publish(user_id)
+
+
+def last_event_id(request):
+    """Id a reconnecting EventSource last received, or ?last_event_id= for the first connection"""
+    value = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def sse(data=None, event=None, event_id=None, retry=None, comment=None):
+    """One Server-Sent Events message, data as a single line of JSON"""
+    lines = []
+    if comment is not None:
+        lines.append(f': {comment}')
+    if retry is not None:
+        lines.append(f'retry: {retry}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    if data is not None:
+        lines.append('data: ' + JSONRenderer().render(data).decode('utf-8'))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def notification_messages(notifications, unread):
+    return [
+        sse({'notification': notification, 'unread_notifications': unread},
+            event='notification', event_id=notification['id'])
+        for notification in notifications
+    ]
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets 'Accept: text/event-stream' through content negotiation, errors go out as an error event"""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse(data, event='error')
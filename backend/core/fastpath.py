@@ -0,0 +1,234 @@
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .images import build_srcset, placeholder_url
+from .metrics import timed
+from .models import ItemImage, split_tags
+from .serializers import (
+    ClothingItemSerializer, ItemImageSerializer, get_user_points, item_can_redeem, item_can_swap,
+    requested_fields
+)
+
+
+DEFAULTS = {
+    # Serve item lists from value tuples instead of ClothingItemSerializer
+    'ENABLED': True,
+}
+
+# Fields whose to_representation hands a database value back unchanged
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField, serializers.CharField, serializers.ChoiceField, serializers.IntegerField,
+)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_FAST_PATH', {})}
+
+
+class RowMapper:
+    """Builds a serializer's output from value tuples, with its field conversions compiled once.
+
+    Each readable field becomes a step reading its columns by position:
+    plain model fields convert one column (most need no conversion at all),
+    nested serializers on a foreign key read theirs from the same row, and
+    fields named in specials, {name: (columns, function)}, get
+    function(state, *values) where state holds the per-request data.
+    Anything else is refused, so a serializer change cannot silently make
+    the output drift.
+    """
+
+    def __init__(self, serializer, specials=None, prefix='', columns=None):
+        self.columns = [] if columns is None else columns
+        self.steps = []
+        specials = specials or {}
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            name = field.field_name
+            if name in specials:
+                names, function = specials[name]
+                step = self.special_step([self.column(prefix + column) for column in names], function)
+            elif isinstance(field, serializers.ModelSerializer):
+                nested = RowMapper(field, prefix=f'{prefix}{field.source}__', columns=self.columns)
+                step = nested.nested_step(self.column(prefix + field.source))
+            elif isinstance(field, PASSTHROUGH_FIELDS) and field.source != '*':
+                step = self.column_step(self.column(prefix + field.source), None)
+            elif isinstance(field, serializers.DateTimeField):
+                step = self.datetime_step(self.column(prefix + field.source), field)
+            else:
+                raise TypeError(f'No fast path for {type(serializer).__name__}.{name}')
+            self.steps.append((name, step))
+
+    def column(self, name):
+        if name not in self.columns:
+            self.columns.append(name)
+        return self.columns.index(name)
+
+    @staticmethod
+    def column_step(index, convert):
+        if convert is None:
+            return lambda row, state: row[index]
+        return lambda row, state: None if row[index] is None else convert(row[index])
+
+    @staticmethod
+    def datetime_step(index, field):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if hasattr(field, 'timezone') or not isinstance(output_format, str) or output_format.lower() != ISO_8601:
+            return RowMapper.column_step(index, field.to_representation)
+
+        def step(row, state):
+            # DateTimeField.to_representation with the time zone looked up once per page
+            value = row[index]
+            if value is None or state['timezone'] is None or not timezone.is_aware(value):
+                return None if value is None else field.to_representation(value)
+            value = value.astimezone(state['timezone']).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return step
+
+    @staticmethod
+    def special_step(indexes, function):
+        return lambda row, state: function(state, *[row[index] for index in indexes])
+
+    def nested_step(self, index):
+        # A null foreign key serializes as None, like a nested serializer does
+        return lambda row, state: None if row[index] is None else self.build(row, state)
+
+    def build(self, row, state):
+        return {name: step(row, state) for name, step in self.steps}
+
+
+def image_url(state, name):
+    if not name:
+        return None
+    url = state['storage'].url(name)
+    request = state['request']
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def image_srcset(state, processing_status, variants):
+    if processing_status != 'ready' or not variants:
+        return {}
+    return build_srcset(variants, lambda name: image_url(state, name))
+
+
+def image_field(state, name, processing_status):
+    # Show a placeholder until the worker pool has resized the upload, as ItemImageSerializer does
+    if processing_status != 'ready':
+        return placeholder_url(state['request'])
+    return image_url(state, name)
+
+
+def viewer_can_swap(state, item_status, for_swap, owner_id):
+    user = state['user']
+    return user is not None and item_can_swap(item_status, for_swap, owner_id, user.id)
+
+
+def viewer_can_redeem(state, item_status, for_points, owner_id, points_value):
+    user = state['user']
+    return user is not None and item_can_redeem(
+        item_status, for_points, owner_id, points_value, user.id, state['user_points'] or 0
+    )
+
+
+class ItemRows:
+    """ClothingItemSerializer output for a page of items, built from value tuples.
+
+    The page is fetched with values_list() and images with one more query,
+    the same two queries as select_related plus prefetch_related, but no
+    model instances or per-field serializer calls. Rows are named tuples
+    so keyset pagination can read created_at and pk off them.
+    """
+    _mappers = None
+
+    def __init__(self, request):
+        self.request = request
+        self.item_mapper, self.image_mapper = self.get_mappers()
+
+    @classmethod
+    def get_mappers(cls):
+        if cls._mappers is None:
+            item_mapper = RowMapper(ClothingItemSerializer(), {
+                'tags_list': (('tags',), lambda state, tags: split_tags(tags)),
+                'images': (('id',), lambda state, pk: state['images'].get(pk, [])),
+                'can_swap': (('status', 'is_available_for_swap', 'owner_id'), viewer_can_swap),
+                'can_redeem': (
+                    ('status', 'is_available_for_points', 'owner_id', 'points_value'), viewer_can_redeem
+                ),
+            }, columns=['pk', 'created_at'])
+            image_mapper = RowMapper(ItemImageSerializer(), {
+                'image': (('image', 'processing_status'), image_field),
+                'srcset': (('processing_status', 'variants'), image_srcset),
+            }, columns=['item_id'])
+            cls._mappers = (item_mapper, image_mapper)
+        return cls._mappers
+
+    def values(self, queryset):
+        """queryset as the named value tuples the mapper reads, for the paginator to slice"""
+        return queryset.select_related(None).prefetch_related(None).values_list(
+            *self.item_mapper.columns, named=True
+        )
+
+    def images(self, item_ids):
+        return ItemImage.objects.filter(item_id__in=item_ids).values_list(*self.image_mapper.columns)
+
+    def state(self):
+        user = self.request.user
+        authenticated = user.is_authenticated
+        context = {'request': self.request}
+        return {
+            'request': self.request,
+            'user': user if authenticated else None,
+            'user_points': get_user_points(context) if authenticated else None,
+            'storage': ItemImage._meta.get_field('image').storage,
+            'timezone': timezone.get_current_timezone() if settings.USE_TZ else None,
+        }
+
+    @timed('serializer_time')
+    def build(self, rows, image_rows):
+        state = self.state()
+        images = {}
+        for row in image_rows:
+            images.setdefault(row[0], []).append(self.image_mapper.build(row, state))
+        state['images'] = images
+        return [self.item_mapper.build(row, state) for row in rows]
+
+    def serialize(self, rows):
+        rows = list(rows)
+        image_rows = self.images([row.pk for row in rows]) if rows else []
+        return self.build(rows, image_rows)
+
+    async def aserialize(self, rows):
+        rows = list(rows)
+        image_rows = [row async for row in self.images([row.pk for row in rows])] if rows else []
+        return self.build(rows, image_rows)
+
+
+def item_rows(request):
+    """ItemRows for a request the fast path serves, None when it needs ClothingItemSerializer.
+
+    That is when the fast path is off, the client picked ?fields=, or the
+    response is not JSON (the public response cache only covers JSON).
+    """
+    if not get_config()['ENABLED'] or requested_fields(request) is not None:
+        return None
+    if request.accepted_renderer.format != 'json':
+        return None
+    return ItemRows(request)
+
+
+class FastItemListMixin:
+    """List action of a ClothingItemSerializer view, served by ItemRows when it can be"""
+
+    def list(self, request, *args, **kwargs):
+        rows = item_rows(request)
+        if rows is None:
+            return super().list(request, *args, **kwargs)
+        queryset = rows.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(rows.serialize(page))
+        return Response(rows.serialize(queryset))
+
@@ -0,0 +1,180 @@
+import io
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.templatetags.static import static
+from PIL import Image, features
+
+from .cache import invalidate_public_responses
+from .models import ItemImage
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # 'thread' resizes on an in-process pool, 'queue' leaves images pending
+    # for the process_images worker, 'sync' resizes in the calling thread
+    'BACKEND': 'thread',
+    'WORKERS': 4,
+    'MAX_SIZE': 800,
+    'PLACEHOLDER': 'core/item-placeholder.svg',
+    # Responsive copies, widths in pixels; formats Pillow cannot encode are skipped
+    'VARIANT_WIDTHS': [160, 400, 800],
+    'VARIANT_FORMATS': ['webp', 'jpeg'],
+    'VARIANT_QUALITY': 80,
+}
+
+VARIANT_FORMATS = {
+    # format: (Pillow plugin, Pillow feature, file extension, MIME type)
+    'avif': ('AVIF', 'avif', 'avif', 'image/avif'),
+    'webp': ('WEBP', 'webp', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'jpg', 'image/jpeg'),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_IMAGE_PROCESSING', {})}
+
+
+def placeholder_url(request=None):
+    """URL served in place of an image that is still being processed"""
+    url = static(get_config()['PLACEHOLDER'])
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def variant_widths(source_width, widths):
+    """Configured widths below the source width, plus one copy at the source width (capped)"""
+    return sorted({width for width in widths if width < source_width} | {min(source_width, max(widths))})
+
+
+def build_variants(item_image, img, config):
+    """Write resized copies of an image in every configured format, returning their metadata"""
+    storage = item_image.image.storage
+    stem = posixpath.splitext(posixpath.basename(item_image.image.name))[0]
+    formats = [name for name in config['VARIANT_FORMATS'] if features.check(VARIANT_FORMATS[name][1])]
+
+    variants = []
+    for width in variant_widths(img.width, config['VARIANT_WIDTHS']):
+        height = max(1, round(img.height * width / img.width))
+        resized = img if width == img.width else img.resize((width, height), Image.Resampling.LANCZOS)
+
+        for name in formats:
+            plugin, _, extension, _ = VARIANT_FORMATS[name]
+            frame = resized
+            if plugin == 'JPEG' and frame.mode not in ('RGB', 'L'):
+                frame = frame.convert('RGB')
+            buffer = io.BytesIO()
+            frame.save(buffer, plugin, quality=config['VARIANT_QUALITY'])
+            path = storage.save(
+                f'item_images/variants/{stem}-{width}w.{extension}', ContentFile(buffer.getvalue())
+            )
+            variants.append({'name': path, 'width': width, 'height': height, 'format': name})
+    return variants
+
+
+def delete_image_files(storage, names):
+    """Remove stored image files; ones already gone are skipped"""
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning('Could not delete image file %s', name, exc_info=True)
+
+
+def build_srcset(variants, url_for):
+    """Group variants into {mime type: 'url 160w, url 400w'} for <picture>/<source srcset>"""
+    srcset = {}
+    for variant in sorted(variants, key=lambda variant: variant['width']):
+        mime = VARIANT_FORMATS[variant['format']][3]
+        entry = f"{url_for(variant['name'])} {variant['width']}w"
+        srcset[mime] = f'{srcset[mime]}, {entry}' if mime in srcset else entry
+    return srcset
+
+
+def difference_hash(img):
+    """64-bit dHash: whether each pixel of a 9x8 greyscale thumbnail is brighter than its right neighbour.
+
+    Survives resizing, recompression and small colour changes, so a reposted
+    photo lands within a few bits of the original.
+    """
+    pixels = img.convert('L').resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    value = 0
+    for row in range(0, 72, 9):
+        for left, right in zip(pixels[row:row + 8], pixels[row + 1:row + 9]):
+            value = value << 1 | (left > right)
+    return value
+
+
+def process_item_image(image_id):
+    """Resize one uploaded image in place, write its variants and mark it ready (or failed)"""
+    config = get_config()
+    max_size = config['MAX_SIZE']
+    try:
+        item_image = ItemImage.objects.get(pk=image_id)
+    except ItemImage.DoesNotExist:
+        return None
+
+    # Reprocessing replaces the previous variants instead of piling up copies
+    delete_image_files(item_image.image.storage, [variant['name'] for variant in item_image.variants])
+    variants = []
+    image_hash = ''
+    try:
+        with Image.open(item_image.image.path) as img:
+            if img.height > max_size or img.width > max_size:
+                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+                img.save(item_image.image.path)
+            img.load()
+            variants = build_variants(item_image, img, config)
+            image_hash = f'{difference_hash(img):016x}'
+        status = 'ready'
+    except Exception:
+        logger.exception('Could not process item image %s', image_id)
+        status = 'failed'
+
+    # update() so a concurrent edit of the row is not overwritten
+    ItemImage.objects.filter(pk=image_id).update(processing_status=status, variants=variants, image_hash=image_hash)
+    invalidate_public_responses()
+
+    # The item's last image to finish triggers its pre-moderation triage
+    from .triage import run_triage
+    run_triage(item_image.item_id)
+    return status
+
+
+def _process_in_worker(image_id):
+    close_old_connections()
+    try:
+        return process_item_image(image_id)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_config()['WORKERS'], thread_name_prefix='item-images'
+                )
+    return _executor
+
+
+def enqueue_image_processing(*image_ids):
+    """Hand uploaded images to the configured worker; each image runs in parallel"""
+    backend = get_config()['BACKEND']
+    if backend == 'queue':
+        return
+    for image_id in image_ids:
+        if backend == 'sync':
+            process_item_image(image_id)
+        else:
+            get_executor().submit(_process_in_worker, image_id)
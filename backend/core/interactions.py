@@ -0,0 +1,279 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, close_old_connections
+from django.utils import timezone
+
+from .models import ClothingItem, UserInteraction
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # 'memory' buffers in process and flushes from a background thread,
+    # 'spool' appends to SPOOL_PATH for the flush_interactions worker,
+    # 'sync' writes inside the request like before
+    'BACKEND': 'memory',
+    'MAX_EVENTS': 500,
+    'MAX_DELAY': 2.0,
+    'SPOOL_PATH': None,
+    # Failed drains of one spool file before flush_interactions moves it
+    # aside as <file>.failed, so it stops blocking the rest of the spool
+    'MAX_ATTEMPTS': 5,
+}
+
+InteractionEvent = namedtuple(
+    'InteractionEvent', ['user_id', 'interaction_type', 'item_id', 'search_query', 'created_at']
+)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_INTERACTIONS', {})}
+
+
+def write_events(events, batch_size=500):
+    """Insert interaction events with bulk_create, returns how many were written.
+
+    Events of a user or item deleted since they were recorded would fail the
+    whole batch, so on an integrity error they are dropped and the rest
+    inserted again. Call it outside a transaction, the failed insert rolls
+    back on its own.
+    """
+    rows = [
+        UserInteraction(
+            user_id=event.user_id,
+            interaction_type=event.interaction_type,
+            item_id=event.item_id,
+            search_query=event.search_query,
+            created_at=event.created_at,
+        )
+        for event in events
+    ]
+    try:
+        UserInteraction.objects.bulk_create(rows, batch_size=batch_size)
+    except IntegrityError:
+        users = set(User.objects.filter(pk__in={row.user_id for row in rows}).values_list('pk', flat=True))
+        items = set(ClothingItem.objects.filter(
+            pk__in={row.item_id for row in rows if row.item_id is not None}
+        ).values_list('pk', flat=True))
+        kept = [row for row in rows if row.user_id in users and (row.item_id is None or row.item_id in items)]
+        logger.warning('Dropped %d interaction events of deleted users or items', len(rows) - len(kept))
+        UserInteraction.objects.bulk_create(kept, batch_size=batch_size)
+        rows = kept
+    return len(rows)
+
+
+class InteractionSpool:
+    """Append-only JSON lines file of pending events, drained by flush_interactions"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+
+    def append(self, events):
+        lines = ''.join(
+            json.dumps([
+                event.user_id, event.interaction_type, event.item_id,
+                event.search_query, event.created_at.isoformat(),
+            ]) + '\n'
+            for event in events
+        )
+        # O_APPEND keeps lines from concurrent processes whole
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, lines.encode('utf-8'))
+            finally:
+                os.close(fd)
+
+    def claim(self):
+        """Move the spool aside for processing and return every claimed file"""
+        directory, name = os.path.split(self.path)
+        directory = directory or '.'
+        if os.path.exists(self.path):
+            claimed = f'{self.path}.{os.getpid()}.{timezone.now():%Y%m%d%H%M%S%f}.work'
+            os.replace(self.path, claimed)
+        return sorted(
+            os.path.join(directory, entry) for entry in os.listdir(directory)
+            if entry.startswith(name + '.') and entry.endswith('.work')
+        )
+
+    @staticmethod
+    def read(path, chunk_size, skip=0):
+        """Yield lists of events from a claimed spool file, after the first skip events"""
+        chunk = []
+        with open(path, encoding='utf-8') as spool:
+            for line in spool:
+                if not line.strip():
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                user_id, interaction_type, item_id, search_query, created_at = json.loads(line)
+                chunk.append(InteractionEvent(
+                    user_id, interaction_type, item_id, search_query,
+                    datetime.fromisoformat(created_at),
+                ))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    # How far the drain of a claimed file got, in <file>.progress next to it:
+    # {'written': events already inserted, 'attempts': failed drains}
+
+    @staticmethod
+    def load_progress(path):
+        try:
+            with open(f'{path}.progress', encoding='utf-8') as progress:
+                return json.load(progress)
+        except FileNotFoundError:
+            return {'written': 0, 'attempts': 0}
+
+    @staticmethod
+    def save_progress(path, progress):
+        temporary = f'{path}.progress.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(progress, file)
+        os.replace(temporary, f'{path}.progress')
+
+    @staticmethod
+    def finish(path):
+        """Remove a claimed file whose events are all written"""
+        os.remove(path)
+        if os.path.exists(f'{path}.progress'):
+            os.remove(f'{path}.progress')
+
+    @staticmethod
+    def quarantine(path):
+        """Move a claimed file that keeps failing to <file>.failed, with its progress, and return the new path"""
+        failed = path[:-len('.work')] + '.failed'
+        os.replace(path, failed)
+        if os.path.exists(f'{path}.progress'):
+            os.replace(f'{path}.progress', f'{failed}.progress')
+        return failed
+
+
+class InteractionBuffer:
+    """In-memory event queue flushed by a background thread.
+
+    A flush happens when MAX_EVENTS are queued or MAX_DELAY seconds have
+    passed, and once more at interpreter exit. Events that cannot be written
+    go to the spool file when one is configured so nothing is dropped.
+    """
+
+    def __init__(self, max_events, max_delay, spool=None):
+        self.max_events = max_events
+        self.max_delay = max_delay
+        self.spool = spool
+        self._events = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, event):
+        with self._lock:
+            self._events.append(event)
+            full = len(self._events) >= self.max_events
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(
+                    target=self._run, name='interaction-flusher', daemon=True
+                )
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def __len__(self):
+        return len(self._events)
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            write_events(events, batch_size=self.max_events)
+        except Exception:
+            if self.spool is None:
+                logger.exception('Dropped %d interaction events', len(events))
+                raise
+            logger.exception('Spooling %d interaction events after a failed flush', len(events))
+            self.spool.append(events)
+        return len(events)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                pass
+        close_old_connections()
+
+    def shutdown(self):
+        """Stop the flusher thread and write whatever is still queued"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.max_delay + 5)
+        self.flush()
+
+
+_buffer = None
+_spool = None
+_setup_lock = threading.Lock()
+
+
+def get_spool(config=None):
+    global _spool
+    config = config or get_config()
+    path = config['SPOOL_PATH']
+    if path is None:
+        return None
+    if _spool is None or _spool.path != str(path):
+        _spool = InteractionSpool(path)
+    return _spool
+
+
+def get_buffer(config=None):
+    global _buffer
+    if _buffer is None:
+        config = config or get_config()
+        with _setup_lock:
+            if _buffer is None:
+                _buffer = InteractionBuffer(
+                    config['MAX_EVENTS'], config['MAX_DELAY'], spool=get_spool(config)
+                )
+                atexit.register(_buffer.shutdown)
+    return _buffer
+
+
+def record_interaction(user, interaction_type, item=None, search_query='', item_id=None):
+    """Queue a UserInteraction for a batched write instead of inserting it in the request"""
+    if item is not None:
+        item_id = item.id
+    event = InteractionEvent(user.id, interaction_type, item_id, search_query[:200], timezone.now())
+    config = get_config()
+    backend = config['BACKEND']
+
+    if backend == 'sync':
+        write_events([event])
+    elif backend == 'spool':
+        spool = get_spool(config)
+        if spool is None:
+            raise ImproperlyConfigured("REWEAR_INTERACTIONS['SPOOL_PATH'] is required for the spool backend")
+        spool.append([event])
+    else:
+        get_buffer(config).add(event)
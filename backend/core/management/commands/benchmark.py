@@ -0,0 +1,85 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+)
+
+from core.benchmark import SCENARIOS, check_budgets, compare_fast_path, load_budgets, run_benchmarks
+from core.datagen import generate
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every core endpoint in process against a generated data set and '
+            'fail when latency, query or memory budgets are exceeded')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--items', type=int, default=5000)
+        parser.add_argument('--swaps', type=int, default=1000)
+        parser.add_argument('--interactions', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--only', nargs='+', metavar='NAME', help='Route names to benchmark')
+        parser.add_argument('--budgets', help='JSON file of {route: {metric: limit}} overriding the defaults')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep cached responses between requests instead of measuring the uncached path')
+        parser.add_argument('--compare-fast-path', action='store_true',
+                            help='Also time item pages with the item fast path off and on')
+        parser.add_argument('--existing-db', action='store_true',
+                            help='Use the configured database as it is instead of a generated test database')
+
+    def handle(self, *args, **options):
+        names = set(options['only'] or ())
+        unknown = names - {scenario.name for scenario in SCENARIOS}
+        if unknown:
+            raise CommandError(f'Unknown routes: {", ".join(sorted(unknown))}')
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+        budgets = load_budgets(options['budgets'])
+
+        setup_test_environment()
+        old_config = None
+        try:
+            if not options['existing_db']:
+                old_config = setup_databases(verbosity=0, interactive=False)
+                generate(
+                    users=options['users'], items=options['items'], swaps=options['swaps'],
+                    interactions=options['interactions'], seed=options['seed'],
+                )
+            results = run_benchmarks(
+                iterations=options['iterations'], names=names, warm_cache=options['warm_cache']
+            )
+            fast_path = compare_fast_path(options['iterations']) if options['compare_fast_path'] else None
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        failures = check_budgets(results, budgets)
+        report = {
+            'python': platform.python_version(),
+            'dataset': None if options['existing_db'] else {
+                key: options[key] for key in ('users', 'items', 'swaps', 'interactions', 'seed')
+            },
+            'iterations': options['iterations'],
+            'warm_cache': options['warm_cache'],
+            'results': results,
+            'budgets': {name: budgets.get(name, {}) for name in results},
+            'failures': failures,
+        }
+        if fast_path is not None:
+            report['fast_path'] = fast_path
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as target:
+                target.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f'{len(failures)} budget failures')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.recommendations import build_model, get_config
+
+
+class Command(BaseCommand):
+    help = 'Build the item co-occurrence model behind /api/recommendations/ from all interactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="Model file, defaults to REWEAR_RECOMMENDATIONS['MODEL_PATH']")
+
+    def handle(self, *args, **options):
+        path = options['output'] or get_config()['MODEL_PATH']
+        if not path:
+            raise CommandError("Set REWEAR_RECOMMENDATIONS['MODEL_PATH'] or pass --output")
+
+        started = time.monotonic()
+        model = build_model()
+        model.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Built a model of {len(model.item_counts)} items and {len(model.history)} users '
+            f'from interactions up to #{model.last_id} in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,104 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core import views
+
+
+# Table scans as reported by SQLite's EXPLAIN QUERY PLAN and Postgres' EXPLAIN.
+# SQLite reports index-driven full scans and FTS lookups as SCAN too, those are fine.
+SQLITE_SCAN_RE = re.compile(r'\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX| VIRTUAL TABLE)')
+POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+TEMP_SORT_RE = re.compile(r'USE TEMP B-TREE FOR ORDER BY|Sort Key')
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the querysets behind each list view and flag sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to build per-user querysets for')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print full query plans')
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error if any sequential scan is found')
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        user = User.objects.order_by('-is_staff', 'id').first()
+        # Querysets only need a primary key to be built, not a saved row
+        return user or User(id=0, is_staff=True)
+
+    def view_queryset(self, view_class, user, params=None):
+        factory = APIRequestFactory()
+        request = Request(factory.get('/', params or {}))
+        request.user = user
+
+        view = view_class()
+        view.request = request
+        view.args = ()
+        view.kwargs = {}
+        view.format_kwarg = None
+        return view.filter_queryset(view.get_queryset())
+
+    def get_querysets(self, user):
+        """(label, queryset) pairs for the hot query shapes of core.views"""
+        yield 'ClothingItemListView', self.view_queryset(views.ClothingItemListView, user)
+        yield 'ClothingItemListView facets', self.view_queryset(
+            views.ClothingItemListView, user, {'category': 1, 'type': 'women', 'size': 'm'}
+        )
+        yield 'ClothingItemListView search', self.view_queryset(
+            views.ClothingItemListView, user, {'search': 'denim'}
+        )
+        yield 'FeaturedItemsView', self.view_queryset(views.FeaturedItemsView, user)
+        yield 'search_items', views.get_search_queryset({'q': 'denim', 'size': 'm'})
+        yield 'MyItemsView', self.view_queryset(views.MyItemsView, user)
+        yield 'AdminItemModerationView', self.view_queryset(views.AdminItemModerationView, user)
+        yield 'SwapRequestListView sent', self.view_queryset(
+            views.SwapRequestListView, user, {'type': 'sent'}
+        )
+        yield 'SwapRequestListView received', self.view_queryset(
+            views.SwapRequestListView, user, {'type': 'received'}
+        )
+        yield 'SwapRequestListView all', self.view_queryset(views.SwapRequestListView, user)
+        yield 'PointsTransactionListView', self.view_queryset(views.PointsTransactionListView, user)
+        yield 'NotificationListView', self.view_queryset(views.NotificationListView, user)
+        yield 'DashboardStatsView pending swaps', user.received_swap_requests.filter(status='pending')
+        yield 'DashboardStatsView unread notifications', user.notifications.filter(is_read=False)
+
+    def find_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return POSTGRES_SCAN_RE.findall(plan)
+        return SQLITE_SCAN_RE.findall(plan)
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        flagged = 0
+
+        for label, queryset in self.get_querysets(user):
+            plan = queryset.explain()
+            scans = self.find_scans(plan)
+
+            if scans:
+                flagged += 1
+                self.stdout.write(self.style.ERROR(
+                    f'SCAN  {label}: sequential scan on {", ".join(sorted(set(scans)))}'
+                ))
+            elif TEMP_SORT_RE.search(plan):
+                self.stdout.write(self.style.WARNING(f'SORT  {label}: indexed, but sorts in memory'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'OK    {label}'))
+
+            if options['verbose_plans']:
+                self.stdout.write(plan)
+                self.stdout.write('')
+
+        if flagged and options['fail_on_scan']:
+            raise CommandError(f'{flagged} queryset(s) use sequential scans')
+        self.stdout.write(f'{flagged} queryset(s) with sequential scans')
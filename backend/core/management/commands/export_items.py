@@ -0,0 +1,31 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bulk import export_rows
+from core.models import ClothingItem
+
+
+class Command(BaseCommand):
+    help = 'Stream items to a CSV or JSONL file without loading the table into memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default=None, help='Only export items owned by this username')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--output', default=None, help='Output file, defaults to stdout')
+
+    def handle(self, *args, **options):
+        queryset = ClothingItem.objects.all()
+        if options['user']:
+            if not User.objects.filter(username=options['user']).exists():
+                raise CommandError(f"User {options['user']} does not exist")
+            queryset = queryset.filter(owner__username=options['user'])
+
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for line in export_rows(queryset, options['format']):
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,44 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.matching import MatchIndex
+
+
+class Command(BaseCommand):
+    help = 'Find mutual swap pairs and three-way swap cycles across every available item'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Write matches as JSON lines to this file')
+        parser.add_argument('--min-score', type=float, default=0, help='Skip weaker matches')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        index = MatchIndex.build()
+        self.stdout.write(
+            f'Indexed {len(index.items)} items of {len(index.owners)} owners '
+            f'in {time.monotonic() - started:.1f}s'
+        )
+
+        counts = {'pair': 0, 'cycle': 0}
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else None
+        try:
+            for match in index.all_matches():
+                if match.score < options['min_score']:
+                    continue
+                counts[match.kind] += 1
+                if output:
+                    output.write(json.dumps({
+                        'type': match.kind,
+                        'score': match.score,
+                        'legs': [leg._asdict() for leg in match.legs],
+                    }) + '\n')
+        finally:
+            if output:
+                output.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Found {counts['pair']} pairs and {counts['cycle']} cycles "
+            f'in {time.monotonic() - started:.1f}s'
+        ))
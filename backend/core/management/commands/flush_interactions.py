@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import InterfaceError, OperationalError
+
+from core.interactions import get_config, get_spool, write_events
+
+
+class Command(BaseCommand):
+    help = (
+        'Write spooled user interaction events to the database with bulk_create. '
+        'Run a single worker per spool file. Progress is kept per chunk, so a retry only '
+        'repeats the chunk in flight if the worker died mid-write. Files that keep failing '
+        'are moved aside as .failed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep draining the spool')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds between drains in --loop mode (default MAX_DELAY)')
+
+    def drain(self, spool, chunk_size, max_attempts):
+        written = 0
+        for path in spool.claim():
+            progress = spool.load_progress(path)
+            try:
+                for events in spool.read(path, chunk_size, skip=progress['written']):
+                    written += write_events(events, batch_size=chunk_size)
+                    # A retry starts after the chunks already in the database
+                    progress['written'] += len(events)
+                    spool.save_progress(path, progress)
+            except (OperationalError, InterfaceError) as exc:
+                # The database is unreachable, not the file at fault: try again next drain
+                self.stderr.write(f'Could not write {path}: {exc}')
+                break
+            except Exception as exc:
+                progress['attempts'] += 1
+                if progress['attempts'] >= max_attempts:
+                    failed = spool.quarantine(path)
+                    self.stderr.write(f'Moved {path} to {failed} after {progress["attempts"]} failed drains: {exc}')
+                else:
+                    spool.save_progress(path, progress)
+                    self.stderr.write(f'Could not write {path}, attempt {progress["attempts"]}: {exc}')
+                continue
+            spool.finish(path)
+        return written
+
+    def handle(self, *args, **options):
+        config = get_config()
+        spool = get_spool(config)
+        if spool is None:
+            raise CommandError("REWEAR_INTERACTIONS['SPOOL_PATH'] is not configured")
+
+        interval = options['interval'] or config['MAX_DELAY']
+        while True:
+            written = self.drain(spool, config['MAX_EVENTS'], config['MAX_ATTEMPTS'])
+            if written or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Wrote {written} interaction events'))
+            if not options['loop']:
+                break
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                # Graceful stop: one last drain so nothing claimed is left behind
+                self.drain(spool, config['MAX_EVENTS'], config['MAX_ATTEMPTS'])
+                break
@@ -0,0 +1,58 @@
+import math
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.datagen import SELLER_SHARE, generate, seller_count
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic data set at production scale for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--swaps', type=int, default=2000)
+        parser.add_argument('--interactions', type=int, default=50000)
+        parser.add_argument('--seed', type=int, default=0, help='Same seed, same data set')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--days', type=int, default=365, help='Spread timestamps over this many past days')
+        parser.add_argument('--prefix', default='user', help='Username prefix for the generated users')
+
+    def handle(self, *args, **options):
+        if options['items'] and not options['users']:
+            raise CommandError('Items need owners, pass --users as well')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        for name in ('users', 'items', 'swaps', 'interactions'):
+            if options[name] < 0:
+                raise CommandError(f'--{name} cannot be negative')
+        if options['swaps']:
+            # Swaps pair available items of two different sellers, each pair once
+            if seller_count(options['users']) < 2:
+                raise CommandError(
+                    f"Swaps need two sellers, but only {seller_count(options['users'])} of "
+                    f"{options['users']} users list items. Pass --users {math.ceil(2 / SELLER_SHARE)} or more"
+                )
+            if options['swaps'] > options['items'] * (options['items'] - 1):
+                raise CommandError(f"{options['items']} items cannot make {options['swaps']} distinct swaps")
+        if options['interactions'] and not (options['users'] and options['items']):
+            raise CommandError('Interactions need users and items, pass --users and --items as well')
+
+        started = time.monotonic()
+        verbose = options['verbosity'] > 1
+        generator = generate(
+            users=options['users'], items=options['items'], swaps=options['swaps'],
+            interactions=options['interactions'], prefix=options['prefix'], seed=options['seed'],
+            batch_size=options['batch_size'], days=options['days'],
+            log=self.stdout.write if verbose else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['users']} users, {options['items']} items, {generator.swap_count} swaps "
+            f"and {options['interactions']} interactions in {time.monotonic() - started:.1f}s"
+        ))
+        if generator.swap_count < options['swaps']:
+            self.stderr.write(self.style.WARNING(
+                f"Only {generator.swap_count} of {options['swaps']} swaps were written, "
+                'the available items ran out of pairs of different owners'
+            ))
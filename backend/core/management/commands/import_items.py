@@ -0,0 +1,44 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bulk import ImageArchive, InvalidArchive, detect_format, import_items
+
+
+class Command(BaseCommand):
+    help = 'Import items for one user from a CSV or JSONL file and an optional zip of images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV or JSONL file of items')
+        parser.add_argument('--user', required=True, help='Username that will own the items')
+        parser.add_argument('--images', default=None, help='Zip archive of the images the rows name')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows validated and inserted together')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+        file_format = detect_format(options['file'], options['format'])
+        if file_format is None:
+            raise CommandError('Pass --format csv or --format jsonl')
+
+        archive_file = open(options['images'], 'rb') if options['images'] else None
+        try:
+            archive = ImageArchive(archive_file) if archive_file else None
+            with open(options['file'], 'rb') as stream:
+                report = import_items(owner, stream, file_format, archive=archive,
+                                      chunk_size=options['chunk_size'])
+        except InvalidArchive as exc:
+            raise CommandError(f'Invalid image archive: {exc}')
+        finally:
+            if archive_file:
+                archive_file.close()
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']}: {json.dumps(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['created']} items, {report['failed']} rows failed"
+        ))
@@ -0,0 +1,56 @@
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.images import _process_in_worker, get_config, process_item_image
+from core.models import ItemImage
+
+
+class Command(BaseCommand):
+    help = 'Resize pending item images and write their variants on a worker pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Parallel workers')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry failed images')
+        parser.add_argument('--missing-variants', action='store_true',
+                            help='Also reprocess ready images that have no variants yet')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new images')
+        parser.add_argument('--interval', type=float, default=2.0, help='Polling interval in seconds')
+
+    def handle(self, *args, **options):
+        statuses = ['pending', 'failed'] if options['retry_failed'] else ['pending']
+        todo = Q(processing_status__in=statuses)
+        if options['missing_variants']:
+            todo |= Q(processing_status='ready', variants=[])
+        workers = options['workers'] or get_config()['WORKERS']
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='item-images') as pool:
+            # A single worker runs inline, on this thread's database connection
+            if workers > 1:
+                run = partial(pool.map, _process_in_worker)
+            else:
+                run = partial(map, process_item_image)
+            # Each pass walks the matching images once in pk order, so images
+            # that fail again or end up without variants are not picked twice
+            last_pk = 0
+            while True:
+                image_ids = list(
+                    ItemImage.objects.filter(todo, pk__gt=last_pk)
+                    .order_by('pk').values_list('pk', flat=True)[:workers * 50]
+                )
+                if image_ids:
+                    results = list(run(image_ids))
+                    last_pk = image_ids[-1]
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Processed {results.count("ready")} images, {results.count("failed")} failed'
+                    ))
+                    continue
+                if not options['loop']:
+                    break
+                # Backfilling variants is a one-off pass, later polls only pick up new uploads
+                todo = Q(processing_status='pending')
+                last_pk = 0
+                time.sleep(options['interval'])
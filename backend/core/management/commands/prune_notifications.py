@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.notifications import prune_notifications
+
+
+class Command(BaseCommand):
+    help = 'Delete read notifications older than the retention period, a chunk per transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Keep read notifications this many days (default RETENTION_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rows deleted per transaction')
+        parser.add_argument('--archive', default=None,
+                            help='Append the deleted rows to this file as JSON lines first')
+
+    def handle(self, *args, **options):
+        archive = open(options['archive'], 'a', encoding='utf-8') if options['archive'] else None
+        try:
+            deleted = prune_notifications(options['days'], options['chunk_size'], archive)
+        finally:
+            if archive:
+                archive.close()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} read notifications'))
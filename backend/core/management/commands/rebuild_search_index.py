@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for clothing items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        vendor = connections[using].vendor
+
+        if vendor == 'sqlite':
+            install_search_index(using, rebuild=True)
+            self.stdout.write(self.style.SUCCESS('Rebuilt SQLite FTS5 search index'))
+        elif vendor == 'postgresql':
+            # The GIN index is an expression index that Postgres maintains itself
+            with connections[using].cursor() as cursor:
+                cursor.execute('REINDEX INDEX core_clothingitem_search_gin')
+            self.stdout.write(self.style.SUCCESS('Reindexed Postgres search index'))
+        else:
+            self.stdout.write(
+                self.style.WARNING(f'No full-text index for the {vendor} backend, nothing to do')
+            )
@@ -0,0 +1,27 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from core.stats import rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized dashboard stats rows for every user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Users per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+        total = 0
+        last_id = 0
+
+        while True:
+            batch = list(user_ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            total += rebuild_user_stats(batch)
+            last_id = batch[-1]
+            self.stdout.write(f'Rebuilt stats for {total} users')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {total} users'))
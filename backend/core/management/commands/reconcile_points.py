@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from core.points import find_balance_drift, reconcile_balances
+
+
+class Command(BaseCommand):
+    help = 'Recompute every points balance from the PointsTransaction ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Users per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Only report balances that drifted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = User.objects.filter(profile__isnull=False).order_by('pk').values_list('pk', flat=True)
+        drifted = 0
+        last_id = 0
+
+        while True:
+            batch = list(user_ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+
+            if options['dry_run']:
+                for user_id, balance, ledger in find_balance_drift(batch):
+                    drifted += 1
+                    self.stdout.write(f'User {user_id}: balance {balance}, ledger {ledger}')
+            else:
+                drifted += reconcile_balances(batch)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{drifted} balances differ from the ledger'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Reconciled {drifted} balances'))
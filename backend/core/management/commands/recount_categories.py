@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recompute the available item counter of every category'
+
+    def handle(self, *args, **options):
+        updated = Category.objects.all().recount_available_items()
+        self.stdout.write(self.style.SUCCESS(f'Recounted {updated} categories'))
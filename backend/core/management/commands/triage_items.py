@@ -0,0 +1,70 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from core.images import difference_hash
+from core.models import ClothingItem, ItemImage
+from core.triage import get_triage_index, reset_triage_index, text_hash, triage_item
+
+
+class Command(BaseCommand):
+    help = 'Triage pending items against the image and text hashes of every other item'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='First hash processed images and items that have no hash yet')
+        parser.add_argument('--all', action='store_true', help='Also re-triage pending items triaged before')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows hashed per UPDATE')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.backfill(options['batch_size'])
+        reset_triage_index()
+        get_triage_index()
+
+        pending = ClothingItem.objects.filter(status='pending')
+        if not options['all']:
+            pending = pending.filter(triage_status='')
+        outcomes = Counter()
+        for item_id in pending.order_by('pk').values_list('pk', flat=True).iterator():
+            outcomes[triage_item(item_id) or 'skipped'] += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Triaged ' + ', '.join(f'{count} {outcome}' for outcome, count in sorted(outcomes.items()))
+            if outcomes else 'Nothing to triage'
+        ))
+
+    def backfill(self, batch_size):
+        hashed_images = self.update_in_batches(
+            ItemImage.objects.filter(processing_status='ready', image_hash='').only('image'),
+            'image_hash', self.hash_image, batch_size
+        )
+        # Pending items get theirs when triaged
+        hashed_items = self.update_in_batches(
+            ClothingItem.objects.exclude(status='pending').filter(text_hash='').only('title', 'description'),
+            'text_hash', lambda item: text_hash(item.title, item.description), batch_size
+        )
+        self.stdout.write(f'Hashed {hashed_images} images and {hashed_items} item texts')
+
+    def hash_image(self, image):
+        try:
+            with Image.open(image.image.path) as img:
+                return difference_hash(img)
+        except Exception as exc:
+            self.stderr.write(f'Could not hash image {image.pk}: {exc}')
+            return None
+
+    def update_in_batches(self, queryset, field, compute, batch_size):
+        model = queryset.model
+        batch, total = [], 0
+        for instance in queryset.order_by('pk').iterator(chunk_size=batch_size):
+            value = compute(instance)
+            if value is not None:
+                setattr(instance, field, f'{value:016x}')
+                batch.append(instance)
+            if len(batch) >= batch_size:
+                model.objects.bulk_update(batch, [field])
+                total += len(batch)
+                batch = []
+        model.objects.bulk_update(batch, [field])
+        return total + len(batch)
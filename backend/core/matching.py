@@ -0,0 +1,234 @@
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count
+
+from .models import ClothingItem, UserInteraction
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    # Owners kept per user in the interest graph; cycles cost FANOUT ** 2 per user
+    'FANOUT': 20,
+    # A user's strongest (type, size) buckets, and the owners kept per bucket,
+    # when matching on taste alone
+    'TASTES': 3,
+    'BUCKET_OWNERS': 50,
+    # Seconds an in-process index is served before a background rebuild
+    'MAX_AGE': 300,
+    'WEIGHTS': {'view': 1, 'like': 3},
+}
+
+# How much a direct view/like counts against a shared (type, size) bucket
+DIRECT_BONUS = 3
+
+IndexedItem = namedtuple('IndexedItem', ['id', 'owner_id', 'type', 'size'])
+
+Leg = namedtuple('Leg', ['giver', 'receiver', 'item_id'])
+
+Match = namedtuple('Match', ['kind', 'score', 'legs'])
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_MATCHING', {})}
+
+
+class MatchIndex:
+    """In-memory index of swappable items and of what each user wants.
+
+    A user wants an owner's item when they viewed or liked it, or when it
+    shares a (type, size) bucket with their own listings or with items they
+    interacted with. Each user's wants are reduced to their FANOUT best owners,
+    which is the directed graph the pair and cycle search walks.
+    """
+
+    def __init__(self, items, interactions, fanout=20, tastes=3, bucket_owners=50, weights=None):
+        weights = weights or DEFAULTS['WEIGHTS']
+        self.fanout = fanout
+        self.taste_count = tastes
+        self.items = {}
+        self.owners = defaultdict(list)
+        bucket_items = defaultdict(lambda: defaultdict(list))
+
+        self.tastes = defaultdict(Counter)
+        for item in items:
+            item = IndexedItem(*item)
+            self.items[item.id] = item
+            self.owners[item.owner_id].append(item.id)
+            bucket_items[item.type, item.size][item.owner_id].append(item.id)
+            self.tastes[item.owner_id][item.type, item.size] += 1
+
+        self.direct = defaultdict(Counter)
+        for user_id, item_id, item_type, size, interaction_type, count in interactions:
+            weight = weights.get(interaction_type, 0) * count
+            self.tastes[user_id][item_type, size] += weight
+            if item_id in self.items:
+                self.direct[user_id][item_id] += weight
+
+        # Owners with the most items in each bucket, who are the likeliest partners
+        self.buckets = {
+            bucket: heapq.nlargest(bucket_owners, owners.items(), key=lambda pair: len(pair[1]))
+            for bucket, owners in bucket_items.items()
+        }
+        self._edges = {}
+
+    @classmethod
+    def build(cls, config=None):
+        config = config or get_config()
+        items = ClothingItem.objects.filter(
+            status='available', is_available_for_swap=True
+        ).values_list('id', 'owner_id', 'type', 'size').iterator(chunk_size=10000)
+        interactions = UserInteraction.objects.filter(
+            item__isnull=False, interaction_type__in=list(config['WEIGHTS'])
+        ).order_by().values_list(
+            'user_id', 'item_id', 'item__type', 'item__size', 'interaction_type'
+        ).annotate(count=Count('pk')).iterator(chunk_size=10000)
+        return cls(
+            items, interactions, fanout=config['FANOUT'], tastes=config['TASTES'],
+            bucket_owners=config['BUCKET_OWNERS'], weights=config['WEIGHTS']
+        )
+
+    def edges(self, user_id):
+        """{owner_id: (score, item_id)} for the owners whose items user_id wants most"""
+        if user_id in self._edges:
+            return self._edges[user_id]
+
+        scores = Counter()
+        picks = {}
+        for item_id, weight in self.direct.get(user_id, Counter()).most_common():
+            owner_id = self.items[item_id].owner_id
+            if owner_id != user_id:
+                scores[owner_id] += weight * DIRECT_BONUS
+                picks.setdefault(owner_id, item_id)
+
+        # Strongest bucket first, so an owner's pick comes from the best fitting one
+        for bucket, weight in self.tastes.get(user_id, Counter()).most_common(self.taste_count):
+            for owner_id, item_ids in self.buckets.get(bucket, ()):
+                if owner_id != user_id:
+                    scores[owner_id] += weight
+                    picks.setdefault(owner_id, item_ids[0])
+
+        edges = {
+            owner_id: (score, picks[owner_id])
+            for owner_id, score in heapq.nlargest(self.fanout, scores.items(), key=lambda pair: pair[1])
+        }
+        self._edges[user_id] = edges
+        return edges
+
+    def matches_for(self, user_id, limit=20):
+        """Best mutual pairs and three-party cycles that include user_id"""
+        if user_id not in self.owners:
+            return []
+        found = []
+        wants = self.edges(user_id)
+        for partner, (score, item_id) in wants.items():
+            back = self.edges(partner).get(user_id)
+            if back:
+                found.append(Match('pair', score + back[0], [
+                    Leg(user_id, partner, back[1]), Leg(partner, user_id, item_id),
+                ]))
+            for third, (third_score, third_item) in self.edges(partner).items():
+                if third == user_id:
+                    continue
+                # user_id gives to third, third gives to partner, partner gives to user_id
+                closing = self.edges(third).get(user_id)
+                if closing:
+                    found.append(Match('cycle', score + third_score + closing[0], [
+                        Leg(user_id, third, closing[1]),
+                        Leg(third, partner, third_item),
+                        Leg(partner, user_id, item_id),
+                    ]))
+        return heapq.nlargest(limit, found, key=lambda match: match.score)
+
+    def all_matches(self):
+        """Every mutual pair and three-party cycle, each reported once"""
+        for user_id in sorted(self.owners):
+            for partner, (score, item_id) in self.edges(user_id).items():
+                if partner < user_id:
+                    continue
+                back = self.edges(partner).get(user_id)
+                if back:
+                    yield Match('pair', score + back[0], [
+                        Leg(user_id, partner, back[1]), Leg(partner, user_id, item_id),
+                    ])
+                # A cycle is reported from its lowest user id
+                for third, (third_score, third_item) in self.edges(partner).items():
+                    if third <= user_id:
+                        continue
+                    closing = self.edges(third).get(user_id)
+                    if closing:
+                        yield Match('cycle', score + third_score + closing[0], [
+                            Leg(user_id, third, closing[1]),
+                            Leg(third, partner, third_item),
+                            Leg(partner, user_id, item_id),
+                        ])
+
+
+_index = None
+_index_built_at = 0
+_index_generation = 0
+_index_lock = threading.Lock()
+_rebuild_thread = None
+
+
+def get_match_index():
+    """Process-wide MatchIndex, None until the first one is built.
+
+    Requests never build the index themselves: once it is missing or
+    MAX_AGE seconds old, a background thread builds a new one and swaps it
+    in, and the current index is served until then.
+    """
+    if _index is None or time.monotonic() - _index_built_at > get_config()['MAX_AGE']:
+        schedule_rebuild()
+    return _index
+
+
+def schedule_rebuild():
+    """Run rebuild_match_index on a background thread unless one is already running"""
+    global _rebuild_thread
+    with _index_lock:
+        if _rebuild_thread is None:
+            _rebuild_thread = threading.Thread(
+                target=_rebuild_in_background, name='match-index-rebuild', daemon=True
+            )
+            _rebuild_thread.start()
+
+
+def _rebuild_in_background():
+    global _rebuild_thread
+    close_old_connections()
+    try:
+        rebuild_match_index()
+    except Exception:
+        logger.exception('Could not rebuild the match index')
+    finally:
+        close_old_connections()
+        with _index_lock:
+            _rebuild_thread = None
+
+
+def rebuild_match_index():
+    """Build a new process-wide index and swap it in, returning it"""
+    global _index, _index_built_at
+    with _index_lock:
+        generation = _index_generation
+    index = MatchIndex.build()
+    with _index_lock:
+        # A reset while building wins over the new index
+        if generation == _index_generation:
+            _index, _index_built_at = index, time.monotonic()
+    return index
+
+
+def reset_match_index():
+    global _index, _index_built_at, _index_generation
+    with _index_lock:
+        _index, _index_built_at = None, 0
+        _index_generation += 1
@@ -0,0 +1,285 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Add a Server-Timing header to every response
+    'SERVER_TIMING': True,
+    # Bearer token Prometheus scrapes /api/metrics/ with; staff users can always read it
+    'TOKEN': None,
+    'DURATION_BUCKETS': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    'QUERY_BUCKETS': [0, 1, 2, 3, 5, 10, 20, 50, 100],
+    'SIZE_BUCKETS': [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304],
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_METRICS', {})}
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """In-process metrics keyed by name and label values.
+
+    Every process keeps its own numbers, so each worker is scraped on its own
+    (or through a per-process port). One lock guards all updates, which are a
+    few additions each.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, labels, value, buckets):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        with self.lock:
+            self.counters[name, labels] = self.counters.get((name, labels), 0) + amount
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        with self.lock:
+            histograms = sorted(
+                (key, list(histogram.counts), histogram.sum, histogram.count, histogram.buckets)
+                for key, histogram in self.histograms.items()
+            )
+            counters = sorted(self.counters.items())
+
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f'# HELP {name} {HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), counts, total, count, buckets in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+HELP = {
+    'rewear_requests_total': 'Requests served, by view, method and status',
+    'rewear_request_duration_seconds': 'Wall time spent in the view and the middleware below it',
+    'rewear_db_duration_seconds': 'Time spent executing SQL per request',
+    'rewear_db_queries': 'SQL queries per request',
+    'rewear_db_duplicate_queries_total': 'Queries repeated with the same SQL and parameters within a request',
+    'rewear_serializer_duration_seconds': 'Time spent building serializer data per request',
+    'rewear_render_duration_seconds': 'Time spent rendering response bodies per request',
+    'rewear_response_size_bytes': 'Response body size',
+}
+
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    """What one request spent its time on, filled in by RequestMetricsMiddleware and timed() code"""
+
+    __slots__ = ('db_time', 'queries', 'seen', 'duplicates', 'serializer_time', 'render_time', 'depth')
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.queries = 0
+        self.seen = set()
+        self.duplicates = 0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # django.db execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            try:
+                key = hash((sql, tuple(params) if isinstance(params, list) else params))
+            except TypeError:
+                key = hash((sql, repr(params)))
+            if key in self.seen:
+                self.duplicates += 1
+            else:
+                self.seen.add(key)
+
+
+current_request = ContextVar('rewear_request_metrics', default=None)
+
+
+def timed(attribute):
+    """Decorator adding the function's time to the current request's attribute, outermost call only"""
+
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = current_request.get()
+            if metrics is None or metrics.depth:
+                return function(*args, **kwargs)
+            metrics.depth += 1
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.depth -= 1
+                setattr(metrics, attribute, getattr(metrics, attribute) + time.perf_counter() - started)
+
+        return wrapper
+
+    return decorate
+
+
+def own_queries(metrics):
+    """Execute wrapper counting towards metrics only the queries its own request makes.
+
+    Async requests share the thread their ORM calls run on, and with it the
+    connection, so each one checks the context variable of the query.
+    """
+
+    def wrapper(execute, sql, params, many, context):
+        if current_request.get() is not metrics:
+            return execute(sql, params, many, context)
+        return metrics(execute, sql, params, many, context)
+
+    return wrapper
+
+
+def add_query_wrapper(metrics):
+    """Install own_queries(metrics) on this thread's connection until remove_query_wrapper()"""
+    wrapper = own_queries(metrics)
+    connection.execute_wrappers.append(wrapper)
+    return wrapper
+
+
+def remove_query_wrapper(wrapper):
+    # By identity, requests on a shared thread do not finish in the order they started
+    connection.execute_wrappers.remove(wrapper)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+def record_request(request, response, metrics, duration, size):
+    config = get_config()
+    labels = (('view', view_label(request)), ('method', request.method))
+    registry.increment('rewear_requests_total', labels + (('status', str(response.status_code)),))
+    registry.observe('rewear_request_duration_seconds', labels, duration, config['DURATION_BUCKETS'])
+    registry.observe('rewear_db_duration_seconds', labels, metrics.db_time, config['DURATION_BUCKETS'])
+    registry.observe('rewear_db_queries', labels, metrics.queries, config['QUERY_BUCKETS'])
+    if metrics.duplicates:
+        registry.increment('rewear_db_duplicate_queries_total', labels, metrics.duplicates)
+    # Observed even when zero, so every histogram counts the same requests
+    registry.observe(
+        'rewear_serializer_duration_seconds', labels, metrics.serializer_time, config['DURATION_BUCKETS']
+    )
+    registry.observe('rewear_render_duration_seconds', labels, metrics.render_time, config['DURATION_BUCKETS'])
+    if size is not None:
+        registry.observe('rewear_response_size_bytes', labels, size, config['SIZE_BUCKETS'])
+
+
+def server_timing(metrics, duration):
+    entries = [
+        f'app;dur={duration * 1000:.1f}',
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries, {metrics.duplicates} duplicates"',
+    ]
+    if metrics.serializer_time:
+        entries.append(f'serialize;dur={metrics.serializer_time * 1000:.1f}')
+    if metrics.render_time:
+        entries.append(f'render;dur={metrics.render_time * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def count_streamed(request, response, metrics, duration, chunks):
+    """Pass streamed chunks through and record the request once the body is complete.
+
+    Queries run while the body is generated count towards the request, the
+    duration stays the time to the first byte.
+    """
+    size = 0
+    try:
+        with connection.execute_wrapper(metrics):
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+    finally:
+        record_request(request, response, metrics, duration, size)
+
+
+async def acount_streamed(request, response, metrics, duration, chunks):
+    """count_streamed for async streaming responses"""
+    size = 0
+    current_request.set(metrics)
+    # Async ORM calls run on the shared sync thread, the wrapper goes on its connection
+    wrapper = await sync_to_async(add_query_wrapper)(metrics)
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        await sync_to_async(remove_query_wrapper)(wrapper)
+        current_request.set(None)
+        record_request(request, response, metrics, duration, size)
@@ -1,8 +1,25 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .metrics import (
+    RequestMetrics, acount_streamed, add_query_wrapper, count_streamed, current_request, get_config,
+    record_request, remove_query_wrapper, server_timing
+)
+
+
 class DisableCSRFForAPIMiddleware:
     """Middleware to disable CSRF for API endpoints"""
-    
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        # Under ASGI stay async so requests do not hop to a thread here
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
         # Disable CSRF for all API endpoints
@@ -11,3 +28,63 @@ class DisableCSRFForAPIMiddleware:
         
         response = self.get_response(request)
         return response
+
+
+class RequestMetricsMiddleware:
+    """Per-view wall time, SQL time and count, duplicate queries, serializer time and response size.
+
+    Numbers go to the in-process registry behind /api/metrics/ and, when
+    SERVER_TIMING is on, to a Server-Timing header. Put it first so the
+    time includes every other middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = config['SERVER_TIMING']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        started = time.perf_counter()
+        # The ORM of async views runs on the shared sync thread, so the wrapper goes on that connection
+        wrapper = await sync_to_async(add_query_wrapper)(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(remove_query_wrapper)(wrapper)
+            current_request.reset(token)
+        return self.finish(request, response, metrics, time.perf_counter() - started)
+
+    def finish(self, request, response, metrics, duration):
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(metrics, duration)
+        if response.streaming:
+            # Recorded once the body has been sent, with its full size
+            stream = acount_streamed if response.is_async else count_streamed
+            response.streaming_content = stream(
+                request, response, metrics, duration, response.streaming_content
+            )
+        else:
+            record_request(request, response, metrics, duration, len(response.content))
+        return response
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+from core.search import (
+    install_search_index, drop_search_index as drop_sqlite_index, search_vector
+)
+
+
+POSTGRES_INDEX = 'core_clothingitem_search_gin'
+
+
+def postgres_index():
+    from django.contrib.postgres.indexes import GinIndex
+
+    return GinIndex(search_vector(), name=POSTGRES_INDEX)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        install_search_index(schema_editor.connection.alias, rebuild=True)
+    elif vendor == 'postgresql':
+        ClothingItem = apps.get_model('core', 'ClothingItem')
+        schema_editor.add_index(ClothingItem, postgres_index())
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        drop_sqlite_index(schema_editor.connection.alias)
+    elif vendor == 'postgresql':
+        ClothingItem = apps.get_model('core', 'ClothingItem')
+        schema_editor.remove_index(ClothingItem, postgres_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
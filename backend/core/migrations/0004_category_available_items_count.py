@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:23
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_available_items_count(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+    ClothingItem = apps.get_model('core', 'ClothingItem')
+    available = ClothingItem.objects.filter(
+        category=models.OuterRef('pk'), status='available'
+    ).order_by().values('category').annotate(count=models.Count('pk')).values('count')
+    Category.objects.update(available_items_count=Coalesce(models.Subquery(available), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='available_items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_available_items_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_category_available_items_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_items', models.PositiveIntegerField(default=0)),
+                ('available_items', models.PositiveIntegerField(default=0)),
+                ('pending_items', models.PositiveIntegerField(default=0)),
+                ('pending_swap_requests', models.PositiveIntegerField(default=0)),
+                ('ongoing_swaps', models.PositiveIntegerField(default=0)),
+                ('completed_swaps', models.PositiveIntegerField(default=0)),
+                ('unread_notifications', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User stats',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_userstats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userinteraction',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
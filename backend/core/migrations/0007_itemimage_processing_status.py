@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+def mark_existing_images_ready(apps, schema_editor):
+    # Images uploaded so far were resized inline by ItemImage.save
+    ItemImage = apps.get_model('core', 'ItemImage')
+    ItemImage.objects.update(processing_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_userinteraction_event_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemimage',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.RunPython(mark_existing_images_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_itemimage_processing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
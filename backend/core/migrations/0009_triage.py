@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_itemimage_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clothingitem',
+            name='text_hash',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='clothingitem',
+            name='triage_priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='clothingitem',
+            name='triage_reasons',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='clothingitem',
+            name='triage_status',
+            field=models.CharField(blank=True, choices=[('', 'Not triaged'), ('clean', 'Clean'), ('review', 'Needs review'), ('flagged', 'Flagged'), ('approved', 'Auto-approved')], default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='itemimage',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='clothingitem',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-triage_priority', 'created_at'], name='item_pending_triage_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_payload(apps, schema_editor):
+    Notification = apps.get_model('core', 'Notification')
+    rows = Notification.objects.filter(
+        models.Q(related_item__isnull=False) | models.Q(related_swap__isnull=False)
+    ).order_by('pk').values_list(
+        'pk', 'related_item_id', 'related_item__title', 'related_swap_id',
+        'related_swap__requester_id', 'related_swap__requester__username',
+        'related_swap__owner_id', 'related_swap__owner__username',
+        'related_swap__requester_item_id', 'related_swap__requester_item__title',
+        'related_swap__requested_item_id', 'related_swap__requested_item__title',
+    )
+    batch = []
+    for (pk, item_id, item_title, swap_id, requester_id, requester, owner_id, owner,
+         requester_item_id, requester_item, requested_item_id, requested_item) in rows.iterator(chunk_size=1000):
+        payload = {}
+        if item_id:
+            payload['item'] = {'id': item_id, 'title': item_title}
+        if swap_id:
+            payload['swap'] = {
+                'id': swap_id,
+                'requester': {'id': requester_id, 'username': requester},
+                'owner': {'id': owner_id, 'username': owner},
+                'requester_item': {'id': requester_item_id, 'title': requester_item},
+                'requested_item': {'id': requested_item_id, 'title': requested_item},
+            }
+        batch.append(Notification(pk=pk, payload=payload))
+        if len(batch) == 1000:
+            Notification.objects.bulk_update(batch, ['payload'])
+            batch = []
+    Notification.objects.bulk_update(batch, ['payload'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_triage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='group_key',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='payload',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', True)), fields=['created_at'], name='notif_read_created_idx'),
+        ),
+        migrations.RunPython(backfill_payload, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
-from PIL import Image
-import os
+from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.utils import timezone
+from functools import partial
+
+from .cache import invalidate_category_catalogue
 
 
 class UserProfile(models.Model):
@@ -20,12 +24,51 @@ class UserProfile(models.Model):
         return f"{self.user.username}'s profile"
 
 
+class CategoryQuerySet(models.QuerySet):
+    def recount_available_items(self):
+        """Recompute the available item counter of these categories from scratch"""
+        available = ClothingItem.objects.filter(
+            category=models.OuterRef('pk'), status='available'
+        ).order_by().values('category').annotate(count=models.Count('pk')).values('count')
+        updated = self.update(
+            available_items_count=Coalesce(models.Subquery(available), 0)
+        )
+        invalidate_category_catalogue()
+        return updated
+
+
+class UserStats(models.Model):
+    """Materialized dashboard counters, moved by core.signals when enabled.
+
+    Only maintained while settings.REWEAR_MATERIALIZED_STATS is True.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stats')
+    total_items = models.PositiveIntegerField(default=0)
+    available_items = models.PositiveIntegerField(default=0)
+    pending_items = models.PositiveIntegerField(default=0)
+    pending_swap_requests = models.PositiveIntegerField(default=0)
+    ongoing_swaps = models.PositiveIntegerField(default=0)
+    completed_swaps = models.PositiveIntegerField(default=0)
+    unread_notifications = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "User stats"
+
+    def __str__(self):
+        return f"{self.user.username}'s stats"
+
+
 class Category(models.Model):
     """Clothing categories like Shirts, Pants, Dresses, etc."""
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True)
+    # Counter cache of items with status='available', maintained by core.signals
+    available_items_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Categories"
 
@@ -33,6 +76,13 @@ class Category(models.Model):
         return self.name
 
 
+def split_tags(tags):
+    """Comma separated tags as a list"""
+    if tags:
+        return [tag.strip() for tag in tags.split(',')]
+    return []
+
+
 class ClothingItem(models.Model):
     """Main model for clothing items"""
     CONDITION_CHOICES = [
@@ -94,24 +144,73 @@ class ClothingItem(models.Model):
     approved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, 
                                    related_name='approved_items')
 
+    # Automated pre-moderation by core.triage
+    TRIAGE_CHOICES = [
+        ('', 'Not triaged'),
+        ('clean', 'Clean'),
+        ('review', 'Needs review'),
+        ('flagged', 'Flagged'),
+        ('approved', 'Auto-approved'),
+    ]
+    triage_status = models.CharField(max_length=10, choices=TRIAGE_CHOICES, blank=True, default='')
+    # Sum of the weights of the checks that fired, higher is more suspicious
+    triage_priority = models.PositiveSmallIntegerField(default=0)
+    # [{'check', 'item', 'status', 'distance'}, ...], item and below only for similarity checks
+    triage_reasons = models.JSONField(default=list, blank=True)
+    # SimHash of title and description as 16 hex digits, see core.triage
+    text_hash = models.CharField(max_length=16, blank=True, editable=False)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Public listing, featured and search: status='available' newest first
+            models.Index(fields=['status', '-created_at'], name='item_status_created_idx'),
+            # Faceted browsing on the listing filters
+            models.Index(fields=['status', 'category', 'type', 'size'], name='item_status_facets_idx'),
+            # Dashboard counts and My Items per owner
+            models.Index(fields=['owner', 'status'], name='item_owner_status_idx'),
+            models.Index(fields=['owner', '-created_at'], name='item_owner_created_idx'),
+            # Moderation queue, oldest first; pending rows are a small slice of the table
+            models.Index(fields=['created_at'], name='item_pending_created_idx',
+                         condition=models.Q(status='pending')),
+            # Moderation queue in triage order
+            models.Index(fields=['-triage_priority', 'created_at'], name='item_pending_triage_idx',
+                         condition=models.Q(status='pending')),
+        ]
 
     def __str__(self):
         return f"{self.title} by {self.owner.username}"
 
+    def save(self, *args, **kwargs):
+        # One transaction, so the counters' read of the stored row keeps it locked, see core.signals
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
     def get_tags_list(self):
         """Return tags as a list"""
-        if self.tags:
-            return [tag.strip() for tag in self.tags.split(',')]
-        return []
+        return split_tags(self.tags)
+
+    def get_primary_image(self):
+        """The primary image, else the first uploaded, from the prefetched images when there are some"""
+        return next(iter(self.images.all()), None)
 
 
 class ItemImage(models.Model):
     """Images for clothing items"""
+    PROCESSING_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
     item = models.ForeignKey(ClothingItem, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='item_images/')
     is_primary = models.BooleanField(default=False)
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='pending')
+    # Resized copies written by core.images: [{'name', 'width', 'height', 'format'}, ...]
+    variants = models.JSONField(default=list, blank=True)
+    # 64-bit difference hash as 16 hex digits, written with the variants
+    image_hash = models.CharField(max_length=16, blank=True, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -121,14 +220,16 @@ class ItemImage(models.Model):
         return f"Image for {self.item.title}"
 
     def save(self, *args, **kwargs):
+        new_upload = bool(self.image) and not self.image._committed
+        if new_upload:
+            self.processing_status = 'pending'
+
         super().save(*args, **kwargs)
-        
-        # Resize image to optimize storage
-        if self.image:
-            img = Image.open(self.image.path)
-            if img.height > 800 or img.width > 800:
-                img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                img.save(self.image.path)
+
+        # Resizing runs on the image worker pool once the upload is committed
+        if new_upload:
+            from .images import enqueue_image_processing
+            transaction.on_commit(partial(enqueue_image_processing, self.pk))
 
 
 class SwapRequest(models.Model):
@@ -140,6 +241,11 @@ class SwapRequest(models.Model):
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
     ]
+    # Statuses the owner may move a swap request to from each status, none out of the others
+    STATUS_TRANSITIONS = {
+        'pending': ['accepted', 'rejected'],
+        'accepted': ['completed'],
+    }
 
     # Items being swapped
     requester_item = models.ForeignKey(ClothingItem, on_delete=models.CASCADE, 
@@ -164,10 +270,22 @@ class SwapRequest(models.Model):
     class Meta:
         unique_together = ['requester_item', 'requested_item']
         ordering = ['-created_at']
+        indexes = [
+            # Dashboard counts by status and the sent/received feeds, newest first
+            models.Index(fields=['owner', 'status'], name='swap_owner_status_idx'),
+            models.Index(fields=['owner', '-created_at'], name='swap_owner_created_idx'),
+            models.Index(fields=['requester', 'status'], name='swap_requester_status_idx'),
+            models.Index(fields=['requester', '-created_at'], name='swap_requester_created_idx'),
+        ]
 
     def __str__(self):
         return f"Swap: {self.requester_item.title} for {self.requested_item.title}"
 
+    def save(self, *args, **kwargs):
+        # One transaction, so the stats' read of the stored row keeps it locked, see core.signals
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
 
 class PointsTransaction(models.Model):
     """Track points transactions for redemptions and rewards"""
@@ -187,6 +305,9 @@ class PointsTransaction(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='points_tx_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.amount} points ({self.transaction_type})"
@@ -236,14 +357,34 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     related_item = models.ForeignKey(ClothingItem, on_delete=models.CASCADE, null=True, blank=True)
     related_swap = models.ForeignKey(SwapRequest, on_delete=models.CASCADE, null=True, blank=True)
+    # Snapshot of the related rows written by core.notifications, served instead of joining them:
+    # {'item': {'id', 'title'}, 'swap': {'id', 'requester', 'owner', 'requester_item', 'requested_item'}}
+    payload = models.JSONField(default=dict, blank=True)
+    # Unread notifications with the same group key are coalesced into one, count says how many
+    group_key = models.CharField(max_length=100, blank=True)
+    count = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notif_user_created_idx'),
+            # Unread counters on the dashboard
+            models.Index(fields=['user'], name='notif_user_unread_idx',
+                         condition=models.Q(is_read=False)),
+            # Retention: read notifications oldest first
+            models.Index(fields=['created_at'], name='notif_read_created_idx',
+                         condition=models.Q(is_read=True)),
+        ]
 
     def __str__(self):
         return f"Notification for {self.user.username}: {self.title}"
 
+    def save(self, *args, **kwargs):
+        # One transaction, so the stats' read of the stored row keeps it locked, see core.signals
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
 
 class UserInteraction(models.Model):
     """Track user interactions for analytics and recommendations"""
@@ -260,7 +401,8 @@ class UserInteraction(models.Model):
     item = models.ForeignKey(ClothingItem, on_delete=models.CASCADE, null=True, blank=True, 
                            related_name='interactions')
     search_query = models.CharField(max_length=200, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the event happened, not when core.interactions wrote it
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-created_at']
@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate_public_responses
+from .models import Category, ClothingItem
+from .notifications import build_notification, send_notifications
+from .stats import apply_stats_changes, count_item
+
+
+ACTIONS = ('approve', 'reject')
+
+# Item ids accepted by one batch request
+MAX_BATCH_SIZE = 1000
+
+RESULTS = {'approve': 'approved', 'reject': 'rejected'}
+
+
+def moderation_notification(action, item, owner_id, message=''):
+    """Unsaved notification telling an owner their item (an item_summary) was approved or rejected"""
+    title = item['title']
+    if action == 'approve':
+        return build_notification(
+            owner_id, 'item_approved', 'Item Approved',
+            f'Your item "{title}" has been approved and is now available for swapping!', item=item
+        )
+    return build_notification(
+        owner_id, 'item_rejected', 'Item Rejected', f'Your item "{title}" has been rejected. Reason: {message}',
+        item=item
+    )
+
+
+def moderate_items(moderator, item_ids, action, message=''):
+    """Approve or reject the pending items among item_ids in one transaction.
+
+    One UPDATE moves the items and one bulk INSERT notifies their owners.
+    Returns {item id: 'approved', 'rejected', 'not_pending' or 'not_found'}.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown moderation action {action!r}')
+    item_ids = list(dict.fromkeys(item_ids))
+
+    with transaction.atomic():
+        rows = ClothingItem.objects.select_for_update().filter(pk__in=item_ids).values_list(
+            'pk', 'status', 'title', 'owner_id', 'category_id'
+        )
+        found = {}
+        pending = []
+        for pk, item_status, title, owner_id, category_id in rows:
+            found[pk] = item_status
+            if item_status == 'pending':
+                pending.append((pk, title, owner_id, category_id))
+
+        if pending:
+            queryset = ClothingItem.objects.filter(pk__in=[row[0] for row in pending])
+            if action == 'approve':
+                queryset.update(status='available', approved_at=timezone.now(), approved_by=moderator)
+            else:
+                queryset.update(status='rejected')
+            send_notifications([
+                moderation_notification(action, {'id': pk, 'title': title}, owner_id, message)
+                for pk, title, owner_id, _ in pending
+            ])
+            after_moderation(action, pending)
+
+    results = {}
+    for pk in item_ids:
+        if pk not in found:
+            results[pk] = 'not_found'
+        elif found[pk] == 'pending':
+            results[pk] = RESULTS[action]
+        else:
+            results[pk] = 'not_pending'
+    return results
+
+
+def after_moderation(action, pending):
+    # update() skips the signals that keep these up to date
+    changes = {}
+    for _, _, owner_id, _ in pending:
+        count_item(changes, owner_id, 'pending', -1)
+        count_item(changes, owner_id, 'available' if action == 'approve' else 'rejected')
+    apply_stats_changes(changes)
+    if action == 'approve':
+        Category.objects.filter(pk__in={category_id for *_, category_id in pending}).recount_available_items()
+    else:
+        invalidate_public_responses()
@@ -0,0 +1,165 @@
+import json
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .events import publish
+from .models import Notification
+from .stats import apply_stats_changes, count_notification
+
+
+DEFAULTS = {
+    # Seconds during which a new event replaces the unread notification with
+    # the same group key, carrying its count over
+    'COALESCE_WINDOW': 24 * 60 * 60,
+    # prune_notifications deletes read notifications older than this many days
+    'RETENTION_DAYS': 90,
+    # Rows per INSERT when sending and per DELETE when pruning
+    'BATCH_SIZE': 500,
+    'CHUNK_SIZE': 1000,
+}
+
+ARCHIVE_FIELDS = [
+    'id', 'user_id', 'notification_type', 'title', 'message', 'payload', 'group_key', 'count', 'created_at',
+]
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_NOTIFICATIONS', {})}
+
+
+def item_summary(item):
+    return {'id': item.pk, 'title': item.title}
+
+
+def user_summary(user):
+    return {'id': user.pk, 'username': user.username}
+
+
+def swap_summary(swap):
+    return {
+        'id': swap.pk,
+        'requester': user_summary(swap.requester),
+        'owner': user_summary(swap.owner),
+        'requester_item': item_summary(swap.requester_item),
+        'requested_item': item_summary(swap.requested_item),
+    }
+
+
+def build_notification(user_id, notification_type, title, message, item=None, swap=None, group_key=None):
+    """Unsaved notification carrying summaries of its item and swap.
+
+    item and swap are item_summary()/swap_summary() dicts. Events about the
+    same type and item (or swap) share a group key unless one is given, ''
+    turns coalescing off.
+    """
+    payload = {}
+    if item is not None:
+        payload['item'] = item
+    if swap is not None:
+        payload['swap'] = swap
+    if group_key is None:
+        related = f"item:{item['id']}" if item is not None else f"swap:{swap['id']}" if swap is not None else None
+        group_key = f'{notification_type}:{related}' if related else ''
+    return Notification(
+        user_id=user_id, notification_type=notification_type, title=title, message=message,
+        related_item_id=item['id'] if item is not None else None,
+        related_swap_id=swap['id'] if swap is not None else None,
+        payload=payload, group_key=group_key,
+    )
+
+
+def send_notifications(notifications):
+    """Insert notifications with one bulk INSERT and wake their recipients' streams.
+
+    Notifications sharing a user and group key are coalesced: the last one
+    is kept with the count of all of them, including an unread one sent
+    within COALESCE_WINDOW, which it replaces so streams deliver it again.
+    Returns the notifications written.
+    """
+    config = get_config()
+    latest = {}
+    for notification in notifications:
+        if notification.group_key:
+            key = (notification.user_id, notification.group_key)
+            if key in latest:
+                notification.count += latest[key].count
+            latest[key] = notification
+    notifications = [
+        notification for notification in notifications
+        if not notification.group_key or latest[notification.user_id, notification.group_key] is notification
+    ]
+    if not notifications:
+        return []
+
+    changes = {}
+    with transaction.atomic():
+        if latest:
+            # Concurrent sends to the same users queue here, so they cannot both
+            # miss an unread row and insert twice, or both replace the same one
+            list(User.objects.select_for_update().filter(
+                pk__in={user_id for user_id, _ in latest}
+            ).order_by('pk').values_list('pk', flat=True))
+            since = timezone.now() - timedelta(seconds=config['COALESCE_WINDOW'])
+            replaced = []
+            for pk, user_id, group_key, count in Notification.objects.filter(
+                user_id__in={user_id for user_id, _ in latest},
+                group_key__in={group_key for _, group_key in latest},
+                is_read=False, created_at__gte=since,
+            ).values_list('pk', 'user_id', 'group_key', 'count'):
+                notification = latest.get((user_id, group_key))
+                if notification is not None:
+                    notification.count += count
+                    replaced.append(pk)
+            if replaced:
+                # post_delete takes the replaced unread rows off the stats
+                Notification.objects.filter(pk__in=replaced).delete()
+
+        created = Notification.objects.bulk_create(notifications, batch_size=config['BATCH_SIZE'])
+
+        # bulk_create skips the signals that update stats and wake streams
+        for notification in created:
+            count_notification(changes, notification.user_id, notification.is_read)
+        apply_stats_changes(changes)
+        for user_id in {notification.user_id for notification in created}:
+            transaction.on_commit(partial(publish, user_id))
+    return created
+
+
+def notify(user_id, notification_type, title, message, item=None, swap=None, group_key=None):
+    """Send a single notification, see build_notification and send_notifications"""
+    return send_notifications([
+        build_notification(user_id, notification_type, title, message, item, swap, group_key)
+    ])[0]
+
+
+def prune_notifications(days=None, chunk_size=None, archive=None):
+    """Delete read notifications older than days, chunk_size rows per transaction.
+
+    With archive, a text file, each chunk is written to it as JSON lines
+    before it is deleted. Returns how many rows were deleted.
+    """
+    config = get_config()
+    days = config['RETENTION_DAYS'] if days is None else days
+    chunk_size = chunk_size or config['CHUNK_SIZE']
+    expired = Notification.objects.filter(
+        is_read=True, created_at__lt=timezone.now() - timedelta(days=days)
+    ).order_by('created_at', 'pk')
+
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            if archive is not None:
+                rows = list(expired.values(*ARCHIVE_FIELDS)[:chunk_size])
+                pks = [row['id'] for row in rows]
+                archive.writelines(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+            else:
+                pks = list(expired.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return deleted
+            deleted += expired.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,181 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination:
+    """Keyset pagination on (created_at, id), with no OFFSET and no COUNT query.
+
+    Cursors are opaque base64 tokens holding the position of the last (or,
+    going back, the first) row of the current page, so every page costs the
+    same index range scan however deep the client has scrolled.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+
+    @staticmethod
+    def get_direction(queryset):
+        """'desc' or 'asc' when the queryset is ordered by created_at alone, else None"""
+        if queryset.query.is_sliced:
+            return None
+        ordering = tuple(queryset.query.order_by)
+        if not ordering and queryset.query.default_ordering:
+            ordering = tuple(queryset.model._meta.ordering)
+        if ordering in (('-created_at',), ('-created_at', '-id')):
+            return 'desc'
+        if ordering in (('created_at',), ('created_at', 'id')):
+            return 'asc'
+        return None
+
+    def encode_cursor(self, instance, reverse):
+        position = [instance.created_at.isoformat(), instance.pk, int(reverse)]
+        token = base64.urlsafe_b64encode(json.dumps(position).encode('ascii'))
+        return token.decode('ascii').rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            created_at, pk, reverse = json.loads(base64.urlsafe_b64decode(padded))
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError(token)
+            return created_at, int(pk), bool(reverse)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def page_queryset(self, queryset, request, direction):
+        """Queryset of the requested page plus one row that tells whether there is more"""
+        self.request = request
+        self.token = request.query_params.get(self.cursor_query_param)
+        self.reverse = False
+
+        # Walking backwards flips the scan direction, the page is flipped back below
+        descending = direction == 'desc'
+        if self.token:
+            created_at, pk, self.reverse = self.decode_cursor(self.token)
+            if descending != self.reverse:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+                )
+
+        if descending != self.reverse:
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            queryset = queryset.order_by('created_at', 'id')
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        page = rows[:self.page_size]
+
+        if self.reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, bool(self.token)
+
+        self.page = page
+        return page
+
+    def paginate_queryset(self, queryset, request, direction):
+        return self.set_page(list(self.page_queryset(queryset, request, direction)))
+
+    async def apaginate_queryset(self, queryset, request, direction):
+        queryset = self.page_queryset(queryset, request, direction)
+        return self.set_page([row async for row in queryset])
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1], reverse=False)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[0], reverse=True)
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class ItemPagination(PageNumberPagination):
+    """Page number pagination with an opt-in keyset mode.
+
+    Clients pass ?pagination=cursor (or follow a ?cursor= link) to switch to
+    KeysetPagination. Querysets that are not ordered by created_at, such as
+    relevance-ranked search results, keep using page numbers.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    mode_query_param = 'pagination'
+
+    keyset = None
+
+    def wants_keyset(self, request):
+        return (request.query_params.get(self.mode_query_param) == 'cursor' or
+                KeysetPagination.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.wants_keyset(request):
+            direction = KeysetPagination.get_direction(queryset)
+            if direction:
+                self.keyset = KeysetPagination(self.get_page_size(request))
+                return self.keyset.paginate_queryset(queryset, request, direction)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset for async views, counting and fetching through the async ORM"""
+        self.keyset = None
+        if self.wants_keyset(request):
+            direction = KeysetPagination.get_direction(queryset)
+            if direction:
+                self.keyset = KeysetPagination(self.get_page_size(request))
+                return await self.keyset.apaginate_queryset(queryset, request, direction)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count is a cached_property, fill it in so page() does not block
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [row async for row in self.page.object_list]
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
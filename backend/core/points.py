@@ -0,0 +1,108 @@
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .authentication import forget_user
+from .models import PointsTransaction, UserProfile
+
+
+# Awarded for every item a user lists
+LISTING_POINTS = 5
+
+
+class InsufficientPoints(Exception):
+    """The balance cannot cover a debit"""
+
+
+def apply_points(user, amount, transaction_type, description, related_item=None):
+    """Write a ledger entry and move the balance by amount in one transaction.
+
+    The balance changes with a single conditional UPDATE instead of a read,
+    modify and save in Python, so concurrent requests cannot lose updates and
+    a debit only succeeds while the stored balance still covers it.
+    """
+    user_id = getattr(user, 'pk', user)
+    with transaction.atomic():
+        profiles = UserProfile.objects.filter(user_id=user_id)
+        if amount < 0:
+            profiles = profiles.filter(points_balance__gte=-amount)
+        if not profiles.update(points_balance=F('points_balance') + amount):
+            if amount < 0:
+                raise InsufficientPoints(user_id)
+            UserProfile.objects.create(user_id=user_id, points_balance=amount)
+
+        entry = PointsTransaction.objects.create(
+            user_id=user_id,
+            transaction_type=transaction_type,
+            amount=amount,
+            description=description,
+            related_item=related_item,
+        )
+        # Cached logins carry the balance, refetch it once this commits
+        transaction.on_commit(partial(forget_user, user_id))
+
+    # Keep an already loaded profile in step with the database
+    if isinstance(user, User) and User.profile.related.is_cached(user):
+        user.profile.refresh_from_db(fields=['points_balance'])
+    return entry
+
+
+def credit_points_in_bulk(user, entries):
+    """Write many credit entries for one user with a bulk insert and one balance UPDATE.
+
+    entries are (amount, transaction_type, description, related_item) tuples.
+    """
+    user_id = getattr(user, 'pk', user)
+    total = sum(amount for amount, _, _, _ in entries)
+    if any(amount < 0 for amount, _, _, _ in entries):
+        raise ValueError('credit_points_in_bulk only takes credits')
+
+    with transaction.atomic():
+        if not UserProfile.objects.filter(user_id=user_id).update(points_balance=F('points_balance') + total):
+            UserProfile.objects.create(user_id=user_id, points_balance=total)
+        created = PointsTransaction.objects.bulk_create([
+            PointsTransaction(
+                user_id=user_id, transaction_type=transaction_type, amount=amount,
+                description=description, related_item=related_item,
+            )
+            for amount, transaction_type, description, related_item in entries
+        ])
+        transaction.on_commit(partial(forget_user, user_id))
+
+    if isinstance(user, User) and User.profile.related.is_cached(user):
+        user.profile.refresh_from_db(fields=['points_balance'])
+    return created
+
+
+def ledger_balance():
+    """Subquery summing the ledger of the outer query's user"""
+    return Coalesce(Subquery(
+        PointsTransaction.objects.filter(user_id=OuterRef('user_id')).order_by().values(
+            'user_id'
+        ).annotate(total=Sum('amount')).values('total')
+    ), Value(0))
+
+
+def find_balance_drift(user_ids=None):
+    """(user_id, stored balance, ledger balance) for every profile that disagrees with its ledger"""
+    profiles = UserProfile.objects.all()
+    if user_ids is not None:
+        profiles = profiles.filter(user_id__in=user_ids)
+    return list(
+        profiles.annotate(ledger=ledger_balance()).exclude(points_balance=F('ledger'))
+        .order_by('user_id').values_list('user_id', 'points_balance', 'ledger')
+    )
+
+
+def reconcile_balances(user_ids):
+    """Reset the balances of a batch of users to their ledger totals with one UPDATE"""
+    changed = UserProfile.objects.filter(user_id__in=user_ids).exclude(
+        points_balance=ledger_balance()
+    ).update(points_balance=ledger_balance())
+    if changed:
+        for user_id in user_ids:
+            transaction.on_commit(partial(forget_user, user_id))
+    return changed
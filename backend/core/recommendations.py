@@ -0,0 +1,273 @@
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import ClothingItem, UserInteraction
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULTS = {
+    # Where build_recommendations saves the model; None keeps it in memory only
+    'MODEL_PATH': None,
+    # Items remembered per user, each new one pairs with all of them
+    'HISTORY': 50,
+    # Seconds between incremental refreshes from new UserInteraction rows
+    'REFRESH_INTERVAL': 30,
+    'WEIGHTS': {'view': 1, 'like': 3},
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_RECOMMENDATIONS', {})}
+
+
+class CooccurrenceModel:
+    """Sparse item-item co-occurrence counts built from UserInteraction rows.
+
+    Two items co-occur when the same user interacted with both, weighted by
+    the stronger of the two interactions. Similarity is the cosine of their
+    co-occurrence count, so popular items do not swamp every list. New
+    interactions are folded in incrementally by update(), which is why each
+    user's recent items are kept alongside the counts.
+    """
+
+    # Bumped whenever to_dict changes shape
+    VERSION = 2
+
+    def __init__(self, history=50, weights=None):
+        self.history_size = history
+        self.weights = weights or DEFAULTS['WEIGHTS']
+        self.pairs = defaultdict(Counter)
+        self.item_counts = Counter()
+        # {user_id: {item_id: weight}}, oldest interaction first
+        self.history = {}
+        self.last_id = 0
+        # Held while folding in rows and while scoring, never across a query
+        self.lock = threading.Lock()
+
+    def add(self, user_id, item_id, weight=1):
+        # Each user counts an item once, at the strongest interaction they had with it
+        history = self.history.setdefault(user_id, {})
+        previous = history.pop(item_id, 0)
+        if weight > previous:
+            self.item_counts[item_id] += weight - previous
+            pairs = self.pairs[item_id]
+            for other, other_weight in history.items():
+                # A pair counts the stronger of its two interactions
+                change = max(weight, other_weight) - (max(previous, other_weight) if previous else 0)
+                if change:
+                    pairs[other] += change
+                    self.pairs[other][item_id] += change
+        # Reinserting moves the item to the recent end
+        history[item_id] = max(weight, previous)
+        while len(history) > self.history_size:
+            del history[next(iter(history))]
+
+    def update(self, batch_size=5000):
+        """Fold in interactions newer than the last one seen, returning how many were read"""
+        rows = UserInteraction.objects.filter(
+            item__isnull=False, interaction_type__in=list(self.weights)
+        ).order_by('pk').values_list('pk', 'user_id', 'item_id', 'interaction_type')
+
+        total = 0
+        while True:
+            batch = list(rows.filter(pk__gt=self.last_id)[:batch_size])
+            if not batch:
+                return total
+            with self.lock:
+                for _, user_id, item_id, interaction_type in batch:
+                    self.add(user_id, item_id, self.weights[interaction_type])
+                self.last_id = batch[-1][0]
+            total += len(batch)
+
+    def similar(self, item_ids, exclude=(), limit=50):
+        """(item_id, score) pairs most similar to the given items, best first"""
+        scores = Counter()
+        with self.lock:
+            for item_id in item_ids:
+                count = self.item_counts.get(item_id)
+                if not count:
+                    continue
+                for other, together in self.pairs.get(item_id, {}).items():
+                    scores[other] += together / math.sqrt(count * self.item_counts[other])
+        for item_id in exclude:
+            scores.pop(item_id, None)
+        return heapq.nlargest(limit, scores.items(), key=lambda pair: pair[1])
+
+    def recommend(self, user_id, limit=50):
+        with self.lock:
+            history = list(self.history.get(user_id, []))
+        return self.similar(history, exclude=history, limit=limit)
+
+    def popular(self, exclude=(), limit=50):
+        exclude = set(exclude)
+        with self.lock:
+            return heapq.nlargest(
+                limit, ((item_id, count) for item_id, count in self.item_counts.items()
+                        if item_id not in exclude),
+                key=lambda pair: pair[1]
+            )
+
+    def to_dict(self):
+        return {
+            'version': self.VERSION,
+            'last_id': self.last_id,
+            'item_counts': list(self.item_counts.items()),
+            'pairs': [[item_id, list(others.items())] for item_id, others in self.pairs.items()],
+            'history': [[user_id, list(items.items())] for user_id, items in self.history.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data, history=50, weights=None):
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported model version {data.get('version')}")
+        model = cls(history=history, weights=weights)
+        model.last_id = data['last_id']
+        model.item_counts = Counter(dict(data['item_counts']))
+        for item_id, others in data['pairs']:
+            model.pairs[item_id] = Counter(dict(others))
+        model.history = {user_id: dict(items) for user_id, items in data['history']}
+        return model
+
+    def save(self, path):
+        # Write next to the target and rename so readers never see half a file
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as output:
+            json.dump(self.to_dict(), output, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, encoding='utf-8') as source:
+            return cls.from_dict(json.load(source), **kwargs)
+
+
+def build_model(config=None):
+    """Build a model from every stored interaction"""
+    config = config or get_config()
+    model = CooccurrenceModel(history=config['HISTORY'], weights=config['WEIGHTS'])
+    model.update()
+    return model
+
+
+_model = None
+_model_loaded_at = 0
+_model_refreshed_at = 0
+_model_generation = 0
+_model_lock = threading.Lock()
+_refresh_thread = None
+
+
+def get_model():
+    """The process-wide model, None until the first one is loaded or built.
+
+    Requests never load, build or refresh the model themselves: when it is
+    missing, older than REFRESH_INTERVAL or older than the model file, a
+    background thread brings it up to date while the current one is served.
+    """
+    config = get_config()
+    path = config['MODEL_PATH']
+    if (
+        _model is None or time.monotonic() - _model_refreshed_at > config['REFRESH_INTERVAL']
+        or (path and os.path.exists(path) and os.path.getmtime(path) > _model_loaded_at)
+    ):
+        schedule_refresh()
+    return _model
+
+
+def schedule_refresh():
+    """Run refresh_model on a background thread unless one is already running"""
+    global _refresh_thread
+    with _model_lock:
+        if _refresh_thread is None:
+            _refresh_thread = threading.Thread(
+                target=_refresh_in_background, name='recommendations-refresh', daemon=True
+            )
+            _refresh_thread.start()
+
+
+def _refresh_in_background():
+    global _refresh_thread
+    close_old_connections()
+    try:
+        refresh_model()
+    except Exception:
+        logger.exception('Could not refresh the recommendation model')
+    finally:
+        close_old_connections()
+        with _model_lock:
+            _refresh_thread = None
+
+
+def refresh_model():
+    """Bring the process-wide model up to date and swap it in.
+
+    A model file newer than the model is loaded, without either the model
+    is built from every interaction, and then new interactions are folded
+    in. Returns the model.
+    """
+    global _model, _model_loaded_at, _model_refreshed_at
+    config = get_config()
+    path = config['MODEL_PATH']
+    with _model_lock:
+        model, loaded_at, generation = _model, _model_loaded_at, _model_generation
+
+    mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+    if mtime is not None and (model is None or mtime > loaded_at):
+        try:
+            model = CooccurrenceModel.load(path, history=config['HISTORY'], weights=config['WEIGHTS'])
+        except ValueError:
+            # Left behind by an older release; build_recommendations replaces it
+            logger.warning('Ignoring outdated recommendation model %s', path)
+            model = model or CooccurrenceModel(history=config['HISTORY'], weights=config['WEIGHTS'])
+        loaded_at = mtime
+        model.update()
+    elif model is None:
+        model = build_model(config)
+    else:
+        model.update()
+
+    with _model_lock:
+        # A reset while refreshing wins over the refreshed model
+        if generation == _model_generation:
+            _model, _model_loaded_at, _model_refreshed_at = model, loaded_at, time.monotonic()
+    return model
+
+
+def reset_model():
+    global _model, _model_loaded_at, _model_refreshed_at, _model_generation
+    with _model_lock:
+        _model, _model_loaded_at, _model_refreshed_at = None, 0, 0
+        _model_generation += 1
+
+
+def recommend_items(user, limit=10, queryset=None):
+    """Available items for the user, most similar to their history first.
+
+    Users without enough history are topped up with the most interacted-with
+    items. Until the process has a model, the newest available items are served.
+    """
+    if queryset is None:
+        queryset = ClothingItem.objects.all()
+    model = get_model()
+    if model is None:
+        return list(queryset.filter(status='available').exclude(owner=user).order_by('-created_at')[:limit])
+
+    with model.lock:
+        seen = list(model.history.get(user.id, []))
+    ranked = [item_id for item_id, _ in model.recommend(user.id, limit=limit * 3)]
+    if len(ranked) < limit * 3:
+        ranked += [item_id for item_id, _ in model.popular(exclude=seen + ranked, limit=limit * 3)]
+
+    items = queryset.filter(pk__in=ranked, status='available').exclude(owner=user).in_bulk()
+    return [items[item_id] for item_id in ranked if item_id in items][:limit]
@@ -0,0 +1,175 @@
+import re
+
+from django.db import connection, connections
+from django.db.models import F, Q
+from rest_framework import filters
+
+
+FTS_TABLE = 'core_clothingitem_fts'
+
+# Column weights used for relevance ranking (title, description, tags)
+FTS_WEIGHTS = (10.0, 1.0, 5.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# SQLite keeps the FTS5 table in sync through triggers, so bulk update()
+# calls (admin actions, moderation) are indexed as well as model saves.
+SQLITE_INDEX_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description, tags,
+        content='core_clothingitem', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON core_clothingitem BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description, tags)
+        VALUES (new.id, new.title, new.description, new.tags);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON core_clothingitem BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, tags)
+        VALUES ('delete', old.id, old.title, old.description, old.tags);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF title, description, tags ON core_clothingitem BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, tags)
+        VALUES ('delete', old.id, old.title, old.description, old.tags);
+        INSERT INTO {FTS_TABLE}(rowid, title, description, tags)
+        VALUES (new.id, new.title, new.description, new.tags);
+    END
+    """,
+]
+
+SQLITE_DROP_SQL = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def install_search_index(using='default', rebuild=False):
+    """Create the SQLite FTS5 index and its triggers, or heal a broken one.
+
+    Django rebuilds SQLite tables on most ALTERs, which drops the triggers,
+    so this also runs after every migrate and re-indexes when it had to heal.
+    Without rebuild=True nothing is created unless the index already exists.
+    """
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return False
+
+    with conn.cursor() as cursor:
+        if not rebuild:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name = %s OR "
+                "(type = 'trigger' AND tbl_name = 'core_clothingitem' AND name LIKE %s)",
+                [FTS_TABLE, f'{FTS_TABLE}_a_'],
+            )
+            names = {row[0] for row in cursor.fetchall()}
+            if FTS_TABLE not in names or len(names) == 4:
+                return False
+        for sql in SQLITE_INDEX_SQL:
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def drop_search_index(using='default'):
+    """Remove the SQLite FTS5 index and its triggers"""
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for sql in SQLITE_DROP_SQL:
+            cursor.execute(sql)
+
+
+def build_fts_query(query):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    tokens = _TOKEN_RE.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_queryset(queryset, query):
+    """Filter a ClothingItem queryset by full-text query, annotated with search_rank.
+
+    Lower search_rank is always more relevant, whatever the backend.
+    """
+    query = (query or '').strip()
+    if not query:
+        return queryset
+
+    if connection.vendor == 'sqlite':
+        match = build_fts_query(query)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        return queryset.extra(
+            select={'search_rank': f'bm25({FTS_TABLE}, {weights})'},
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE}.rowid = core_clothingitem.id',
+                f'{FTS_TABLE} MATCH %s',
+            ],
+            params=[match],
+        )
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        search_query = SearchQuery(query, config='english', search_type='websearch')
+        return queryset.alias(
+            search_document=search_vector()
+        ).filter(search_document=search_query).annotate(
+            search_rank=-SearchRank(F('search_document'), search_query)
+        )
+
+    # Other backends have no full-text index, fall back to substring matching
+    return queryset.filter(
+        Q(title__icontains=query) |
+        Q(description__icontains=query) |
+        Q(tags__icontains=query)
+    )
+
+
+def search_vector():
+    """Weighted tsvector expression matching the GIN index built in migrations"""
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('title', weight='A', config='english') +
+        SearchVector('tags', weight='B', config='english') +
+        SearchVector('description', weight='C', config='english')
+    )
+
+
+def order_by_relevance(queryset):
+    """Order search results by rank, newest first among equally ranked items"""
+    query = queryset.query
+    if 'search_rank' in query.extra or 'search_rank' in query.annotations:
+        return queryset.order_by('search_rank', '-created_at')
+    return queryset.order_by('-created_at')
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """SearchFilter backed by the full-text index instead of icontains scans.
+
+    Results are relevance-ranked unless the client asks for an explicit
+    ordering, so this backend must run after OrderingFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+
+        queryset = search_queryset(queryset, query)
+        if not request.query_params.get(filters.OrderingFilter.ordering_param):
+            queryset = order_by_relevance(queryset)
+        return queryset
@@ -1,13 +1,205 @@
 from rest_framework import serializers
+from rest_framework.fields import get_attribute
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.db import models
+from .images import build_srcset, placeholder_url
+from .metrics import timed
+from .moderation import ACTIONS as MODERATION_ACTIONS, MAX_BATCH_SIZE as MAX_MODERATION_BATCH_SIZE
 from .models import (
     UserProfile, Category, ClothingItem, ItemImage, SwapRequest,
     PointsTransaction, PointsRedemption, Notification, UserInteraction
 )
 
 
-class UserSerializer(serializers.ModelSerializer):
+def get_user_points(context):
+    """Points balance of the requesting user, loaded once per serializer context"""
+    if 'user_points' not in context:
+        request = context.get('request')
+        user = getattr(request, 'user', None)
+        context['user_points'] = None
+        if user is not None and user.is_authenticated:
+            try:
+                context['user_points'] = user.profile.points_balance
+            except UserProfile.DoesNotExist:
+                pass
+    return context['user_points']
+
+
+def item_can_swap(status, for_swap, owner_id, user_id):
+    return status == 'available' and for_swap and owner_id != user_id
+
+
+def item_can_redeem(status, for_points, owner_id, points_value, user_id, user_points):
+    return (status == 'available' and
+            for_points and
+            owner_id != user_id and
+            user_points >= points_value)
+
+
+def apply_viewer_fields(data, request):
+    """Recompute can_swap/can_redeem of serialized items for the requesting user.
+
+    Lets one cached item payload serve every viewer, see core.cache.
+    """
+    user = request.user
+    authenticated = user.is_authenticated
+    context = {'request': request}
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        items = data['results']
+    elif isinstance(data, list):
+        items = data
+    else:
+        items = [data]
+
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        # Either flag may have been left out by ?fields=
+        if 'can_swap' in item:
+            item['can_swap'] = authenticated and item_can_swap(
+                item['status'], item['is_available_for_swap'], item['owner']['id'], user.id
+            )
+        if 'can_redeem' in item:
+            item['can_redeem'] = authenticated and item_can_redeem(
+                item['status'], item['is_available_for_points'], item['owner']['id'], item['points_value'],
+                user.id, get_user_points(context) or 0
+            )
+    return items
+
+
+class TimedSerializerMixin:
+    """Count building the representation towards the request's serializer time"""
+
+    @timed('serializer_time')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+
+class BatchedListSerializer(serializers.ListSerializer):
+    """ListSerializer that lets the child prepare shared data for the whole page at once"""
+
+    @timed('serializer_time')
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        instances = list(iterable)
+        self.child.prime_context(instances)
+        return super().to_representation(instances)
+
+
+class BatchedSerializerMixin:
+    """Precompute per-request data for a batch of instances before serializing them.
+
+    The default walks nested batched serializers so that, for example, the
+    items of a page of swap requests are primed together.
+    """
+
+    def prime_context(self, instances):
+        for field in self.fields.values():
+            if field.write_only or not isinstance(field, BatchedSerializerMixin):
+                continue
+            related = []
+            for instance in instances:
+                try:
+                    value = get_attribute(instance, field.source_attrs)
+                except (AttributeError, KeyError):
+                    continue
+                if value is not None:
+                    related.append(value)
+            if related:
+                field.prime_context(related)
+
+
+# Query parameters of sparse fieldsets, see SparseFieldsetMixin
+FIELDS_QUERY_PARAM = 'fields'
+EXPAND_QUERY_PARAM = 'expand'
+
+
+def parse_field_paths(value):
+    """Tree of comma separated dotted names, 'id,owner.username' is {'id': {}, 'owner': {'username': {}}}"""
+    tree = {}
+    for path in value.split(','):
+        names = [name for name in path.strip().split('.') if name]
+        node = tree
+        for name in names:
+            node = node.setdefault(name, {})
+    return tree
+
+
+def merge_field_paths(tree, extra):
+    """tree plus the paths in extra; an empty subtree stands for every field"""
+    merged = dict(tree)
+    for name, subtree in extra.items():
+        if name not in merged:
+            merged[name] = subtree
+        elif merged[name] and subtree:
+            merged[name] = merge_field_paths(merged[name], subtree)
+        else:
+            merged[name] = {}
+    return merged
+
+
+def requested_fields(request):
+    """?fields= of a GET request as a tree of field names, None when every field is wanted"""
+    if not isinstance(request, Request) or request.method not in SAFE_METHODS:
+        return None
+    return parse_field_paths(request.query_params.get(FIELDS_QUERY_PARAM, '')) or None
+
+
+def select_fields(rows, request):
+    """Apply ?fields= to rows already serialized to dicts, such as a cached catalogue"""
+    only = requested_fields(request)
+    if only is None:
+        return rows
+    return [{name: value for name, value in row.items() if name in only or name == 'id'} for row in rows]
+
+
+class SparseFieldsetMixin(TimedSerializerMixin):
+    """Serialize only the fields the client asks for, expanding compact relations on request.
+
+    ?fields=id,title,owner.username keeps those fields of a GET response (id
+    always stays) and ?expand=owner swaps a field listed in
+    Meta.expandable_fields for its full serializer. Nested serializers get
+    their part of both from their parent. Meta.field_dependencies names the
+    fields a selected field needs alongside it.
+    """
+    # (fields tree or None for all of them, expand tree), set by the parent serializer
+    field_selection = None
+
+    def get_field_selection(self):
+        if self.field_selection is not None:
+            return self.field_selection
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        request = self.context.get('request')
+        if parent is not None or not isinstance(request, Request):
+            return None, {}
+        return requested_fields(request), parse_field_paths(request.query_params.get(EXPAND_QUERY_PARAM, ''))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = self.get_field_selection()
+        meta = getattr(self, 'Meta', None)
+
+        for name, serializer_class in getattr(meta, 'expandable_fields', {}).items():
+            if name in expand and name in fields:
+                fields[name] = serializer_class(read_only=True)
+        if only is not None:
+            only = merge_field_paths(only, {'id': {}})
+            for name, dependencies in getattr(meta, 'field_dependencies', {}).items():
+                if name in only:
+                    only = merge_field_paths(only, parse_field_paths(dependencies))
+            fields = {name: field for name, field in fields.items() if name in only or field.write_only}
+
+        for name, field in fields.items():
+            nested = getattr(field, 'child', field)
+            if isinstance(nested, SparseFieldsetMixin):
+                nested.field_selection = ((only or {}).get(name) or None, expand.get(name, {}))
+        return fields
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for User model"""
     class Meta:
         model = User
@@ -15,7 +207,14 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'date_joined']
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserCardSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Compact user embedded in lists, ?expand= gives the UserSerializer fields"""
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
+
+class UserProfileSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for UserProfile model"""
     user = UserSerializer(read_only=True)
     
@@ -69,26 +268,50 @@ class UserLoginSerializer(serializers.Serializer):
             raise serializers.ValidationError('Must include username and password')
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Category model"""
-    items_count = serializers.SerializerMethodField()
+    items_count = serializers.IntegerField(source='available_items_count', read_only=True)
 
     class Meta:
         model = Category
         fields = ['id', 'name', 'description', 'items_count', 'created_at']
 
-    def get_items_count(self, obj):
-        return obj.items.filter(status='available').count()
+
+class CategoryCardSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Compact category embedded in item cards"""
+    class Meta:
+        model = Category
+        fields = ['id', 'name']
 
 
-class ItemImageSerializer(serializers.ModelSerializer):
+class ItemImageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for ItemImage model"""
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ItemImage
-        fields = ['id', 'image', 'is_primary', 'uploaded_at']
+        fields = ['id', 'image', 'is_primary', 'processing_status', 'srcset', 'uploaded_at']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Show a placeholder until the worker pool has resized the upload
+        if instance.processing_status != 'ready':
+            data['image'] = placeholder_url(self.context.get('request'))
+        return data
+
+    def get_srcset(self, obj):
+        if obj.processing_status != 'ready' or not obj.variants:
+            return {}
+        request = self.context.get('request')
+        storage = obj.image.storage
+
+        def url_for(name):
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return build_srcset(obj.variants, url_for)
 
 
-class ClothingItemSerializer(serializers.ModelSerializer):
+class ClothingItemSerializer(SparseFieldsetMixin, BatchedSerializerMixin, serializers.ModelSerializer):
     """Serializer for ClothingItem model"""
     owner = UserSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
@@ -108,6 +331,17 @@ class ClothingItemSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'approved_at'
         ]
         read_only_fields = ['owner', 'status', 'approved_at']
+        list_serializer_class = BatchedListSerializer
+        # What apply_viewer_fields recomputes the flags of cached responses from
+        field_dependencies = {
+            'can_swap': 'owner.id,status,is_available_for_swap',
+            'can_redeem': 'owner.id,status,is_available_for_points,points_value',
+        }
+
+    def prime_context(self, instances):
+        super().prime_context(instances)
+        if 'can_redeem' in self.fields:
+            get_user_points(self.context)
 
     def get_tags_list(self, obj):
         return obj.get_tags_list()
@@ -116,26 +350,48 @@ class ClothingItemSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
-        return (obj.status == 'available' and 
-                obj.is_available_for_swap and 
-                obj.owner != request.user)
+        return item_can_swap(obj.status, obj.is_available_for_swap, obj.owner_id, request.user.id)
 
     def get_can_redeem(self, obj):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
-        user_points = request.user.profile.points_balance
-        return (obj.status == 'available' and 
-                obj.is_available_for_points and 
-                obj.owner != request.user and 
-                user_points >= obj.points_value)
+        return item_can_redeem(
+            obj.status, obj.is_available_for_points, obj.owner_id, obj.points_value,
+            request.user.id, get_user_points(self.context) or 0
+        )
 
     def create(self, validated_data):
         validated_data['owner'] = self.context['request'].user
         return super().create(validated_data)
 
 
-class ClothingItemCreateSerializer(serializers.ModelSerializer):
+class ItemCardSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Compact item embedded in swap, points and interaction lists.
+
+    Carries the primary image alone and the owner and category as cards;
+    ?expand= gives the ClothingItemSerializer fields.
+    """
+    owner = UserCardSerializer(read_only=True)
+    category = CategoryCardSerializer(read_only=True)
+    image = ItemImageSerializer(source='get_primary_image', read_only=True)
+
+    class Meta:
+        model = ClothingItem
+        fields = [
+            'id', 'title', 'type', 'size', 'condition', 'status', 'points_value',
+            'is_available_for_swap', 'is_available_for_points', 'owner', 'category', 'image', 'created_at'
+        ]
+
+
+class ModerationItemSerializer(ClothingItemSerializer):
+    """Item in the moderation queue, with the outcome of its automated triage"""
+
+    class Meta(ClothingItemSerializer.Meta):
+        fields = ClothingItemSerializer.Meta.fields + ['triage_status', 'triage_priority', 'triage_reasons']
+
+
+class ClothingItemCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for creating clothing items with image upload"""
     images = serializers.ListField(
         child=serializers.ImageField(), write_only=True, required=False
@@ -164,7 +420,7 @@ class ClothingItemCreateSerializer(serializers.ModelSerializer):
         return item
 
 
-class SwapRequestSerializer(serializers.ModelSerializer):
+class SwapRequestSerializer(SparseFieldsetMixin, BatchedSerializerMixin, serializers.ModelSerializer):
     """Serializer for SwapRequest model"""
     requester = UserSerializer(read_only=True)
     owner = UserSerializer(read_only=True)
@@ -181,6 +437,7 @@ class SwapRequestSerializer(serializers.ModelSerializer):
             'response_message', 'created_at', 'updated_at', 'completed_at'
         ]
         read_only_fields = ['requester', 'owner', 'completed_at']
+        list_serializer_class = BatchedListSerializer
 
     def validate(self, attrs):
         requester_item_id = attrs.get('requester_item_id')
@@ -228,7 +485,50 @@ class SwapRequestSerializer(serializers.ModelSerializer):
         return SwapRequest.objects.create(**validated_data)
 
 
-class PointsTransactionSerializer(serializers.ModelSerializer):
+class SwapRequestUpdateSerializer(SwapRequestSerializer):
+    """Owner's answer to a swap request: status along SwapRequest.STATUS_TRANSITIONS and response_message"""
+    requester_item_id = serializers.IntegerField(write_only=True, required=False)
+    requested_item_id = serializers.IntegerField(write_only=True, required=False)
+
+    class Meta(SwapRequestSerializer.Meta):
+        read_only_fields = [
+            'requester', 'owner', 'message', 'created_at', 'updated_at', 'completed_at'
+        ]
+
+    def validate_requester_item_id(self, value):
+        if value != self.instance.requester_item_id:
+            raise serializers.ValidationError("The items of a swap request can't be changed")
+        return value
+
+    def validate_requested_item_id(self, value):
+        if value != self.instance.requested_item_id:
+            raise serializers.ValidationError("The items of a swap request can't be changed")
+        return value
+
+    def validate_status(self, value):
+        if value not in SwapRequest.STATUS_TRANSITIONS.get(self.instance.status, []):
+            raise serializers.ValidationError(f"A {self.instance.status} swap request can't become {value}")
+        return value
+
+    def validate(self, attrs):
+        return attrs
+
+
+class SwapRequestListSerializer(SwapRequestSerializer):
+    """Swap request in list views, with cards for its users and items; ?expand= gives the full ones"""
+    requester = UserCardSerializer(read_only=True)
+    owner = UserCardSerializer(read_only=True)
+    requester_item = ItemCardSerializer(read_only=True)
+    requested_item = ItemCardSerializer(read_only=True)
+
+    class Meta(SwapRequestSerializer.Meta):
+        expandable_fields = {
+            'requester': UserSerializer, 'owner': UserSerializer,
+            'requester_item': ClothingItemSerializer, 'requested_item': ClothingItemSerializer,
+        }
+
+
+class PointsTransactionSerializer(SparseFieldsetMixin, BatchedSerializerMixin, serializers.ModelSerializer):
     """Serializer for PointsTransaction model"""
     user = UserSerializer(read_only=True)
     related_item = ClothingItemSerializer(read_only=True)
@@ -239,9 +539,19 @@ class PointsTransactionSerializer(serializers.ModelSerializer):
             'id', 'user', 'transaction_type', 'amount', 'description',
             'related_item', 'created_at'
         ]
+        list_serializer_class = BatchedListSerializer
+
+
+class PointsTransactionListSerializer(PointsTransactionSerializer):
+    """Points transaction in list views, with cards for its user and item; ?expand= gives the full ones"""
+    user = UserCardSerializer(read_only=True)
+    related_item = ItemCardSerializer(read_only=True)
 
+    class Meta(PointsTransactionSerializer.Meta):
+        expandable_fields = {'user': UserSerializer, 'related_item': ClothingItemSerializer}
 
-class PointsRedemptionSerializer(serializers.ModelSerializer):
+
+class PointsRedemptionSerializer(SparseFieldsetMixin, BatchedSerializerMixin, serializers.ModelSerializer):
     """Serializer for PointsRedemption model"""
     user = UserSerializer(read_only=True)
     item = ClothingItemSerializer(read_only=True)
@@ -254,6 +564,7 @@ class PointsRedemptionSerializer(serializers.ModelSerializer):
             'message', 'created_at', 'updated_at', 'completed_at'
         ]
         read_only_fields = ['user', 'points_used', 'completed_at']
+        list_serializer_class = BatchedListSerializer
 
     def validate(self, attrs):
         item_id = attrs.get('item_id')
@@ -298,20 +609,35 @@ class PointsRedemptionSerializer(serializers.ModelSerializer):
         return PointsRedemption.objects.create(**validated_data)
 
 
-class NotificationSerializer(serializers.ModelSerializer):
-    """Serializer for Notification model"""
-    related_item = ClothingItemSerializer(read_only=True)
-    related_swap = SwapRequestSerializer(read_only=True)
+class PointsRedemptionListSerializer(PointsRedemptionSerializer):
+    """Points redemption in list views, with cards for its user and item; ?expand= gives the full ones"""
+    user = UserCardSerializer(read_only=True)
+    item = ItemCardSerializer(read_only=True)
+
+    class Meta(PointsRedemptionSerializer.Meta):
+        expandable_fields = {'user': UserSerializer, 'item': ClothingItemSerializer}
+
+
+class NotificationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Serializer for Notification model, related rows come from the stored payload without a join"""
+    related_item = serializers.SerializerMethodField()
+    related_swap = serializers.SerializerMethodField()
 
     class Meta:
         model = Notification
         fields = [
-            'id', 'notification_type', 'title', 'message', 'is_read',
+            'id', 'notification_type', 'title', 'message', 'is_read', 'count', 'group_key',
             'related_item', 'related_swap', 'created_at'
         ]
 
+    def get_related_item(self, obj):
+        return obj.payload.get('item')
+
+    def get_related_swap(self, obj):
+        return obj.payload.get('swap')
+
 
-class UserInteractionSerializer(serializers.ModelSerializer):
+class UserInteractionSerializer(SparseFieldsetMixin, BatchedSerializerMixin, serializers.ModelSerializer):
     """Serializer for UserInteraction model"""
     item = ClothingItemSerializer(read_only=True)
 
@@ -320,9 +646,10 @@ class UserInteractionSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'interaction_type', 'item', 'search_query', 'created_at'
         ]
+        list_serializer_class = BatchedListSerializer
 
 
-class DashboardStatsSerializer(serializers.Serializer):
+class DashboardStatsSerializer(TimedSerializerMixin, serializers.Serializer):
     """Serializer for user dashboard statistics"""
     total_items = serializers.IntegerField()
     available_items = serializers.IntegerField()
@@ -332,3 +659,12 @@ class DashboardStatsSerializer(serializers.Serializer):
     ongoing_swaps = serializers.IntegerField()
     completed_swaps = serializers.IntegerField()
     unread_notifications = serializers.IntegerField()
+
+
+class BatchModerationSerializer(serializers.Serializer):
+    """Input of the batch moderation endpoint"""
+    action = serializers.ChoiceField(choices=MODERATION_ACTIONS)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=MAX_MODERATION_BATCH_SIZE
+    )
+    message = serializers.CharField(required=False, allow_blank=True, default='')
@@ -0,0 +1,208 @@
+from functools import partial
+
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token, forget_user
+from .cache import invalidate_category_catalogue, invalidate_public_responses
+from .events import publish
+from .images import delete_image_files
+from .models import Category, ClothingItem, ItemImage, SwapRequest, Notification, UserProfile
+from .search import install_search_index
+from .stats import (
+    apply_stats_changes, count_item, count_notification, count_swap, materialized_stats_enabled
+)
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using='default', **kwargs):
+    """Reinstall the full-text index triggers if a table rebuild dropped them"""
+    if sender.name == 'core':
+        install_search_index(using)
+
+
+# Category.available_items_count counter cache.
+# Bulk queryset.update() calls bypass these signals and must call
+# Category.objects.filter(...).recount_available_items() themselves.
+
+def adjust_available_count(category_id, delta):
+    Category.objects.filter(pk=category_id).update(
+        available_items_count=F('available_items_count') + delta
+    )
+
+
+def read_stored_state(instance, using, *fields):
+    """The stored values of a row about to be saved, None for a new row.
+
+    Inside a transaction the row stays locked until it commits, so a
+    concurrent save of the same row waits and then reads this save's
+    values instead of applying its counter changes from the same ones.
+    """
+    rows = type(instance)._default_manager.using(using).filter(pk=instance.pk)
+    if connections[using].in_atomic_block:
+        rows = rows.select_for_update()
+    return rows.values_list(*fields).first()
+
+
+@receiver(pre_save, sender=ClothingItem)
+def remember_counted_state(sender, instance, raw=False, using='default', **kwargs):
+    """Read the stored category, status and owner, which in-memory instances may not reflect"""
+    instance._counted_state = (None, None, None)
+    if not raw and instance.pk is not None:
+        stored = read_stored_state(instance, using, 'category_id', 'status', 'owner_id')
+        if stored:
+            instance._counted_state = stored
+
+
+@receiver(post_save, sender=ClothingItem)
+def update_available_count_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    old_category, old_status, _ = instance._counted_state
+    new_category, new_status = instance.category_id, instance.status
+
+    was_counted = old_status == 'available'
+    is_counted = new_status == 'available'
+    if was_counted and is_counted and old_category == new_category:
+        return
+
+    if was_counted:
+        adjust_available_count(old_category, -1)
+    if is_counted:
+        adjust_available_count(new_category, 1)
+    if was_counted or is_counted:
+        invalidate_category_catalogue()
+
+
+@receiver(post_delete, sender=ClothingItem)
+def update_available_count_on_delete(sender, instance, **kwargs):
+    if instance.status == 'available':
+        adjust_available_count(instance.category_id, -1)
+        invalidate_category_catalogue()
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalogue_on_category_change(sender, **kwargs):
+    invalidate_category_catalogue()
+
+
+# Cached public item responses, see core.cache.PublicResponseCacheMixin.
+# Category changes already invalidate them through the catalogue.
+
+@receiver([post_save, post_delete], sender=ClothingItem)
+@receiver([post_save, post_delete], sender=ItemImage)
+def invalidate_responses_on_item_change(sender, raw=False, **kwargs):
+    if not raw:
+        invalidate_public_responses()
+
+
+# Django leaves stored files behind when their row goes away
+
+@receiver(post_delete, sender=ItemImage)
+def delete_files_on_image_delete(sender, instance, **kwargs):
+    names = [variant['name'] for variant in instance.variants]
+    if instance.image:
+        names.append(instance.image.name)
+    # After commit, so a rolled back delete keeps its files
+    transaction.on_commit(partial(delete_image_files, instance.image.storage, names))
+
+
+# Materialized dashboard stats, see core.stats. Each save or delete moves the
+# counters of the users involved by the difference between the stored and the
+# new row; bulk writes apply the same changes themselves.
+
+@receiver(post_save, sender=ClothingItem)
+def update_stats_on_item_save(sender, instance, raw=False, **kwargs):
+    if raw or not materialized_stats_enabled():
+        return
+    _, old_status, old_owner = instance._counted_state
+    changes = {}
+    if old_status is not None:
+        count_item(changes, old_owner, old_status, -1)
+    apply_stats_changes(count_item(changes, instance.owner_id, instance.status))
+
+
+@receiver(post_delete, sender=ClothingItem)
+def update_stats_on_item_delete(sender, instance, **kwargs):
+    if materialized_stats_enabled():
+        apply_stats_changes(count_item({}, instance.owner_id, instance.status, -1))
+
+
+@receiver(pre_save, sender=SwapRequest)
+def remember_swap_stats_state(sender, instance, raw=False, using='default', **kwargs):
+    instance._stats_state = None
+    if materialized_stats_enabled() and not raw and instance.pk is not None:
+        instance._stats_state = read_stored_state(instance, using, 'requester_id', 'owner_id', 'status')
+
+
+@receiver(post_save, sender=SwapRequest)
+def update_stats_on_swap_save(sender, instance, raw=False, **kwargs):
+    if raw or not materialized_stats_enabled():
+        return
+    changes = {}
+    stored = getattr(instance, '_stats_state', None)
+    if stored is not None:
+        count_swap(changes, *stored, -1)
+    apply_stats_changes(count_swap(changes, instance.requester_id, instance.owner_id, instance.status))
+
+
+@receiver(post_delete, sender=SwapRequest)
+def update_stats_on_swap_delete(sender, instance, **kwargs):
+    if materialized_stats_enabled():
+        apply_stats_changes(count_swap({}, instance.requester_id, instance.owner_id, instance.status, -1))
+
+
+@receiver(pre_save, sender=Notification)
+def remember_notification_stats_state(sender, instance, raw=False, using='default', **kwargs):
+    instance._stats_state = None
+    if materialized_stats_enabled() and not raw and instance.pk is not None:
+        instance._stats_state = read_stored_state(instance, using, 'user_id', 'is_read')
+
+
+@receiver(post_save, sender=Notification)
+def update_stats_on_notification_save(sender, instance, raw=False, **kwargs):
+    if raw or not materialized_stats_enabled():
+        return
+    changes = {}
+    stored = getattr(instance, '_stats_state', None)
+    if stored is not None:
+        count_notification(changes, *stored, -1)
+    apply_stats_changes(count_notification(changes, instance.user_id, instance.is_read))
+
+
+@receiver(post_delete, sender=Notification)
+def update_stats_on_notification_delete(sender, instance, **kwargs):
+    if materialized_stats_enabled():
+        apply_stats_changes(count_notification({}, instance.user_id, instance.is_read, -1))
+
+
+# Wake the recipient's notification streams once the row is visible to them
+
+@receiver(post_save, sender=Notification)
+def publish_new_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(partial(publish, instance.user_id))
+
+
+# Cached token logins carry the user and profile; drop them when either changes
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+    # Signed tokens are cached per user and versioned by this token
+    forget_user(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_changed_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def forget_changed_profile(sender, instance, **kwargs):
+    forget_user(instance.user_id)
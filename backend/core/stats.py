@@ -0,0 +1,179 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, F, IntegerField, Q
+from django.db.models.functions import Greatest
+
+from .models import ClothingItem, SwapRequest, Notification, UserProfile, UserStats
+
+
+COUNTER_FIELDS = [
+    'total_items', 'available_items', 'pending_items', 'pending_swap_requests',
+    'ongoing_swaps', 'completed_swaps', 'unread_notifications',
+]
+
+
+def materialized_stats_enabled():
+    return getattr(settings, 'REWEAR_MATERIALIZED_STATS', False)
+
+
+def item_counters():
+    return {
+        'total_items': Count('pk'),
+        'available_items': Count('pk', filter=Q(status='available')),
+        'pending_items': Count('pk', filter=Q(status='pending')),
+    }
+
+
+def swap_counters(user_id):
+    return {
+        'pending_swap_requests': Count('pk', filter=Q(owner_id=user_id, status='pending')),
+        'ongoing_swaps': Count('pk', filter=Q(status='accepted')),
+        'completed_swaps': Count('pk', filter=Q(status='completed')),
+    }
+
+
+def user_swaps(user_id):
+    return SwapRequest.objects.filter(Q(requester_id=user_id) | Q(owner_id=user_id))
+
+
+def compute_user_stats(user_id):
+    """Dashboard counters for one user, with one conditional aggregate per table"""
+    stats = ClothingItem.objects.filter(owner_id=user_id).aggregate(**item_counters())
+    stats.update(user_swaps(user_id).aggregate(**swap_counters(user_id)))
+    stats['unread_notifications'] = Notification.objects.filter(
+        user_id=user_id, is_read=False
+    ).count()
+    return stats
+
+
+async def acompute_user_stats(user_id):
+    """compute_user_stats through the async ORM"""
+    stats = await ClothingItem.objects.filter(owner_id=user_id).aaggregate(**item_counters())
+    stats.update(await user_swaps(user_id).aaggregate(**swap_counters(user_id)))
+    stats['unread_notifications'] = await Notification.objects.filter(
+        user_id=user_id, is_read=False
+    ).acount()
+    return stats
+
+
+def add_counts(changes, user_id, counts, sign=1):
+    """Add counts, {counter: n}, to changes[user_id], or take them away with sign=-1"""
+    if user_id is None:
+        return changes
+    counters = changes.setdefault(user_id, {})
+    for name, value in counts.items():
+        counters[name] = counters.get(name, 0) + sign * value
+    return changes
+
+
+def count_item(changes, owner_id, status, sign=1):
+    return add_counts(changes, owner_id, {
+        'total_items': 1,
+        'available_items': int(status == 'available'),
+        'pending_items': int(status == 'pending'),
+    }, sign)
+
+
+def count_swap(changes, requester_id, owner_id, status, sign=1):
+    counts = {'ongoing_swaps': int(status == 'accepted'), 'completed_swaps': int(status == 'completed')}
+    add_counts(changes, requester_id, counts, sign)
+    return add_counts(changes, owner_id, {**counts, 'pending_swap_requests': int(status == 'pending')}, sign)
+
+
+def count_notification(changes, user_id, is_read, sign=1):
+    return add_counts(changes, user_id, {'unread_notifications': int(not is_read)}, sign)
+
+
+def apply_stats_changes(changes):
+    """Move the stats rows by changes, {user id: {counter: delta}}, one UPDATE per user.
+
+    Users without a row yet are skipped, get_dashboard_stats computes theirs
+    in full on first read. Counters never drop below zero.
+    """
+    if not materialized_stats_enabled():
+        return
+    for user_id, counters in changes.items():
+        updates = {
+            name: F(name) + delta if delta > 0 else Greatest(F(name) + delta, 0, output_field=IntegerField())
+            for name, delta in counters.items() if delta
+        }
+        if updates:
+            UserStats.objects.filter(user_id=user_id).update(**updates)
+
+
+def rebuild_user_stats(user_ids):
+    """Recompute stats rows for a batch of users with grouped aggregates and bulk writes"""
+    user_ids = list(user_ids)
+    stats = {user_id: dict.fromkeys(COUNTER_FIELDS, 0) for user_id in user_ids}
+
+    for row in ClothingItem.objects.filter(owner_id__in=user_ids).order_by().values(
+        'owner_id'
+    ).annotate(**item_counters()):
+        stats[row.pop('owner_id')].update(row)
+
+    for row in SwapRequest.objects.filter(owner_id__in=user_ids).order_by().values(
+        'owner_id'
+    ).annotate(
+        pending_swap_requests=Count('pk', filter=Q(status='pending')),
+        ongoing_swaps=Count('pk', filter=Q(status='accepted')),
+        completed_swaps=Count('pk', filter=Q(status='completed')),
+    ):
+        stats[row.pop('owner_id')].update(row)
+
+    # A user is never both sides of one swap, so sent swaps add to the totals
+    for row in SwapRequest.objects.filter(requester_id__in=user_ids).order_by().values(
+        'requester_id'
+    ).annotate(
+        ongoing_swaps=Count('pk', filter=Q(status='accepted')),
+        completed_swaps=Count('pk', filter=Q(status='completed')),
+    ):
+        counters = stats[row['requester_id']]
+        counters['ongoing_swaps'] += row['ongoing_swaps']
+        counters['completed_swaps'] += row['completed_swaps']
+
+    for row in Notification.objects.filter(user_id__in=user_ids, is_read=False).order_by().values(
+        'user_id'
+    ).annotate(unread_notifications=Count('pk')):
+        stats[row['user_id']]['unread_notifications'] = row['unread_notifications']
+
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id, **counters) for user_id, counters in stats.items()],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=COUNTER_FIELDS,
+    )
+    return len(stats)
+
+
+def get_dashboard_stats(user):
+    """Dashboard payload for the user, from the stats row when materialized"""
+    stats = None
+    if materialized_stats_enabled():
+        stats = UserStats.objects.filter(user=user).values(*COUNTER_FIELDS).first()
+        if stats is None:
+            rebuild_user_stats([user.id])
+            stats = UserStats.objects.filter(user=user).values(*COUNTER_FIELDS).first()
+    if stats is None:
+        stats = compute_user_stats(user.id)
+    return add_points_balance(stats, user)
+
+
+async def aget_dashboard_stats(user):
+    """get_dashboard_stats for async views, the user's profile must already be loaded"""
+    stats = None
+    if materialized_stats_enabled():
+        stats = await UserStats.objects.filter(user=user).values(*COUNTER_FIELDS).afirst()
+        if stats is None:
+            await sync_to_async(rebuild_user_stats)([user.id])
+            stats = await UserStats.objects.filter(user=user).values(*COUNTER_FIELDS).afirst()
+    if stats is None:
+        stats = await acompute_user_stats(user.id)
+    return add_points_balance(stats, user)
+
+
+def add_points_balance(stats, user):
+    try:
+        stats['points_balance'] = user.profile.points_balance
+    except UserProfile.DoesNotExist:
+        stats['points_balance'] = 0
+    return stats
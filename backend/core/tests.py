@@ -1,3 +1,2021 @@
-from django.test import TestCase
+import io
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.contrib.admin import AdminSite
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, QuerySet, Sum
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .models import (
+    UserProfile, Category, ClothingItem, ItemImage, SwapRequest, PointsTransaction,
+    PointsRedemption, Notification, UserInteraction, UserStats
+)
+from . import async_views, urls as core_urls
+from .admin import ClothingItemAdmin
+from .authentication import get_token_cache
+from .benchmark import (
+    FAST_PATH_SCENARIOS, SCENARIOS, check_budgets, compare_fast_path, core_route_names, default_budgets,
+    run_benchmarks
+)
+from .datagen import generate
+from .fastpath import ItemRows, RowMapper
+from .images import difference_hash, process_item_image
+from .events import Broker, DatabaseBroker, ThreadSubscription, get_broker, get_config as get_events_config, reset_broker
+from .matching import MatchIndex, rebuild_match_index, reset_match_index
+from .metrics import RequestMetrics, registry
+from .notifications import build_notification, item_summary, notify, prune_notifications, send_notifications
+from .points import InsufficientPoints, apply_points, find_balance_drift
+from .recommendations import CooccurrenceModel, get_model, refresh_model, reset_model
+from .renderers import FastJSONRenderer
+from .search import FTS_TABLE, order_by_relevance, search_queryset
+from .serializers import ClothingItemSerializer, NotificationSerializer, PointsRedemptionSerializer
+from .triage import BKTree, has_contact_details, reset_triage_index, text_hash, triage_item
+
+
+# Write tracked interactions inline so no flusher thread outlives the test database
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class ListQueryCountTests(TestCase):
+    """Every list endpoint must run a fixed number of queries, whatever the page size"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='alice', is_staff=True)
+        self.other = User.objects.create(username='bob')
+        UserProfile.objects.create(user=self.user, points_balance=100)
+        UserProfile.objects.create(user=self.other, points_balance=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.batch = 0
+
+    def add_rows(self, count):
+        """Create count of each kind of row, spread over fresh categories"""
+        for _ in range(count):
+            self.batch += 1
+            category = Category.objects.create(name=f'Category {self.batch}')
+            mine = self.make_item(self.user, category, 'available')
+            theirs = self.make_item(self.other, category, 'available')
+            self.make_item(self.other, category, 'pending')
+            self.make_item(self.user, category, 'pending')
+
+            swap = SwapRequest.objects.create(
+                requester_item=mine, requested_item=theirs,
+                requester=self.user, owner=self.other
+            )
+            SwapRequest.objects.create(
+                requester_item=theirs, requested_item=mine,
+                requester=self.other, owner=self.user
+            )
+            PointsTransaction.objects.create(
+                user=self.user, transaction_type='earned', amount=5,
+                description='Listing', related_item=mine
+            )
+            PointsRedemption.objects.create(user=self.user, item=theirs, points_used=10)
+            Notification.objects.create(
+                user=self.user, notification_type='swap_accepted', title='Accepted',
+                message='Accepted', related_item=theirs, related_swap=swap
+            )
+
+    def make_item(self, owner, category, status):
+        item = ClothingItem.objects.create(
+            title=f'Denim jacket {self.batch}', description='Classic blue denim',
+            category=category, type='unisex', size='m', condition='good',
+            owner=owner, status=status, tags='denim, vintage'
+        )
+        # bulk_create skips ItemImage.save, which expects a real file on disk
+        ItemImage.objects.bulk_create([
+            ItemImage(item=item, image=f'item_images/{owner.username}-{self.batch}.jpg')
+        ])
+        return item
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def assert_constant_queries(self, url):
+        self.add_rows(2)
+        small = self.count_queries(url)
+        self.add_rows(6)
+        large = self.count_queries(url)
+        self.assertEqual(small, large, f'{url} runs more queries as the page grows')
+
+    def test_categories(self):
+        self.assert_constant_queries('/api/categories/')
+
+    def test_items(self):
+        self.assert_constant_queries('/api/items/')
+
+    def test_items_search(self):
+        self.assert_constant_queries('/api/items/?search=denim')
+
+    def test_featured_items(self):
+        self.assert_constant_queries('/api/items/featured/')
+
+    def test_my_items(self):
+        self.assert_constant_queries('/api/items/my-items/')
+
+    def test_search(self):
+        self.assert_constant_queries('/api/search/?q=denim')
+
+    def test_swaps(self):
+        for request_type in ['all', 'sent', 'received']:
+            with self.subTest(request_type=request_type):
+                self.assert_constant_queries(f'/api/swaps/?type={request_type}')
+
+    def test_points_transactions(self):
+        self.assert_constant_queries('/api/points/transactions/')
+
+    def test_points_redemptions(self):
+        self.assert_constant_queries('/api/points/redemptions/')
+
+    def test_notifications(self):
+        self.assert_constant_queries('/api/notifications/')
+
+    def test_admin_pending_items(self):
+        self.assert_constant_queries('/api/admin/items/pending/')
+
+
+class KeysetPaginationTests(TestCase):
+    """?pagination=cursor walks feeds by (created_at, id) without OFFSET or COUNT"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='alice', is_staff=True)
+        UserProfile.objects.create(user=self.user)
+        category = Category.objects.create(name='Shirts')
+        ClothingItem.objects.bulk_create([
+            ClothingItem(
+                title=f'Shirt {i}', description='Plain shirt', category=category,
+                type='unisex', size='m', condition='good', owner=self.user, status='available'
+            )
+            for i in range(25)
+        ])
+        # Several rows share a timestamp so the id tie-break is exercised
+        ids = list(ClothingItem.objects.values_list('id', flat=True))
+        ClothingItem.objects.filter(id__in=ids[5:15]).update(
+            created_at=ClothingItem.objects.get(id=ids[5]).created_at
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, key):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertNotIn('count', response.data)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data[key]
+        return pages
+
+    def test_forward_and_backward_walks_match_page_numbers(self):
+        expected = list(ClothingItem.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        forward = self.walk('/api/items/?pagination=cursor&page_size=7', 'next')
+        self.assertEqual([len(page) for page in forward], [7, 7, 7, 4])
+        self.assertEqual(sum(forward, []), expected)
+
+        last_page = self.client.get('/api/items/?pagination=cursor&page_size=7')
+        for _ in range(3):
+            last_page = self.client.get(last_page.data['next'])
+        backward = self.walk(last_page.data['previous'], 'previous')
+        self.assertEqual(sum(reversed(backward), []), expected[:21])
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/points/transactions/?pagination=cursor')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in ctx.captured_queries))
+
+    def test_ascending_feed(self):
+        ClothingItem.objects.update(status='pending')
+        pages = self.walk('/api/admin/items/pending/?pagination=cursor&page_size=10', 'next')
+        expected = list(ClothingItem.objects.order_by('created_at', 'id').values_list('id', flat=True))
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/items/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class FullTextSearchTests(TestCase):
+    """Relevance-ranked search over the FTS5 index kept in sync by triggers"""
+
+    def setUp(self):
+        self.owner = User.objects.create(username='owner')
+        self.category = Category.objects.create(name='Jackets')
+        self.client = APIClient()
+
+    def make_item(self, title, description='Warm and plain', tags=''):
+        return ClothingItem.objects.create(
+            title=title, description=description, tags=tags, category=self.category, type='unisex',
+            size='m', condition='good', owner=self.owner, status='available'
+        )
+
+    def found(self, query):
+        return list(order_by_relevance(search_queryset(ClothingItem.objects.all(), query))
+                    .values_list('pk', flat=True))
+
+    def indexed(self, word):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [word])
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_title_outranks_tags_and_description(self):
+        in_description = self.make_item('Parka', description='Lined with denim')
+        in_title = self.make_item('Denim jacket')
+        in_tags = self.make_item('Bomber', tags='denim,blue')
+        self.make_item('Raincoat')
+        self.assertEqual(self.found('denim'), [in_title.pk, in_tags.pk, in_description.pk])
+
+        response = self.client.get('/api/items/?search=denim')
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [in_title.pk, in_tags.pk, in_description.pk])
+
+    def test_prefix_and_every_word(self):
+        jacket = self.make_item('Denim jacket')
+        self.make_item('Denim shirt')
+        cafe = self.make_item('Café apron')
+        self.assertEqual(self.found('jack'), [jacket.pk])
+        self.assertEqual(self.found('den jack'), [jacket.pk])
+        self.assertEqual(self.found('CAFE'), [cafe.pk])
+
+    def test_punctuation_only_queries(self):
+        self.make_item('Denim jacket')
+        # Nothing reaches FTS5 as query syntax, so none of these is a syntax error
+        for query in ('"', '*', '-- ()', 'NEAR(^:)'):
+            with self.subTest(query=query):
+                response = self.client.get('/api/items/', {'search': query})
+                self.assertEqual((response.status_code, response.data['count']), (200, 0))
+        self.assertEqual(self.found('"denim'), self.found('denim'))
+
+    def test_triggers_follow_writes(self):
+        item = self.make_item('Denim jacket')
+        self.assertEqual(self.indexed('denim'), [item.pk])
+
+        item.title = 'Corduroy jacket'
+        item.save()
+        self.assertEqual((self.indexed('denim'), self.indexed('corduroy')), ([], [item.pk]))
+
+        ClothingItem.objects.filter(pk=item.pk).update(tags='vintage')
+        self.assertEqual(self.indexed('vintage'), [item.pk])
+
+        item.delete()
+        self.assertEqual((self.indexed('corduroy'), self.indexed('vintage')), ([], []))
+
+
+class CategoryCounterTests(TestCase):
+    """Category.available_items_count follows item status changes"""
+
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.owner = User.objects.create(username='owner')
+        UserProfile.objects.create(user=self.owner)
+        self.shirts = Category.objects.create(name='Shirts')
+        self.pants = Category.objects.create(name='Pants')
+        self.client = APIClient()
+
+    def make_item(self, status='pending', category=None):
+        return ClothingItem.objects.create(
+            title='Shirt', description='Plain shirt', category=category or self.shirts,
+            type='unisex', size='m', condition='good', owner=self.owner, status=status
+        )
+
+    def assert_counts(self, shirts, pants):
+        self.shirts.refresh_from_db()
+        self.pants.refresh_from_db()
+        self.assertEqual(
+            (self.shirts.available_items_count, self.pants.available_items_count),
+            (shirts, pants)
+        )
+
+    def test_status_transitions(self):
+        item = self.make_item()
+        self.make_item(status='available')
+        self.assert_counts(1, 0)
+
+        self.client.force_authenticate(self.admin)
+        self.client.post(f'/api/admin/items/{item.id}/moderate/', {'action': 'approve'})
+        self.assert_counts(2, 0)
+
+        item.refresh_from_db()
+        item.category = self.pants
+        item.save()
+        self.assert_counts(1, 1)
+
+        item.status = 'in_swap'
+        item.save()
+        self.assert_counts(1, 0)
+
+        ClothingItem.objects.filter(status='available').delete()
+        self.assert_counts(0, 0)
+
+    def test_stale_instance(self):
+        item = self.make_item()
+        ClothingItem.objects.filter(pk=item.pk).update(status='available')
+        Category.objects.all().recount_available_items()
+        # The instance still believes it is pending
+        item.status = 'rejected'
+        item.save()
+        self.assert_counts(0, 0)
+
+    def test_save_locks_the_stored_row(self):
+        item = self.make_item()
+        item.status = 'available'
+        with patch.object(QuerySet, 'select_for_update', autospec=True,
+                          side_effect=QuerySet.select_for_update) as lock:
+            item.save()
+        lock.assert_called_once()
+        self.assert_counts(1, 0)
+
+    def test_catalogue_served_without_queries(self):
+        self.make_item(status='available')
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response.data['results'][0]['items_count'], 1)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/categories/')
+        self.assertEqual(response.data['count'], 2)
+
+        self.make_item(status='available')
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response.data['results'][0]['items_count'], 2)
+
+
+class DashboardStatsTests(TestCase):
+    """Dashboard counters, aggregated on request or read from UserStats"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.other = User.objects.create(username='bob')
+        UserProfile.objects.create(user=self.user, points_balance=42)
+        UserProfile.objects.create(user=self.other)
+        category = Category.objects.create(name='Shirts')
+
+        def item(owner, status):
+            return ClothingItem.objects.create(
+                title='Shirt', description='Plain shirt', category=category, type='unisex',
+                size='m', condition='good', owner=owner, status=status
+            )
+
+        mine = [item(self.user, 'available'), item(self.user, 'available'), item(self.user, 'pending')]
+        theirs = [item(self.other, 'available') for _ in range(3)]
+        SwapRequest.objects.create(requester_item=theirs[0], requested_item=mine[0],
+                                   requester=self.other, owner=self.user, status='pending')
+        SwapRequest.objects.create(requester_item=mine[1], requested_item=theirs[1],
+                                   requester=self.user, owner=self.other, status='accepted')
+        SwapRequest.objects.create(requester_item=theirs[2], requested_item=mine[1],
+                                   requester=self.other, owner=self.user, status='completed')
+        Notification.objects.create(user=self.user, notification_type='general', title='Hi', message='Hi')
+        Notification.objects.create(user=self.user, notification_type='general', title='Hi',
+                                    message='Hi', is_read=True)
+
+        self.expected = {
+            'total_items': 3, 'available_items': 2, 'pending_items': 1, 'points_balance': 42,
+            'pending_swap_requests': 1, 'ongoing_swaps': 1, 'completed_swaps': 1,
+            'unread_notifications': 1,
+        }
+        self.client = APIClient()
+        # A freshly loaded user, as token authentication would provide
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+
+    def test_aggregated(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/dashboard/stats/')
+        self.assertEqual(response.data, self.expected)
+
+    def test_materialized(self):
+        from .stats import rebuild_user_stats
+
+        with self.settings(REWEAR_MATERIALIZED_STATS=True):
+            rebuild_user_stats([self.user.id, self.other.id])
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/dashboard/stats/')
+            self.assertEqual(response.data, self.expected)
+
+            self.client.post('/api/notifications/read-all/')
+            response = self.client.get('/api/dashboard/stats/')
+            self.assertEqual(response.data['unread_notifications'], 0)
+
+            SwapRequest.objects.filter(status='pending').update(status='rejected')
+            swap = SwapRequest.objects.get(status='accepted')
+            swap.status = 'completed'
+            swap.save()
+            response = self.client.get('/api/dashboard/stats/')
+            self.assertEqual(response.data['ongoing_swaps'], 0)
+            self.assertEqual(response.data['completed_swaps'], 2)
+
+    def test_materialized_changes(self):
+        from .moderation import moderate_items
+        from .stats import compute_user_stats, rebuild_user_stats
+
+        def stored(user):
+            return UserStats.objects.filter(user=user).values(*compute_user_stats(user.id)).get()
+
+        with self.settings(REWEAR_MATERIALIZED_STATS=True):
+            rebuild_user_stats([self.user.id, self.other.id])
+            item = ClothingItem.objects.filter(owner=self.user, status='pending').get()
+            moderate_items(self.other, [item.pk], 'approve')
+            item.refresh_from_db()
+            item.owner = self.other
+            # Moving an item costs the stored-state read and one UPDATE per owner
+            with self.assertNumQueries(4):
+                item.save()
+            ClothingItem.objects.filter(owner=self.other).first().delete()
+            notice = Notification.objects.create(user=self.other, notification_type='general', title='Hi',
+                                                 message='Hi')
+            notice.is_read = True
+            swap = SwapRequest.objects.get(status='pending')
+            swap.status = 'rejected'
+            # Both reads lock the stored row, so concurrent saves apply their deltas in turn
+            with patch.object(QuerySet, 'select_for_update', autospec=True,
+                              side_effect=QuerySet.select_for_update) as lock:
+                notice.save()
+                swap.save()
+            self.assertEqual(lock.call_count, 2)
+            send_notifications([
+                build_notification(self.user.id, 'general', 'Hi', 'Hi', group_key='hello') for _ in range(3)
+            ])
+            SwapRequest.objects.filter(status='accepted').delete()
+
+            for user in (self.user, self.other):
+                self.assertEqual(stored(user), compute_user_stats(user.id))
+
+
+class InteractionPipelineTests(TestCase):
+    """Item views and searches are queued and written in batches"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        UserProfile.objects.create(user=self.user)
+        category = Category.objects.create(name='Shirts')
+        self.item = ClothingItem.objects.create(
+            title='Denim shirt', description='Plain shirt', category=category, type='unisex',
+            size='m', condition='good', owner=self.user, status='available'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_buffer_flushes_in_one_batch(self):
+        from .interactions import InteractionBuffer, InteractionEvent
+
+        buffer = InteractionBuffer(max_events=100, max_delay=60)
+        # No add(): keep the background thread out of the test transaction
+        buffer._events = [
+            InteractionEvent(self.user.id, 'view', self.item.id, '', timezone.now())
+            for _ in range(50)
+        ]
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 50)
+        self.assertEqual(UserInteraction.objects.count(), 50)
+
+    def test_spool_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'BACKEND': 'spool', 'SPOOL_PATH': os.path.join(directory, 'events.spool')}
+            with self.settings(REWEAR_INTERACTIONS=config):
+                with CaptureQueriesContext(connection) as ctx:
+                    self.client.get(f'/api/items/{self.item.id}/')
+                    self.client.get('/api/search/?q=denim')
+                self.assertFalse(any(query['sql'].startswith('INSERT') for query in ctx.captured_queries))
+                call_command('flush_interactions', stdout=io.StringIO())
+                self.assertEqual(os.listdir(directory), [])
+
+        self.assertEqual(
+            sorted(UserInteraction.objects.values_list('interaction_type', 'item_id', 'search_query')),
+            [('search', None, 'denim'), ('view', self.item.id, '')]
+        )
+
+
+class InteractionSpoolRecoveryTests(TransactionTestCase):
+    """A spool file with bad events neither blocks the spool nor gets written twice"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        category = Category.objects.create(name='Shirts')
+        self.item = ClothingItem.objects.create(
+            title='Denim shirt', description='Plain shirt', category=category, type='unisex',
+            size='m', condition='good', owner=self.user, status='available'
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'events.spool')
+
+    def spool_file(self, name, item_ids, extra=''):
+        with open(os.path.join(self.directory.name, name), 'w') as spool:
+            for item_id in item_ids:
+                spool.write(json.dumps([self.user.id, 'view', item_id, '', timezone.now().isoformat()]) + '\n')
+            spool.write(extra)
+
+    def flush(self):
+        config = {'BACKEND': 'spool', 'SPOOL_PATH': self.path, 'MAX_EVENTS': 2, 'MAX_ATTEMPTS': 2}
+        err = io.StringIO()
+        with self.settings(REWEAR_INTERACTIONS=config):
+            call_command('flush_interactions', stdout=io.StringIO(), stderr=err)
+        return err.getvalue()
+
+    def test_deleted_items_are_dropped(self):
+        self.spool_file('events.spool', [self.item.id, self.item.id + 1000, None])
+        self.flush()
+        self.assertEqual(os.listdir(self.directory.name), [])
+        self.assertCountEqual(UserInteraction.objects.values_list('item_id', flat=True), [None, self.item.id])
+
+    def test_retry_skips_written_chunks(self):
+        self.spool_file('events.spool.1.1.work', [self.item.id] * 3)
+        with open(os.path.join(self.directory.name, 'events.spool.1.1.work.progress'), 'w') as progress:
+            json.dump({'written': 2, 'attempts': 0}, progress)
+        self.flush()
+        self.assertEqual(UserInteraction.objects.count(), 1)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_failing_file_is_quarantined(self):
+        self.spool_file('events.spool', [self.item.id] * 3, extra='not json\n')
+        self.assertIn('attempt 1', self.flush())
+        self.assertEqual(UserInteraction.objects.count(), 2)
+
+        # The next file still drains, the broken one resumes after its written chunk and is moved aside
+        self.spool_file('events.spool', [self.item.id])
+        self.assertIn('.failed after 2 failed drains', self.flush())
+        self.assertEqual(UserInteraction.objects.count(), 3)
+        remaining = sorted(os.listdir(self.directory.name))
+        self.assertEqual(len(remaining), 2)
+        self.assertTrue(remaining[0].endswith('.failed') and remaining[1].endswith('.failed.progress'), remaining)
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class ImageProcessingTests(TestCase):
+    """Uploads are resized after the request, with a placeholder until then"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.user = User.objects.create(username='alice')
+        UserProfile.objects.create(user=self.user)
+        self.category = Category.objects.create(name='Shirts')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, count):
+        images = []
+        for i in range(count):
+            buffer = io.BytesIO()
+            Image.new('RGB', (1600, 1200), 'navy').save(buffer, 'JPEG')
+            images.append(SimpleUploadedFile(f'shirt-{i}.jpg', buffer.getvalue(), 'image/jpeg'))
+
+        with self.settings(MEDIA_ROOT=self.media.name):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/items/create/', {
+                    'title': 'Shirt', 'description': 'Plain shirt', 'category': self.category.id,
+                    'type': 'unisex', 'size': 'm', 'condition': 'good', 'points_value': 10,
+                    'images': images,
+                }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response
+
+    def test_placeholder_until_processed(self):
+        with self.settings(REWEAR_IMAGE_PROCESSING={'BACKEND': 'queue'}):
+            response = self.upload(2)
+        self.assertEqual(
+            [image['processing_status'] for image in response.data['images']], ['pending', 'pending']
+        )
+        self.assertTrue(all(image['image'].endswith('item-placeholder.svg')
+                            for image in response.data['images']))
+
+        with self.settings(MEDIA_ROOT=self.media.name):
+            call_command('process_images', workers=1, stdout=io.StringIO())
+            for item_image in ItemImage.objects.all():
+                self.assertEqual(item_image.processing_status, 'ready')
+                with Image.open(item_image.image.path) as img:
+                    self.assertEqual(img.size, (800, 600))
+
+    def test_sync_backend(self):
+        with self.settings(REWEAR_IMAGE_PROCESSING={'BACKEND': 'sync'}):
+            self.upload(1)
+        self.assertEqual(ItemImage.objects.get().processing_status, 'ready')
+
+    def test_variants_and_srcset(self):
+        with self.settings(REWEAR_IMAGE_PROCESSING={'BACKEND': 'sync'}):
+            self.upload(1)
+        item_image = ItemImage.objects.get()
+        self.assertEqual(
+            sorted((variant['width'], variant['format']) for variant in item_image.variants),
+            [(160, 'jpeg'), (160, 'webp'), (400, 'jpeg'), (400, 'webp'), (800, 'jpeg'), (800, 'webp')],
+        )
+        with self.settings(MEDIA_ROOT=self.media.name):
+            with Image.open(item_image.image.storage.path(item_image.variants[0]['name'])) as img:
+                self.assertEqual(img.size, (item_image.variants[0]['width'], item_image.variants[0]['height']))
+
+        response = self.client.get(f'/api/items/{item_image.item_id}/')
+        srcset = response.data['images'][0]['srcset']
+        self.assertEqual(sorted(srcset), ['image/jpeg', 'image/webp'])
+        self.assertRegex(srcset['image/webp'], r'-160w\.webp 160w, .*-400w\.webp 400w, .*-800w\.webp 800w$')
+
+    def test_backfill_missing_variants(self):
+        with self.settings(REWEAR_IMAGE_PROCESSING={'BACKEND': 'sync', 'VARIANT_FORMATS': []}):
+            self.upload(1)
+        self.assertEqual(ItemImage.objects.get().variants, [])
+
+        with self.settings(MEDIA_ROOT=self.media.name):
+            call_command('process_images', workers=1, missing_variants=True, stdout=io.StringIO())
+        self.assertEqual(len(ItemImage.objects.get().variants), 6)
+
+    def test_files_are_cleaned_up(self):
+        with self.settings(REWEAR_IMAGE_PROCESSING={'BACKEND': 'sync'}):
+            response = self.upload(1)
+        variants_dir = os.path.join(self.media.name, 'item_images', 'variants')
+        self.assertEqual(len(os.listdir(variants_dir)), 6)
+
+        with self.settings(MEDIA_ROOT=self.media.name):
+            # Reprocessing replaces the variants rather than adding suffixed copies
+            process_item_image(ItemImage.objects.get().pk)
+            self.assertEqual(len(os.listdir(variants_dir)), 6)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                ClothingItem.objects.get(pk=response.data['id']).delete()
+        self.assertEqual(os.listdir(variants_dir), [])
+        self.assertEqual(os.listdir(os.path.join(self.media.name, 'item_images')), ['variants'])
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class PointsLedgerTests(TestCase):
+    """Balances only move through ledger entries, atomically"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.other = User.objects.create(username='bob')
+        UserProfile.objects.create(user=self.user)
+        UserProfile.objects.create(user=self.other)
+        apply_points(self.user, 10, 'bonus', 'Welcome bonus points')
+        category = Category.objects.create(name='Shirts')
+        self.items = [
+            ClothingItem.objects.create(
+                title=f'Shirt {i}', description='Plain shirt', category=category, type='unisex',
+                size='m', condition='good', owner=self.other, status='available', points_value=10
+            )
+            for i in range(2)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def balance(self, user):
+        return UserProfile.objects.get(user=user).points_balance
+
+    def test_debit_cannot_overdraw(self):
+        apply_points(self.user, -10, 'redeemed', 'Redeemed')
+        with self.assertRaises(InsufficientPoints):
+            apply_points(self.user, -10, 'redeemed', 'Redeemed')
+        self.assertEqual(self.balance(self.user), 0)
+        self.assertEqual(self.user.points_transactions.count(), 2)
+
+    def test_redemption_with_stale_balance_is_refused(self):
+        response = self.client.post('/api/points/redeem/', {'item_id': self.items[0].id})
+        self.assertEqual(response.status_code, 201, response.content)
+
+        # A concurrent request validated before the first one spent the points
+        UserProfile.objects.filter(user=self.user).update(points_balance=0)
+        self.user.profile.points_balance = 10
+        serializer = PointsRedemptionSerializer(
+            data={'item_id': self.items[1].id}, context={'request': Mock(user=self.user)}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.assertRaises(InsufficientPoints), transaction.atomic():
+            redemption = serializer.save()
+            apply_points(self.user, -redemption.points_used, 'redeemed', 'Redeemed')
+
+        self.assertEqual(self.balance(self.user), 0)
+        self.assertEqual(PointsRedemption.objects.count(), 1)
+        self.assertEqual(find_balance_drift(), [])
+
+    def test_swap_completion_pays_out_once(self):
+        mine = ClothingItem.objects.create(
+            title='Jacket', description='Denim jacket', category=self.items[0].category, type='unisex',
+            size='m', condition='good', owner=self.user, status='in_swap'
+        )
+        swap = SwapRequest.objects.create(requester_item=mine, requested_item=self.items[0],
+                                          requester=self.user, owner=self.other, status='accepted')
+        self.client.force_authenticate(self.other)
+        response = self.client.patch(f'/api/swaps/{swap.id}/', {'status': 'completed'})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.client.patch(f'/api/swaps/{swap.id}/', {'status': 'completed'}).status_code, 400)
+
+        self.assertEqual(self.balance(self.user), 20)
+        self.assertEqual(self.balance(self.other), 10)
+        swap.refresh_from_db()
+        self.assertIsNotNone(swap.completed_at)
+
+    def test_swap_status_follows_transitions(self):
+        mine = ClothingItem.objects.create(
+            title='Jacket', description='Denim jacket', category=self.items[0].category, type='unisex',
+            size='m', condition='good', owner=self.user, status='available'
+        )
+        swap = SwapRequest.objects.create(requester_item=mine, requested_item=self.items[0],
+                                          requester=self.user, owner=self.other)
+        self.client.force_authenticate(self.other)
+
+        def patch(data):
+            return self.client.patch(f'/api/swaps/{swap.id}/', data)
+
+        # Completion needs acceptance first, and the items stay the ones offered
+        self.assertEqual(patch({'status': 'completed'}).status_code, 400)
+        self.assertEqual(patch({'status': 'accepted', 'requester_item_id': self.items[1].id}).status_code, 400)
+        self.assertEqual(patch({'requested_item_id': self.items[0].id, 'response_message': 'Sure'}).status_code, 200)
+        self.assertEqual(self.balance(self.other), 0)
+
+        self.assertEqual(patch({'status': 'accepted'}).status_code, 200)
+        self.assertEqual(patch({'status': 'rejected'}).status_code, 400)
+        self.assertEqual(patch({'status': 'completed'}).status_code, 200)
+        for status in ('accepted', 'pending', 'rejected', 'cancelled'):
+            self.assertEqual(patch({'status': status}).status_code, 400, status)
+
+        swap.refresh_from_db()
+        mine.refresh_from_db()
+        self.assertEqual((swap.status, swap.requester_item_id, swap.response_message), ('completed', mine.id, 'Sure'))
+        self.assertEqual(mine.status, 'swapped')
+        self.assertEqual(self.balance(self.other), 10)
+
+        rejected = SwapRequest.objects.create(requester_item=mine, requested_item=self.items[1],
+                                              requester=self.user, owner=self.other, status='rejected')
+        response = self.client.patch(f'/api/swaps/{rejected.id}/', {'status': 'accepted'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_reconcile_points(self):
+        UserProfile.objects.filter(user=self.user).update(points_balance=500)
+        self.assertEqual(find_balance_drift(), [(self.user.id, 500, 10)])
+        call_command('reconcile_points', stdout=io.StringIO())
+        self.assertEqual(find_balance_drift(), [])
+        self.assertEqual(self.balance(self.user), 10)
+
+
+class PointsConcurrencyTests(TransactionTestCase):
+    """Stress the ledger from several threads at once"""
+
+    threads = 8
+    rounds = 25
+
+    def test_concurrent_credits_and_debits(self):
+        user = User.objects.create(username='alice')
+        UserProfile.objects.create(user=user)
+        apply_points(user, self.rounds * self.threads, 'bonus', 'Starting balance')
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def worker(index):
+            try:
+                barrier.wait()
+                for _ in range(self.rounds):
+                    # Even threads spend 2 points, odd threads earn 1
+                    amount = -2 if index % 2 == 0 else 1
+                    while True:
+                        try:
+                            apply_points(user.id, amount, 'bonus', 'Stress')
+                            break
+                        except InsufficientPoints:
+                            break
+                        except OperationalError:
+                            # SQLite serialises writers by refusing them, retry the whole transaction
+                            time.sleep(0.001)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        ledger = PointsTransaction.objects.filter(user=user).aggregate(total=Sum('amount'))['total']
+        self.assertEqual(UserProfile.objects.get(user=user).points_balance, ledger)
+        self.assertGreaterEqual(ledger, 0)
+        self.assertEqual(find_balance_drift(), [])
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class PublicResponseCacheTests(TestCase):
+    """Public item endpoints are served from a shared cache with per-user flags"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create(username='alice')
+        self.viewer = User.objects.create(username='bob')
+        UserProfile.objects.create(user=self.owner)
+        UserProfile.objects.create(user=self.viewer, points_balance=100)
+        category = Category.objects.create(name='Shirts')
+        self.item = ClothingItem.objects.create(
+            title='Shirt', description='Plain shirt', category=category, type='unisex',
+            size='m', condition='good', owner=self.owner, status='available', points_value=10
+        )
+        self.client = APIClient()
+
+    def test_hits_skip_the_database(self):
+        first = self.client.get('/api/items/?size=m&type=')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/items/?type=&size=m')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_conditional_requests(self):
+        response = self.client.get(f'/api/items/{self.item.id}/')
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(f'/api/items/{self.item.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        self.item.title = 'Blue shirt'
+        self.item.save()
+        changed = self.client.get(f'/api/items/{self.item.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['title'], 'Blue shirt')
+
+    def test_viewer_fields_are_per_user(self):
+        anonymous = self.client.get('/api/items/featured/').json()['results'][0]
+        self.assertEqual((anonymous['can_swap'], anonymous['can_redeem']), (False, False))
+
+        self.client.force_authenticate(self.viewer)
+        viewer = self.client.get('/api/items/featured/')
+        self.assertEqual((viewer.json()['results'][0]['can_swap'], viewer.json()['results'][0]['can_redeem']),
+                         (True, True))
+        self.client.force_authenticate(self.owner)
+        owner = self.client.get('/api/items/featured/')
+        self.assertEqual(owner.json()['results'][0]['can_redeem'], False)
+        self.assertNotEqual(viewer['ETag'], owner['ETag'])
+
+    def test_detail_hits_still_record_views(self):
+        self.client.force_authenticate(self.viewer)
+        for _ in range(2):
+            self.client.get(f'/api/items/{self.item.id}/')
+        self.assertEqual(UserInteraction.objects.filter(user=self.viewer, interaction_type='view').count(), 2)
+
+
+@override_settings(REWEAR_RECOMMENDATIONS={'REFRESH_INTERVAL': 60})
+class RecommendationTests(TestCase):
+    """Item-item co-occurrence recommendations from UserInteraction rows"""
+
+    def setUp(self):
+        reset_model()
+        self.addCleanup(reset_model)
+        self.owner = User.objects.create(username='owner')
+        self.users = [User.objects.create(username=name) for name in ('alice', 'bob', 'carol')]
+        category = Category.objects.create(name='Shirts')
+        self.items = [
+            ClothingItem.objects.create(
+                title=f'Shirt {i}', description='Plain shirt', category=category, type='unisex',
+                size='m', condition='good', owner=self.owner, status='available'
+            )
+            for i in range(4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def interact(self, user, *items, interaction_type='view'):
+        UserInteraction.objects.bulk_create([
+            UserInteraction(user=user, item=item, interaction_type=interaction_type) for item in items
+        ])
+
+    def recommended(self):
+        response = self.client.get('/api/recommendations/?limit=5')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_similar_items_first(self):
+        alice, bob, carol = self.users
+        shirt, liked, viewed, other = self.items
+        self.interact(bob, shirt)
+        self.interact(bob, liked, interaction_type='like')
+        self.interact(carol, shirt, viewed)
+        self.interact(carol, other, interaction_type='search')
+        self.interact(alice, shirt)
+        refresh_model()
+        self.assertEqual(self.recommended(), [liked.id, viewed.id])
+
+    def test_requests_never_build_the_model(self):
+        with patch('core.recommendations.schedule_refresh') as schedule:
+            self.interact(self.users[1], *self.items)
+            # Without a model the newest items are served while it is built in the background
+            with self.assertNumQueries(3):
+                self.assertEqual(self.recommended(), [item.id for item in reversed(self.items)])
+            self.assertIsNone(get_model())
+            self.assertTrue(schedule.called)
+
+            refresh_model()
+            schedule.reset_mock()
+            self.recommended()
+            schedule.assert_not_called()
+
+    def test_refreshes_incrementally_and_from_file(self):
+        alice, bob, _ = self.users
+        refresh_model()
+        self.assertEqual(self.recommended(), [])
+
+        self.interact(bob, self.items[0], self.items[1])
+        self.interact(alice, self.items[0])
+        refresh_model()
+        self.assertEqual(self.recommended(), [self.items[1].id])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.json')
+            call_command('build_recommendations', output=path, stdout=io.StringIO())
+            model = CooccurrenceModel.load(path)
+        self.assertEqual(model.history, {bob.id: {self.items[0].id: 1, self.items[1].id: 1},
+                                         alice.id: {self.items[0].id: 1}})
+        self.assertEqual([item_id for item_id, _ in model.recommend(alice.id)], [self.items[1].id])
+
+    def test_stronger_repeat_interactions_count(self):
+        model = CooccurrenceModel()
+        model.add(1, 'shirt')
+        model.add(1, 'jeans')
+        self.assertEqual(model.similar(['jeans']), [('shirt', 1.0)])
+        model.add(1, 'shirt', 3)
+        # A weaker repeat neither lowers the weight nor counts again
+        model.add(1, 'shirt')
+        self.assertEqual(model.history[1], {'jeans': 1, 'shirt': 3})
+        self.assertEqual(model.item_counts, {'shirt': 3, 'jeans': 1})
+        self.assertEqual(model.pairs['shirt'], {'jeans': 3})
+        self.assertEqual(model.pairs['jeans'], {'shirt': 3})
+        [(item_id, score)] = model.similar(['jeans'])
+        self.assertEqual(item_id, 'shirt')
+        self.assertAlmostEqual(score, math.sqrt(3))
+
+        copy = CooccurrenceModel.from_dict(json.loads(json.dumps(model.to_dict())))
+        self.assertEqual((copy.history, copy.item_counts, copy.pairs),
+                         ({1: {'jeans': 1, 'shirt': 3}}, model.item_counts, model.pairs))
+        with self.assertRaises(ValueError):
+            CooccurrenceModel.from_dict({**model.to_dict(), 'version': 1})
+
+
+class SwapMatchTests(TestCase):
+    """Mutual pairs and three-way cycles from the in-memory match index"""
+
+    def setUp(self):
+        reset_match_index()
+        self.addCleanup(reset_match_index)
+        category = Category.objects.create(name='Shirts')
+        self.users = {name: User.objects.create(username=name) for name in ('alice', 'bob', 'carol', 'dave')}
+        self.items = {
+            name: ClothingItem.objects.create(
+                title=f"{name}'s shirt", description='Plain shirt', category=category, type=item_type,
+                size=size, condition='good', owner=self.users[name], status='available'
+            )
+            for name, item_type, size in [
+                ('alice', 'men', 'm'), ('bob', 'women', 's'), ('carol', 'kids', 'l'), ('dave', 'unisex', 'xl'),
+            ]
+        }
+
+    def like(self, name, owner):
+        UserInteraction.objects.create(user=self.users[name], item=self.items[owner], interaction_type='like')
+
+    def legs(self, match):
+        names = {user.id: name for name, user in self.users.items()}
+        return [(names[leg.giver], names[leg.receiver], leg.item_id) for leg in match.legs]
+
+    def test_pairs_and_cycles(self):
+        # alice, bob and carol each want the next one's item; dave and alice want each other's
+        self.like('alice', 'bob')
+        self.like('bob', 'carol')
+        self.like('carol', 'alice')
+        self.like('dave', 'alice')
+        self.like('alice', 'dave')
+
+        matches = sorted(MatchIndex.build().all_matches(), key=lambda match: match.kind)
+        self.assertEqual([match.kind for match in matches], ['cycle', 'pair'])
+        self.assertEqual(self.legs(matches[0]), [
+            ('alice', 'carol', self.items['alice'].id),
+            ('carol', 'bob', self.items['carol'].id),
+            ('bob', 'alice', self.items['bob'].id),
+        ])
+        self.assertEqual(self.legs(matches[1]), [
+            ('alice', 'dave', self.items['alice'].id),
+            ('dave', 'alice', self.items['dave'].id),
+        ])
+
+    def test_endpoint(self):
+        self.like('bob', 'carol')
+        self.like('carol', 'bob')
+        client = APIClient()
+        client.force_authenticate(self.users['bob'])
+        # The first request schedules the index build instead of running it
+        with patch('core.matching.schedule_rebuild') as schedule:
+            response = client.get('/api/swaps/matches/')
+        self.assertEqual(response.data['results'], [])
+        schedule.assert_called_once()
+
+        rebuild_match_index()
+        response = client.get('/api/swaps/matches/')
+        self.assertEqual(response.status_code, 200)
+        [match] = response.data['results']
+        self.assertEqual(match['type'], 'pair')
+        self.assertEqual([leg['item']['id'] for leg in match['legs']],
+                         [self.items['bob'].id, self.items['carol'].id])
+
+        output = io.StringIO()
+        call_command('find_swap_matches', stdout=output)
+        self.assertIn('Found 1 pairs and 0 cycles', output.getvalue())
+
+
+class BulkImportExportTests(TestCase):
+    """CSV/JSONL item import with an image archive, and the streaming export"""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.user = User.objects.create(username='store')
+        UserProfile.objects.create(user=self.user)
+        self.category = Category.objects.create(name='Shirts')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def archive(self, *names):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name in names:
+                image = io.BytesIO()
+                Image.new('RGB', (40, 30), 'red').save(image, 'JPEG')
+                archive.writestr(f'photos/{name}', image.getvalue())
+        return SimpleUploadedFile('images.zip', buffer.getvalue(), 'application/zip')
+
+    def post(self, name, content, archive=None):
+        data = {'file': SimpleUploadedFile(name, content.encode('utf-8'))}
+        if archive:
+            data['images'] = archive
+        with self.settings(MEDIA_ROOT=self.media.name, REWEAR_IMAGE_PROCESSING={'BACKEND': 'queue'}):
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post('/api/items/import/', data, format='multipart')
+
+    def test_csv_import_reports_row_errors(self):
+        content = (
+            'title,description,category,type,size,condition,points_value,tags,images\n'
+            'Red shirt,Cotton,shirts,men,m,good,20,"red, cotton",front.jpg;back.jpg\n'
+            'Blue shirt,Linen,%d,women,s,fair,,,\n'
+            'Bad shirt,Wool,Hats,men,huge,good,,,missing.jpg\n' % self.category.id
+        )
+        response = self.post('items.csv', content, self.archive('front.jpg', 'back.jpg'))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 4)
+        self.assertEqual(sorted(response.data['errors'][0]['errors']), ['category', 'images', 'size'])
+
+        red = ClothingItem.objects.get(title='Red shirt')
+        self.assertEqual((red.owner, red.status, red.points_value), (self.user, 'pending', 20))
+        self.assertEqual([image.is_primary for image in red.images.order_by('pk')], [True, False])
+        self.assertEqual(ClothingItem.objects.get(title='Blue shirt').points_value, 10)
+        self.assertEqual(UserProfile.objects.get(user=self.user).points_balance, 10)
+        self.assertEqual(find_balance_drift(), [])
+
+    def test_jsonl_import_and_export_round_trip(self):
+        lines = [
+            json.dumps({'title': 'Jacket', 'description': 'Denim', 'category': 'Shirts', 'type': 'unisex',
+                        'size': 'l', 'condition': 'excellent', 'is_available_for_points': False}),
+            'not json',
+        ]
+        response = self.post('items.jsonl', '\n'.join(lines))
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+
+        response = self.client.get('/api/items/export/?as=jsonl')
+        [row] = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual((row['title'], row['category'], row['is_available_for_points']), ('Jacket', 'Shirts', False))
+
+        response = self.client.get('/api/items/export/')
+        exported = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        # An export imports back as is
+        self.assertEqual(self.post('items.csv', exported).data['created'], 1)
+        self.assertEqual(ClothingItem.objects.filter(title='Jacket').count(), 2)
+
+
+class DataGeneratorTests(TestCase):
+    def test_generates_consistent_data(self):
+        generator = generate(users=20, items=200, swaps=30, interactions=300, seed=7, batch_size=64)
+
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(ClothingItem.objects.count(), 200)
+        self.assertEqual(SwapRequest.objects.count(), 30)
+        self.assertEqual(Notification.objects.count(), 30)
+        self.assertEqual(UserInteraction.objects.count(), 300)
+        self.assertEqual(list(generator.item_ids), list(ClothingItem.objects.order_by('pk').values_list('pk', flat=True)))
+
+        # Balances match the ledger and swaps never pair a user with themselves
+        self.assertEqual(find_balance_drift(), [])
+        self.assertFalse(SwapRequest.objects.filter(requester=F('owner')).exists())
+        self.assertEqual(
+            sum(Category.objects.values_list('available_items_count', flat=True)),
+            ClothingItem.objects.filter(status='available').count()
+        )
+        user = User.objects.get(pk=generator.user_ids[0])
+        self.assertTrue(user.check_password('password123'))
+        self.assertEqual(user.profile.points_balance, 50 + 5 * user.owned_items.count())
+
+        # Notifications carry the swap summary real ones are sent with
+        notification = Notification.objects.select_related(
+            'related_swap__requester', 'related_swap__requested_item'
+        ).first()
+        swap = notification.related_swap
+        self.assertEqual(notification.group_key, f'swap_request:swap:{swap.pk}')
+        related = NotificationSerializer(notification).data['related_swap']
+        self.assertEqual(related['requester'], {'id': swap.requester_id, 'username': swap.requester.username})
+        self.assertEqual(related['requested_item'], {'id': swap.requested_item_id, 'title': swap.requested_item.title})
+
+        # New rows still get ids after the explicit ones
+        late = User.objects.create(username='late')
+        self.assertGreater(late.pk, generator.user_ids[-1])
+        self.assertGreater(Notification.objects.create(user=late, title='Hi', message='Hi').pk, 30)
+
+    def test_tables_without_explicit_ids_leave_them_to_the_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            generate(users=2, seed=1)
+        inserts = [query['sql'] for query in queries if 'INSERT INTO' in query['sql']]
+        self.assertIn('"id"', next(sql for sql in inserts if 'auth_user' in sql))
+        self.assertNotIn('"id"', next(sql for sql in inserts if 'core_userprofile' in sql))
+        self.assertEqual(UserProfile.objects.count(), 2)
+
+    def test_swaps_stop_when_pairs_run_out(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_data', users=3, items=20, swaps=2, interactions=10, stdout=io.StringIO())
+
+        # One seller, no pairs of different owners
+        self.assertEqual(generate(users=3, items=20, swaps=2, seed=1).swap_count, 0)
+        # Three sellers and a few items, far more swaps asked for than pairs exist
+        generator = generate(users=10, items=12, swaps=1000, seed=1, prefix='b')
+        self.assertGreater(generator.swap_count, 0)
+        self.assertLess(generator.swap_count, 1000)
+        self.assertEqual(SwapRequest.objects.count(), generator.swap_count)
+        self.assertFalse(SwapRequest.objects.filter(requester=F('owner')).exists())
+        self.assertEqual(
+            SwapRequest.objects.values('requester_item', 'requested_item').distinct().count(),
+            generator.swap_count
+        )
+
+    def test_same_seed_same_data(self):
+        generate(users=10, items=50, seed=3, prefix='a')
+        generate(users=10, items=50, seed=3, prefix='b')
+        rows = list(ClothingItem.objects.order_by('pk').values_list('title', 'size', 'condition', 'points_value'))
+        self.assertEqual(rows[:50], rows[50:])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchmarkTests(TestCase):
+    def test_every_route_has_a_scenario(self):
+        self.assertEqual(sorted(scenario.name for scenario in SCENARIOS), sorted(core_route_names()))
+
+    def test_endpoints_stay_within_budgets(self):
+        generate(users=30, items=300, swaps=40, interactions=500, seed=1)
+        results = run_benchmarks(iterations=1)
+
+        self.assertEqual(set(results), set(core_route_names()))
+        # Every route has all three budgets and stays within them
+        budgets = default_budgets()
+        self.assertEqual({frozenset(limits) for limits in budgets.values()},
+                         {frozenset({'queries', 'memory_kb', 'p95_ms'})})
+        self.assertEqual(check_budgets(results, budgets), [])
+        # Everything the run wrote was rolled back
+        self.assertFalse(User.objects.filter(username='benchmark_admin').exists())
+
+    def test_budgets_fail_on_memory_and_latency(self):
+        result = {'status': [200], 'queries': 3, 'memory_kb': 900.5, 'p95_ms': 175.0}
+        self.assertEqual(check_budgets({'items-list': result}, default_budgets()), [
+            'items-list: memory_kb 900.5 over budget 768',
+            'items-list: p95_ms 175.0 over budget 100',
+        ])
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'}, REWEAR_METRICS={'TOKEN': 'scrape-me'})
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        cache.clear()
+        self.staff = User.objects.create(username='ops', is_staff=True)
+        category = Category.objects.create(name='Shirts')
+        ClothingItem.objects.create(
+            title='Tee', description='Cotton tee', category=category, type='unisex', size='m',
+            condition='good', owner=self.staff, status='available'
+        )
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/items/')
+        timing = response['Server-Timing']
+        self.assertIn('app;dur=', timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries, 0 duplicates"')
+        self.assertIn('serialize;dur=', timing)
+
+    def test_prometheus_endpoint(self):
+        self.client.get('/api/items/')
+        self.client.get('/api/items/')
+
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE rewear_request_duration_seconds histogram', body)
+        self.assertIn('rewear_requests_total{view="items-list",method="GET",status="200"} 2', body)
+        self.assertIn('rewear_request_duration_seconds_count{view="items-list",method="GET"} 2', body)
+        self.assertIn('rewear_response_size_bytes_bucket{view="items-list",method="GET",le="+Inf"} 2', body)
+        self.assertIn('rewear_serializer_duration_seconds_count{view="items-list",method="GET"} 2', body)
+
+        staff = APIClient()
+        staff.force_authenticate(self.staff)
+        self.assertEqual(staff.get('/api/metrics/').status_code, 200)
+
+    def test_duplicate_queries_are_counted(self):
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            list(Category.objects.filter(name='Shirts'))
+            list(Category.objects.filter(name='Shirts'))
+            list(Category.objects.filter(name='Pants'))
+        self.assertEqual(metrics.queries, 3)
+        self.assertEqual(metrics.duplicates, 1)
+        self.assertGreater(metrics.db_time, 0)
+
+    def test_async_requests_count_their_queries(self):
+        with override_settings(ROOT_URLCONF=__name__):
+            response = async_to_sync(AsyncClient().get)('/api/items/')
+            self.assertTrue(issubclass(response.resolver_match.func.view_class, async_views.AsyncAPIView))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries')
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+
+    def test_rest_framework_is_left_alone(self):
+        self.client.get('/api/items/')
+        self.assertFalse(hasattr(serializers.Serializer.data.fget, '__wrapped__'))
+        self.assertFalse(hasattr(JSONRenderer.render, '__wrapped__'))
+        self.assertEqual(connection.execute_wrappers, [])
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class CachedTokenAuthTests(TestCase):
+    """Token logins are served from the per-process cache until something changes"""
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = User.objects.create_user(username='alice', password='secret-pass-1')
+        UserProfile.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def auth_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/profile/')
+        self.assertEqual(response.status_code, 200)
+        return response, [q['sql'] for q in queries if 'authtoken_token' in q['sql']]
+
+    def test_cache_hit_skips_token_query(self):
+        self.assertEqual(len(self.auth_queries()[1]), 1)
+        self.assertEqual(self.auth_queries()[1], [])
+
+    def test_profile_and_points_changes_invalidate(self):
+        self.auth_queries()
+        profile = self.user.profile
+        profile.bio = 'Thrifter'
+        profile.save()
+        self.assertEqual(len(self.auth_queries()[1]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_points(self.user, 25, 'bonus', 'Bonus')
+        response, queries = self.auth_queries()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(response.data['points_balance'], 25)
+
+    def test_logout_and_deactivation_revoke(self):
+        self.auth_queries()
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        self.assertEqual(self.client.get('/api/profile/').status_code, 401)
+
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.auth_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/profile/').status_code, 401)
+
+    @override_settings(REWEAR_AUTH={'SIGNED_TOKENS': True})
+    def test_signed_token(self):
+        response = self.client.post('/api/auth/login/', {'username': 'alice', 'password': 'secret-pass-1'})
+        signed = response.data['signed_token']
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Signed {signed}')
+        for expected in (1, 0):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get('/api/notifications/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len([q for q in queries if 'auth_user' in q['sql'] or 'authtoken' in q['sql']]), expected)
+
+        client.credentials(HTTP_AUTHORIZATION=f'Signed {signed[:-2]}xx')
+        self.assertEqual(client.get('/api/notifications/').status_code, 401)
+        with override_settings(REWEAR_AUTH={'SIGNED_TOKENS': False}):
+            client.credentials(HTTP_AUTHORIZATION=f'Signed {signed}')
+            self.assertEqual(client.get('/api/notifications/').status_code, 401)
+
+    @override_settings(REWEAR_AUTH={'SIGNED_TOKENS': True})
+    def test_signed_token_follows_the_account(self):
+        def signed_client():
+            client = APIClient()
+            response = client.post('/api/auth/login/', {'username': 'alice', 'password': 'secret-pass-1'})
+            client.cookies.clear()
+            client.credentials(HTTP_AUTHORIZATION=f'Signed {response.data["signed_token"]}')
+            return client
+
+        self.user.is_staff = True
+        self.user.save()
+        client = signed_client()
+        self.assertEqual(client.get('/api/metrics/').status_code, 200)
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(client.get('/api/metrics/').status_code, 403)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(client.get('/api/notifications/').status_code, 401)
+        self.user.is_active = True
+        self.user.save()
+
+        self.assertEqual(client.post('/api/auth/logout/').status_code, 200)
+        self.assertEqual(client.get('/api/notifications/').status_code, 401)
+
+        client = signed_client()
+        self.user.set_password('secret-pass-2')
+        self.user.save()
+        self.assertEqual(client.get('/api/notifications/').status_code, 401)
+
+
+# URLconf with the async views in front, as core.urls does under ASGI
+urlpatterns = [path('api/', include(async_views.urlpatterns + core_urls.urlpatterns))]
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class AsyncViewTests(TestCase):
+    """The async views answer exactly like the sync views they stand in for"""
+
+    def setUp(self):
+        cache.clear()
+        get_token_cache().clear()
+        self.user = User.objects.create(username='alice')
+        self.other = User.objects.create(username='bob')
+        UserProfile.objects.create(user=self.user, points_balance=15)
+        UserProfile.objects.create(user=self.other)
+        self.token = Token.objects.create(user=self.user)
+        category = Category.objects.create(name='Shirts')
+        self.items = [
+            ClothingItem.objects.create(
+                title=f'Cotton shirt {i}', description='Plain shirt', category=category, type='unisex',
+                size='m', condition='good', owner=self.other, status='available', points_value=10 + i
+            )
+            for i in range(25)
+        ]
+        Notification.objects.create(
+            user=self.user, notification_type='swap_request', title='Hi', message='New swap',
+            related_item=self.items[0]
+        )
+        self.async_client = AsyncClient()
+
+    def compare(self, url, **headers):
+        cache.clear()
+        expected = self.client.get(url, headers=headers)
+        cache.clear()
+        with override_settings(ROOT_URLCONF=__name__):
+            response = async_to_sync(self.async_client.get)(url, headers=headers)
+            self.assertTrue(issubclass(response.resolver_match.func.view_class, async_views.AsyncAPIView), url)
+        self.assertEqual(response.status_code, expected.status_code, url)
+        self.assertEqual(response.json(), expected.json(), url)
+        return response
+
+    def test_responses_match_sync_views(self):
+        item = self.items[0]
+        urls = [
+            '/api/items/', '/api/items/?page=2', f'/api/items/?category={item.category_id}',
+            '/api/items/?search=cotton', '/api/items/?pagination=cursor', f'/api/items/{item.pk}/',
+            '/api/items/featured/', '/api/search/?q=shirt&min_points=20', '/api/notifications/',
+            '/api/dashboard/stats/', '/api/items/?page=9', '/api/items/0/',
+        ]
+        for url in urls:
+            self.compare(url)
+            self.compare(url, Authorization=f'Token {self.token.key}')
+
+        response = self.compare('/api/dashboard/stats/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        self.assertEqual(self.compare('/api/notifications/', Authorization='Token nope').status_code, 401)
+
+        response = self.compare('/api/dashboard/stats/', Authorization=f'Token {self.token.key}')
+        self.assertEqual(response.json()['points_balance'], 15)
+
+    def test_session_login_and_tracking(self):
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        with override_settings(ROOT_URLCONF=__name__):
+            response = async_to_sync(self.async_client.get)(f'/api/items/{self.items[1].pk}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['can_redeem'])
+            self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries')
+            response = async_to_sync(self.async_client.post)('/api/items/')
+            self.assertEqual(response.status_code, 405)
+        self.assertTrue(UserInteraction.objects.filter(
+            user=self.user, interaction_type='view', item=self.items[1]
+        ).exists())
+
+
+@override_settings(
+    REWEAR_INTERACTIONS={'BACKEND': 'sync'}, REWEAR_EVENTS={'HEARTBEAT': 0.05, 'MAX_DURATION': 0.3}
+)
+class NotificationStreamTests(TestCase):
+    """New notifications are pushed over Server-Sent Events"""
+
+    def setUp(self):
+        reset_broker()
+        self.addCleanup(reset_broker)
+        get_token_cache().clear()
+        self.user = User.objects.create(username='alice')
+        UserProfile.objects.create(user=self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.admin = APIClient()
+        self.admin.force_authenticate(User.objects.create(username='mod', is_staff=True))
+        category = Category.objects.create(name='Shirts')
+        self.item = ClothingItem.objects.create(
+            title='Tee', description='Cotton tee', category=category, type='unisex', size='m',
+            condition='good', owner=self.user, status='pending'
+        )
+        self.first = self.notify('Welcome')
+        self.async_client = AsyncClient()
+
+    def notify(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(
+                user=self.user, notification_type='general', title=title, message=title
+            )
+
+    def payload(self, chunk):
+        return json.loads(chunk.decode().split('data: ', 1)[1])
+
+    def test_stream_pushes_new_notifications(self):
+        response = self.client.get(
+            f'/api/notifications/stream/?token={self.token.key}&last_event_id={self.first.pk - 1}',
+            HTTP_ACCEPT='text/event-stream'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = iter(response.streaming_content)
+        self.assertEqual(next(chunks), b'retry: 3000\n\n')
+
+        backlog = next(chunks)
+        self.assertTrue(backlog.startswith(f'id: {self.first.pk}\nevent: notification\n'.encode()))
+        self.assertEqual(self.payload(backlog)['unread_notifications'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.post(f'/api/admin/items/{self.item.pk}/moderate/', {'action': 'approve'}, format='json')
+        live = self.payload(next(chunks))
+        self.assertEqual(live['notification']['notification_type'], 'item_approved')
+        self.assertEqual(live['notification']['related_item']['id'], self.item.pk)
+        self.assertEqual(live['unread_notifications'], 2)
+
+        self.assertEqual(next(chunks), b': keep-alive\n\n')
+        self.assertEqual(set(chunks), {b': keep-alive\n\n'})
+        response.close()
+        self.assertFalse(get_broker().subscriptions)
+
+        response = self.client.get('/api/notifications/stream/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response.content.startswith(b'event: error\n'))
+
+    def test_async_stream(self):
+        async def stream():
+            response = await self.async_client.get('/api/notifications/stream/', headers={
+                'Authorization': f'Token {self.token.key}', 'Last-Event-ID': str(self.first.pk),
+            })
+            self.assertTrue(issubclass(response.resolver_match.func.view_class, async_views.AsyncAPIView))
+            chunks = aiter(response.streaming_content)
+            await anext(chunks)
+            await sync_to_async(self.notify)('Later')
+            live = await anext(chunks)
+            rest = [chunk async for chunk in chunks]
+            return live, rest
+
+        with override_settings(ROOT_URLCONF=__name__):
+            live, rest = async_to_sync(stream)()
+        self.assertEqual(self.payload(live)['notification']['title'], 'Later')
+        self.assertEqual(set(rest), {b': keep-alive\n\n'})
+        self.assertFalse(get_broker().subscriptions)
+
+    def test_database_broker_sees_other_processes(self):
+        broker = DatabaseBroker(get_events_config())
+        subscription = ThreadSubscription(self.user.id)
+        # Subscribed without starting the polling thread, polls are driven by hand
+        Broker.subscribe(broker, subscription)
+        broker.poll()
+        self.assertFalse(subscription.wait(0))
+
+        # Rows written elsewhere, so nothing was published in this process
+        Notification.objects.create(user=self.user, notification_type='general', title='Hi', message='Hi')
+        broker.poll()
+        self.assertTrue(subscription.wait(0))
+        broker.poll()
+        self.assertFalse(subscription.wait(0))
+
+
+class BatchModerationTests(TestCase):
+    """Many pending items are approved or rejected in a fixed number of queries"""
+
+    def setUp(self):
+        reset_broker()
+        self.addCleanup(reset_broker)
+        self.admin = User.objects.create(username='mod', is_staff=True)
+        self.owners = [User.objects.create(username=name) for name in ('alice', 'bob')]
+        self.category = Category.objects.create(name='Shirts')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def make_items(self, count, status='pending'):
+        return ClothingItem.objects.bulk_create(
+            ClothingItem(
+                title=f'Shirt {number}', description='Plain shirt', category=self.category, type='unisex',
+                size='m', condition='good', owner=self.owners[number % 2], status=status
+            )
+            for number in range(count)
+        )
+
+    def moderate(self, ids, action='approve', **data):
+        return self.client.post('/api/admin/items/moderate/', {'action': action, 'ids': ids, **data}, format='json')
+
+    def test_approve_batch(self):
+        pending = [item.pk for item in self.make_items(50)]
+        available = self.make_items(1, status='available')[0].pk
+        subscription = ThreadSubscription(self.owners[0].pk)
+        get_broker().subscribe(subscription)
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.moderate(pending + [available, 999999, pending[0]])
+        self.assertEqual(response.status_code, 200)
+        # Items, their UPDATE, the recipients' lock, unread notifications to coalesce with, the INSERT
+        # and the category recount
+        self.assertEqual(len([query for query in queries if 'SAVEPOINT' not in query['sql']]), 6)
+        self.assertEqual(response.data['updated'], 50)
+        self.assertEqual(response.data['results'], {
+            **{pk: 'approved' for pk in pending}, available: 'not_pending', 999999: 'not_found'
+        })
+        self.assertTrue(subscription.event.is_set())
+
+        approved = ClothingItem.objects.filter(pk__in=pending, status='available', approved_by=self.admin)
+        self.assertEqual(approved.count(), 50)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.available_items_count, 51)
+        notifications = Notification.objects.filter(notification_type='item_approved')
+        self.assertEqual(notifications.count(), 50)
+        self.assertEqual(set(notifications.values_list('related_item_id', flat=True)), set(pending))
+
+        # Approving again changes nothing
+        response = self.moderate(pending[:2])
+        self.assertEqual(response.data, {'action': 'approve', 'updated': 0, 'results': {
+            pending[0]: 'not_pending', pending[1]: 'not_pending'
+        }})
+
+    def test_reject_batch(self):
+        item = self.make_items(1)[0]
+        response = self.moderate([item.pk], 'reject', message='Blurry photos')
+        self.assertEqual(response.data['results'], {item.pk: 'rejected'})
+        item.refresh_from_db()
+        self.assertEqual(item.status, 'rejected')
+        notification = Notification.objects.get(user=item.owner)
+        self.assertEqual(notification.notification_type, 'item_rejected')
+        self.assertTrue(notification.message.endswith('Reason: Blurry photos'))
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.moderate([1], 'delete').status_code, 400)
+        self.assertEqual(self.moderate([]).status_code, 400)
+        self.assertEqual(self.moderate(list(range(1, 1002))).status_code, 400)
+        self.client.force_authenticate(self.owners[0])
+        self.assertEqual(self.moderate([1]).status_code, 403)
+
+    def test_admin_action_notifies_owners(self):
+        items = self.make_items(3)
+        model_admin = ClothingItemAdmin(ClothingItem, AdminSite())
+        model_admin.message_user = Mock()
+        request = Mock(user=self.admin)
+        model_admin.approve_items(request, ClothingItem.objects.filter(pk__in=[item.pk for item in items]))
+        model_admin.message_user.assert_called_once_with(request, '3 items were approved.')
+        self.assertEqual(Notification.objects.filter(notification_type='item_approved').count(), 3)
+
+
+class TriageTests(TestCase):
+    """New items are checked against every other item's image and text hashes"""
+
+    def setUp(self):
+        reset_triage_index()
+        self.addCleanup(reset_triage_index)
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.category = Category.objects.create(name='Shirts')
+
+    def make_item(self, owner, title='Linen shirt', description='Blue linen shirt, worn twice, no stains',
+                  image_hash=None, status='pending', **fields):
+        item = ClothingItem.objects.create(
+            title=title, description=description, category=self.category, type='unisex', size='m',
+            condition='good', owner=owner, status=status, **fields
+        )
+        if image_hash is not None:
+            ItemImage.objects.create(item=item, processing_status='ready', image_hash=f'{image_hash:016x}')
+        return item
+
+    def test_bk_tree_matches_brute_force(self):
+        import random
+        rng = random.Random(5)
+        values = [rng.getrandbits(64) for _ in range(500)]
+        # Near copies of the first few, a couple of bits flipped
+        values += [value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for value in values[:50]]
+        tree = BKTree()
+        for item_id, value in enumerate(values):
+            tree.add(value, item_id)
+        for query in values[:60]:
+            expected = {
+                item_id: (query ^ value).bit_count() for item_id, value in enumerate(values)
+                if (query ^ value).bit_count() <= 6
+            }
+            self.assertEqual(tree.search(query, 6), expected)
+
+    def test_hashes_survive_small_changes(self):
+        photo = Image.new('RGB', (400, 300), 'white')
+        for x in range(0, 400, 40):
+            photo.paste((x // 2, 80, 200 - x // 3), (x, x // 2, x + 40, 300))
+        buffer = io.BytesIO()
+        photo.resize((200, 150)).save(buffer, 'JPEG', quality=60)
+        copy = Image.open(buffer)
+        other = photo.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        self.assertLessEqual((difference_hash(photo) ^ difference_hash(copy)).bit_count(), 6)
+        self.assertGreater((difference_hash(photo) ^ difference_hash(other)).bit_count(), 6)
+
+        text = text_hash('Linen shirt', 'Blue linen shirt, worn twice, no stains, fits true to size')
+        self.assertEqual(text, text_hash('LINEN SHIRT', 'Blue linen shirt - worn twice, no stains, fits true to size!'))
+        self.assertGreater((text ^ text_hash('Wool coat', 'Grey wool coat with a missing button')).bit_count(), 3)
+        self.assertIsNone(text_hash('', '...'))
+
+    def test_flags_copied_listing(self):
+        original = self.make_item(self.bob, image_hash=0xF0F0F0F0F0F0F0F0, status='available')
+        call_command('triage_items', backfill=True, stdout=io.StringIO())
+        item = self.make_item(self.alice, image_hash=0xF0F0F0F0F0F0F0F1)
+
+        self.assertEqual(triage_item(item.pk), 'flagged')
+        item.refresh_from_db()
+        self.assertEqual(item.triage_priority, 80)
+        self.assertEqual(item.triage_reasons, [
+            {'check': 'copied_image', 'item': original.pk, 'status': 'available', 'distance': 1},
+            {'check': 'copied_text', 'item': original.pk, 'status': 'available', 'distance': 0},
+        ])
+
+        # The same photo listed again by its owner is a duplicate, found through the in-memory index
+        again = self.make_item(self.alice, title='Top', description='Cotton top', image_hash=0xF0F0F0F0F0F0F0F1)
+        self.assertEqual(triage_item(again.pk), 'flagged')
+        again.refresh_from_db()
+        self.assertEqual(
+            [(reason['check'], reason['item']) for reason in again.triage_reasons],
+            [('duplicate_listing', item.pk), ('copied_image', original.pk)]
+        )
+
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create(username='mod', is_staff=True))
+        response = admin.get('/api/admin/items/pending/?triage=flagged&ordering=-triage_priority,created_at')
+        self.assertEqual([row['id'] for row in response.data['results']], [item.pk, again.pk])
+        self.assertEqual(response.data['results'][0]['triage_status'], 'flagged')
+
+    def test_heuristics_and_auto_approval(self):
+        item = self.make_item(self.alice, description='Call me on +44 7700 900123', image_hash=1)
+        self.assertEqual(triage_item(item.pk), 'flagged')
+        self.assertEqual(triage_item(self.make_item(self.alice, title='Scarf', description='Red').pk), 'review')
+
+        admin = User.objects.create(username='mod', is_staff=True)
+        for number in range(3):
+            self.make_item(self.bob, title=f'Coat {number}', description=f'Coat number {number}',
+                           status='available', approved_by=admin)
+        with self.settings(REWEAR_TRIAGE={'AUTO_APPROVE': True}):
+            clean = self.make_item(self.alice, title='Jeans', description='Dark jeans', image_hash=0x123456789ABCDEF0)
+            self.assertEqual(triage_item(clean.pk), 'clean')
+            trusted = self.make_item(self.bob, title='Hat', description='Straw sun hat', image_hash=0x0FEDCBA987654321)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(triage_item(trusted.pk), 'approved')
+        trusted.refresh_from_db()
+        self.assertEqual((trusted.status, trusted.approved_by), ('available', None))
+        self.assertTrue(Notification.objects.filter(user=self.bob, notification_type='item_approved').exists())
+
+    def test_contact_details_need_a_phone_shape(self):
+        for text in ('Call me on +44 7700 900123', '07700 900123', '+1 (555) 123-4567', 'www.example.com',
+                     'mail me at me@example.com'):
+            self.assertTrue(has_contact_details(text), text)
+        for text in ('Chest 52 - 54 - 56 cm', 'Model 1990-2000 vintage', 'Size 10 (2019) 100% cotton',
+                     'Waist 76-80-84cm', 'Bought 2019, worn 3 times'):
+            self.assertFalse(has_contact_details(text), text)
+        item = self.make_item(self.alice, description='Chest 52 - 54 - 56 cm', image_hash=1)
+        self.assertEqual(triage_item(item.pk), 'clean')
+
+    def test_triaged_after_images_are_processed(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        client = APIClient()
+        for user in (self.bob, self.alice):
+            UserProfile.objects.create(user=user)
+            buffer = io.BytesIO()
+            Image.new('RGB', (300, 200), 'navy').save(buffer, 'JPEG')
+            client.force_authenticate(user)
+            with self.settings(MEDIA_ROOT=media.name, REWEAR_IMAGE_PROCESSING={'BACKEND': 'sync'}):
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = client.post('/api/items/create/', {
+                        'title': f'{user.username} shirt', 'description': f'Shirt of {user.username}',
+                        'category': self.category.id, 'type': 'unisex', 'size': 'm', 'condition': 'good',
+                        'images': [SimpleUploadedFile('shirt.jpg', buffer.getvalue(), 'image/jpeg')],
+                    }, format='multipart')
+            self.assertEqual(response.status_code, 201, response.content)
+
+        first, second = ClothingItem.objects.order_by('pk')
+        self.assertEqual((first.triage_status, second.triage_status), ('clean', 'flagged'))
+        self.assertEqual(second.triage_reasons[0]['check'], 'copied_image')
+        self.assertEqual(ItemImage.objects.exclude(image_hash='').count(), 2)
+
+
+class NotificationServiceTests(TestCase):
+    """Notifications are sent in bulk, coalesced, served from their payload and pruned"""
+
+    def setUp(self):
+        reset_broker()
+        self.addCleanup(reset_broker)
+        self.user = User.objects.create(username='alice')
+        self.other = User.objects.create(username='bob')
+        category = Category.objects.create(name='Shirts')
+        self.item = ClothingItem.objects.create(
+            title='Tee', description='Cotton tee', category=category, type='unisex', size='m',
+            condition='good', owner=self.user
+        )
+
+    def redeemed(self, user=None, item=None):
+        return build_notification(
+            (user or self.user).pk, 'points_redeemed', 'Item Redeemed with Points', 'Someone wants it',
+            item=item_summary(item or self.item)
+        )
+
+    def test_send_coalesces_duplicates(self):
+        subscription = ThreadSubscription(self.user.pk)
+        get_broker().subscribe(subscription)
+        general = build_notification(self.user.pk, 'general', 'Hello', 'Welcome')
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            created = send_notifications([self.redeemed(), general, self.redeemed(), self.redeemed(self.other)])
+        # The recipients' lock, unread notifications to coalesce with and the INSERT
+        self.assertEqual(len([query for query in queries if 'SAVEPOINT' not in query['sql']]), 3)
+        self.assertEqual(
+            [(row.user_id, row.count) for row in created],
+            [(self.user.pk, 1), (self.user.pk, 2), (self.other.pk, 1)]
+        )
+        self.assertTrue(subscription.event.is_set())
+
+        # A later event replaces the unread one, a read one is left alone
+        first = Notification.objects.get(user=self.user, notification_type='points_redeemed')
+        latest = notify(self.user.pk, 'points_redeemed', 'Item Redeemed with Points', 'Again',
+                        item=item_summary(self.item))
+        self.assertGreater(latest.pk, first.pk)
+        self.assertEqual(latest.count, 3)
+        self.assertFalse(Notification.objects.filter(pk=first.pk).exists())
+        Notification.objects.filter(pk=latest.pk).update(is_read=True)
+        self.assertEqual(notify(self.user.pk, 'points_redeemed', 'Item Redeemed with Points', 'Once more',
+                                item=item_summary(self.item)).count, 1)
+
+        with self.settings(REWEAR_NOTIFICATIONS={'COALESCE_WINDOW': 0}):
+            self.assertEqual(send_notifications([self.redeemed()])[0].count, 1)
+
+    def test_list_reads_payload_only(self):
+        send_notifications([self.redeemed() for _ in range(3)] + [
+            build_notification(self.user.pk, 'general', f'Note {number}', 'Hi') for number in range(5)
+        ])
+        self.item.delete()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            response = client.get('/api/notifications/')
+        self.assertEqual(response.data['count'], 5)
+
+        coat = ClothingItem.objects.create(
+            title='Coat', description='Wool coat', category=self.item.category, type='unisex', size='m',
+            condition='good', owner=self.other
+        )
+        notify(self.user.pk, 'general', 'Item', 'With item', item=item_summary(coat))
+        row = client.get('/api/notifications/').data['results'][0]
+        self.assertEqual((row['related_item'], row['related_swap']), ({'id': coat.pk, 'title': 'Coat'}, None))
+
+    def test_prune_read_notifications_in_chunks(self):
+        send_notifications([
+            build_notification(self.user.pk, 'general', f'Note {number}', 'Hi') for number in range(7)
+        ])
+        old = timezone.now() - timezone.timedelta(days=100)
+        Notification.objects.filter(title__in=[f'Note {number}' for number in range(5)]).update(created_at=old)
+        Notification.objects.exclude(title='Note 4').update(is_read=True)
+
+        archive = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(prune_notifications(days=90, chunk_size=2, archive=archive), 4)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE')]), 2)
+        self.assertEqual(
+            sorted(json.loads(line)['title'] for line in archive.getvalue().splitlines()),
+            ['Note 0', 'Note 1', 'Note 2', 'Note 3']
+        )
+        self.assertEqual(
+            sorted(Notification.objects.values_list('title', flat=True)), ['Note 4', 'Note 5', 'Note 6']
+        )
+
+        out = io.StringIO()
+        call_command('prune_notifications', days=0, stdout=out)
+        self.assertIn('Deleted 2 read notifications', out.getvalue())
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.other = User.objects.create(username='bob', email='bob@example.com')
+        UserProfile.objects.create(user=self.user, points_balance=100)
+        UserProfile.objects.create(user=self.other, points_balance=100)
+        category = Category.objects.create(name='Shirts')
+        self.mine, self.theirs = [
+            ClothingItem.objects.create(
+                title=f'Shirt {owner.username}', description='Cotton shirt', category=category, type='unisex',
+                size='m', condition='good', owner=owner, status='available', points_value=10
+            )
+            for owner in (self.user, self.other)
+        ]
+        ItemImage.objects.create(item=self.theirs, image='item_images/shirt.jpg', is_primary=True)
+        SwapRequest.objects.create(
+            requester=self.user, owner=self.other, requester_item=self.mine, requested_item=self.theirs
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_swap_list_embeds_cards_and_expands(self):
+        swap = self.client.get('/api/swaps/').data['results'][0]
+        self.assertEqual(swap['owner'], {'id': self.other.pk, 'username': 'bob'})
+        item = swap['requested_item']
+        self.assertEqual(item['category'], {'id': self.mine.category_id, 'name': 'Shirts'})
+        self.assertEqual(item['owner'], {'id': self.other.pk, 'username': 'bob'})
+        self.assertEqual(item['image']['processing_status'], 'pending')
+        self.assertNotIn('description', item)
+        self.assertIsNone(swap['requester_item']['image'])
+
+        swap = self.client.get('/api/swaps/?expand=owner,requested_item').data['results'][0]
+        self.assertEqual(swap['owner']['email'], 'bob@example.com')
+        self.assertEqual(swap['requested_item']['description'], 'Cotton shirt')
+        self.assertEqual(len(swap['requested_item']['images']), 1)
+        self.assertNotIn('description', swap['requester_item'])
+
+    def test_detail_and_create_keep_full_embeds(self):
+        swap = SwapRequest.objects.get()
+        detail = self.client.get(f'/api/swaps/{swap.pk}/').data
+        self.assertEqual(detail['owner']['email'], 'bob@example.com')
+        self.assertEqual(detail['requested_item']['description'], 'Cotton shirt')
+
+        created = self.client.post('/api/points/redeem/', {'item_id': self.theirs.pk})
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(created.data['item']['description'], 'Cotton shirt')
+        self.assertIn('date_joined', created.data['user'])
+        listed = self.client.get('/api/points/redemptions/').data['results'][0]
+        self.assertEqual(listed['user'], {'id': self.user.pk, 'username': 'alice'})
+
+    def test_fields_selects_nested_paths(self):
+        swap = self.client.get(
+            '/api/swaps/?fields=status,requested_item.title,requested_item.owner.username'
+        ).data['results'][0]
+        self.assertEqual(swap, {
+            'id': swap['id'], 'status': 'pending',
+            'requested_item': {
+                'id': self.theirs.pk, 'title': 'Shirt bob', 'owner': {'id': self.other.pk, 'username': 'bob'}
+            },
+        })
+
+        rows = self.client.get('/api/points/transactions/?fields=amount').data['results']
+        self.assertTrue(all(set(row) == {'id', 'amount'} for row in rows))
+        self.assertEqual(self.client.get('/api/categories/?fields=name').data['results'], [
+            {'id': self.mine.category_id, 'name': 'Shirts'}
+        ])
+
+    def test_cached_items_keep_viewer_flags(self):
+        anonymous = APIClient().get('/api/items/?fields=title,can_redeem').data['results']
+        self.assertEqual(
+            {row['title']: row['can_redeem'] for row in anonymous}, {'Shirt alice': False, 'Shirt bob': False}
+        )
+        self.assertEqual(set(anonymous[0]), {
+            'id', 'title', 'can_redeem', 'owner', 'status', 'is_available_for_points', 'points_value'
+        })
+        self.assertEqual(set(anonymous[0]['owner']), {'id'})
+
+        rows = self.client.get('/api/items/?fields=title,can_redeem').data['results']
+        self.assertEqual({row['title']: row['can_redeem'] for row in rows}, {'Shirt alice': False, 'Shirt bob': True})
+        self.assertNotIn('can_swap', rows[0])
+
+    def test_fields_only_apply_to_reads(self):
+        response = self.client.patch(
+            f'/api/items/{self.mine.pk}/update/?fields=id', {'title': 'Renamed'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['title'], 'Renamed')
+
+
+@override_settings(REWEAR_INTERACTIONS={'BACKEND': 'sync'})
+class FastPathTests(TestCase):
+    """Item pages built from value tuples match ClothingItemSerializer byte for byte"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='alice', first_name='Alice')
+        self.other = User.objects.create(username='bob', email='bob@example.com')
+        UserProfile.objects.create(user=self.user, points_balance=15)
+        UserProfile.objects.create(user=self.other)
+        category = Category.objects.create(name='Shirts', description='Tops')
+        self.items = [
+            ClothingItem.objects.create(
+                title=f'Cotton shirt {i}', description='Plain shirt' if i else '', category=category,
+                type='unisex', size='m', condition='good', owner=self.other if i % 2 else self.user,
+                status='available', points_value=10 + i, tags='cotton, plain' if i % 3 else '',
+                approved_at=timezone.now() if i % 2 else None, is_available_for_points=i != 3
+            )
+            for i in range(8)
+        ]
+        ItemImage.objects.create(
+            item=self.items[1], image='item_images/shirt.jpg', processing_status='ready', is_primary=True,
+            variants=[{'name': 'item_images/shirt_160.webp', 'width': 160, 'height': 120, 'format': 'webp'}]
+        )
+        ItemImage.objects.create(item=self.items[1], image='item_images/back.jpg')
+        ItemImage.objects.create(item=self.items[2], image='item_images/other.jpg', processing_status='failed')
+        self.client.force_login(self.user)
+
+    def fetch(self, client, url, enabled):
+        cache.clear()
+        with override_settings(REWEAR_FAST_PATH={'ENABLED': enabled}), \
+                CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response, len(queries)
+
+    def test_pages_match_serializer(self):
+        cursor = self.client.get('/api/items/?pagination=cursor&page_size=3').json()['next']
+        urls = [
+            '/api/items/', '/api/items/?page_size=3&page=2', '/api/items/?ordering=-points_value',
+            '/api/items/?search=cotton', cursor, '/api/items/featured/', '/api/items/my-items/',
+            '/api/search/?q=shirt', '/api/search/?min_points=12',
+        ]
+        for client in (self.client, Client()):
+            for url in urls:
+                expected, expected_queries = self.fetch(client, url, False)
+                response, queries = self.fetch(client, url, True)
+                self.assertEqual(response.status_code, expected.status_code, url)
+                self.assertEqual(response.content, expected.content, url)
+                self.assertEqual(queries, expected_queries, url)
+
+        rows = self.client.get('/api/items/my-items/').json()['results']
+        self.assertEqual(len(rows), 4)
+        rows = self.client.get('/api/items/').json()['results']
+        row = next(row for row in rows if row['id'] == self.items[1].pk)
+        self.assertEqual([image['is_primary'] for image in row['images']], [True, False])
+        self.assertTrue(row['images'][0]['srcset'])
+
+    def test_sparse_fieldsets_use_serializer(self):
+        with patch.object(ItemRows, 'build', side_effect=AssertionError):
+            response = self.client.get('/api/items/?fields=title,can_swap')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]), {
+            'id', 'title', 'can_swap', 'owner', 'status', 'is_available_for_swap'
+        })
+
+    def test_mapper_refuses_unknown_fields(self):
+        class ExtraSerializer(ClothingItemSerializer):
+            popularity = serializers.SerializerMethodField()
+
+            class Meta(ClothingItemSerializer.Meta):
+                fields = ClothingItemSerializer.Meta.fields + ['popularity']
+
+        with self.assertRaises(TypeError):
+            RowMapper(ExtraSerializer())
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            'title': 'Caf\u00e9 \u2028 line', 'when': timezone.now(), 'results': {1: 'approved'},
+            'items': [{'points': 10, 'ratio': 0.1, 'ok': True, 'none': None}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2')
+        )
+
+    def test_benchmark_comparison(self):
+        results = compare_fast_path(iterations=1)
+        self.assertEqual(set(results), {scenario.name for scenario in FAST_PATH_SCENARIOS})
+        self.assertGreater(results['items-list']['speedup'], 0)
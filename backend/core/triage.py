@@ -0,0 +1,314 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+
+from .images import get_config as get_image_config, get_executor
+from .models import ClothingItem, ItemImage
+from .moderation import moderate_items
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Differing bits, out of 64, under which two hashes count as the same picture or wording
+    'IMAGE_DISTANCE': 6,
+    'TEXT_DISTANCE': 3,
+    # Priority added by each check that fires, once per check however many matches it has
+    'WEIGHTS': {
+        'copied_image': 50,
+        'copied_text': 30,
+        'duplicate_listing': 30,
+        'contact_details': 20,
+        'failed_image': 10,
+        'no_images': 5,
+    },
+    # Items at or above this priority are 'flagged', anything above zero needs 'review'
+    'FLAG_PRIORITY': 20,
+    # Approve clean items of owners with TRUSTED_APPROVALS items approved by a
+    # moderator and none rejected, without waiting for a moderator
+    'AUTO_APPROVE': False,
+    'TRUSTED_APPROVALS': 3,
+    # Matches kept per check in triage_reasons
+    'MAX_MATCHES': 5,
+    # Seconds an in-process index is reused before it is rebuilt with other processes' items
+    'MAX_AGE': 300,
+}
+
+WORD = re.compile(r'\w+')
+
+# Links and email addresses, which listings should not carry
+LINKS = re.compile(r'https?://|www\.|[\w.+-]+@[\w-]+\.\w')
+# Phone number candidates: digit groups split by one space, dot or dash, or by
+# parentheses, not part of a longer number and not followed by a unit or %.
+# Only candidates with PHONE_DIGITS digits count, which leaves out sizes,
+# measurements like 52 - 54 - 56 cm and years like 1990-2000.
+PHONE_NUMBER = re.compile(
+    r'(?<![\w+.])\+?(?:\(\d{1,5}\)|\d+)(?:[ .-]?\(\d{1,5}\)|[ .-]\d+|(?<=\))\d+){1,7}'
+    r'(?![\w%]|\s*(?:cm|mm|in|inch|inches|kg|g|ml)\b)'
+)
+PHONE_DIGITS = range(9, 16)
+
+
+def has_contact_details(text):
+    if LINKS.search(text):
+        return True
+    return any(sum(char.isdigit() for char in match.group()) in PHONE_DIGITS for match in PHONE_NUMBER.finditer(text))
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REWEAR_TRIAGE', {})}
+
+
+def text_hash(*texts):
+    """64-bit SimHash of the word pairs in texts, None when there are no words.
+
+    Every pair votes on each bit with its own hash, so texts sharing most of
+    their wording end up a few bits apart.
+    """
+    words = WORD.findall(' '.join(texts).lower())
+    features = [f'{first} {second}' for first, second in zip(words, words[1:])] or words
+    if not features:
+        return None
+    votes = [0] * 64
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            votes[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, vote in enumerate(votes) if vote > 0)
+
+
+def hamming(first, second):
+    return (first ^ second).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree of 64-bit hashes, each with the item ids that have it.
+
+    Children hang off a node by their Hamming distance to it, so by the
+    triangle inequality a search within radius r of a query at distance d
+    only descends into children whose edge is within d ± r.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item_id):
+        if self.root is None:
+            self.root = (value, {item_id}, {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].add(item_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, {item_id}, {})
+                return
+            node = child
+
+    def search(self, value, radius):
+        """{item id: smallest distance} of every hash within radius of value"""
+        found = {}
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                for item_id in node[1]:
+                    found[item_id] = min(distance, found.get(item_id, distance))
+            stack.extend(
+                child for edge, child in node[2].items() if distance - radius <= edge <= distance + radius
+            )
+        return found
+
+
+class TriageIndex:
+    """In-memory BK-trees of every item's image and text hashes"""
+
+    def __init__(self, images=(), texts=()):
+        self.images = BKTree()
+        self.texts = BKTree()
+        self.lock = threading.Lock()
+        for item_id, value in images:
+            self.images.add(int(value, 16), item_id)
+        for item_id, value in texts:
+            self.texts.add(int(value, 16), item_id)
+
+    @classmethod
+    def build(cls):
+        images = ItemImage.objects.exclude(image_hash='').values_list(
+            'item_id', 'image_hash'
+        ).iterator(chunk_size=10000)
+        texts = ClothingItem.objects.exclude(text_hash='').values_list(
+            'pk', 'text_hash'
+        ).iterator(chunk_size=10000)
+        return cls(images, texts)
+
+    def add(self, item_id, image_hashes, text):
+        with self.lock:
+            for value in image_hashes:
+                self.images.add(value, item_id)
+            if text is not None:
+                self.texts.add(text, item_id)
+
+    def similar(self, item_id, image_hashes, text, image_distance, text_distance):
+        """({other item id: distance} by image, same by text), item_id itself left out"""
+        with self.lock:
+            by_image = {}
+            for value in image_hashes:
+                for other, distance in self.images.search(value, image_distance).items():
+                    by_image[other] = min(distance, by_image.get(other, distance))
+            by_text = self.texts.search(text, text_distance) if text is not None else {}
+        by_image.pop(item_id, None)
+        by_text.pop(item_id, None)
+        return by_image, by_text
+
+
+_index = None
+_index_built_at = 0
+_index_lock = threading.Lock()
+
+
+def get_triage_index():
+    """Process-wide TriageIndex, rebuilt once it is MAX_AGE seconds old"""
+    global _index, _index_built_at
+    config = get_config()
+    if _index is None or time.monotonic() - _index_built_at > config['MAX_AGE']:
+        with _index_lock:
+            if _index is None or time.monotonic() - _index_built_at > config['MAX_AGE']:
+                _index = TriageIndex.build()
+                _index_built_at = time.monotonic()
+    return _index
+
+
+def reset_triage_index():
+    global _index, _index_built_at
+    with _index_lock:
+        _index, _index_built_at = None, 0
+
+
+def similarity_reasons(item, by_image, by_text, max_matches):
+    """Reasons for the near-identical images and texts of other items, closest first"""
+    if not by_image and not by_text:
+        return []
+    matched = ClothingItem.objects.filter(pk__in=set(by_image) | set(by_text)).values_list(
+        'pk', 'owner_id', 'status'
+    )
+    others = {pk: (owner_id, status) for pk, owner_id, status in matched}
+    reasons = []
+    for kind, matches in (('image', by_image), ('text', by_text)):
+        counts = {}
+        for other, distance in sorted(matches.items(), key=lambda match: (match[1], match[0])):
+            if other not in others:
+                # Deleted since the index was built
+                continue
+            owner_id, status = others[other]
+            check = 'duplicate_listing' if owner_id == item['owner_id'] else f'copied_{kind}'
+            counts[check] = counts.get(check, 0) + 1
+            if counts[check] <= max_matches:
+                reasons.append({'check': check, 'item': other, 'status': status, 'distance': distance})
+    return reasons
+
+
+def is_trusted_owner(owner_id, approvals):
+    counts = ClothingItem.objects.filter(owner_id=owner_id).aggregate(
+        approved=Count('pk', filter=Q(approved_by__isnull=False)),
+        rejected=Count('pk', filter=Q(status='rejected')),
+    )
+    return counts['approved'] >= approvals and not counts['rejected']
+
+
+def triage_item(item_id, config=None):
+    """Check a pending item once all its images are processed, returning its triage status.
+
+    Returns None, and leaves the item alone, when it is not pending or still
+    has images to process; the last image to finish calls this again.
+    """
+    config = config or get_config()
+    if not config['ENABLED']:
+        return None
+    item = ClothingItem.objects.filter(pk=item_id, status='pending').values(
+        'owner_id', 'title', 'description'
+    ).first()
+    if item is None:
+        return None
+    images = list(ItemImage.objects.filter(item_id=item_id).values_list('processing_status', 'image_hash'))
+    if any(processing_status == 'pending' for processing_status, _ in images):
+        return None
+
+    image_hashes = {int(value, 16) for _, value in images if value}
+    text = text_hash(item['title'], item['description'])
+    index = get_triage_index()
+    by_image, by_text = index.similar(
+        item_id, image_hashes, text, config['IMAGE_DISTANCE'], config['TEXT_DISTANCE']
+    )
+
+    reasons = similarity_reasons(item, by_image, by_text, config['MAX_MATCHES'])
+    if has_contact_details(f"{item['title']}\n{item['description']}"):
+        reasons.append({'check': 'contact_details'})
+    if any(processing_status == 'failed' for processing_status, _ in images):
+        reasons.append({'check': 'failed_image'})
+    if not images:
+        reasons.append({'check': 'no_images'})
+
+    weights = config['WEIGHTS']
+    priority = sum(weights.get(check, 0) for check in {reason['check'] for reason in reasons})
+    if priority >= config['FLAG_PRIORITY']:
+        triage_status = 'flagged'
+    elif priority:
+        triage_status = 'review'
+    elif config['AUTO_APPROVE'] and is_trusted_owner(item['owner_id'], config['TRUSTED_APPROVALS']):
+        triage_status = 'approved'
+    else:
+        triage_status = 'clean'
+
+    with transaction.atomic():
+        updated = ClothingItem.objects.filter(pk=item_id, status='pending').update(
+            triage_status=triage_status, triage_priority=min(priority, 32767), triage_reasons=reasons,
+            text_hash=f'{text:016x}' if text is not None else '',
+        )
+        if updated and triage_status == 'approved':
+            moderate_items(None, [item_id], 'approve')
+    index.add(item_id, image_hashes, text)
+    return triage_status if updated else None
+
+
+def run_triage(item_id):
+    """triage_item for background callers, a failure is logged and leaves the item untriaged"""
+    try:
+        return triage_item(item_id)
+    except Exception:
+        logger.exception('Could not triage item %s', item_id)
+        return None
+
+
+def _triage_in_worker(item_id):
+    close_old_connections()
+    try:
+        return run_triage(item_id)
+    finally:
+        close_old_connections()
+
+
+def enqueue_triage(*item_ids):
+    """Triage new items on the image worker; items with images wait for them to be processed"""
+    if not get_config()['ENABLED']:
+        return
+    backend = get_image_config()['BACKEND']
+    if backend == 'queue':
+        # The triage_items command picks them up
+        return
+    for item_id in item_ids:
+        if backend == 'sync':
+            run_triage(item_id)
+        else:
+            get_executor().submit(_triage_in_worker, item_id)
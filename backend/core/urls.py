@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 # URL patterns for the core app
 urlpatterns = [
@@ -19,15 +19,19 @@ urlpatterns = [
     # Items
     path('items/', views.ClothingItemListView.as_view(), name='items-list'),
     path('items/create/', views.ClothingItemCreateView.as_view(), name='items-create'),
+    path('items/import/', views.ItemImportView.as_view(), name='items-import'),
+    path('items/export/', views.ItemExportView.as_view(), name='items-export'),
     path('items/<int:pk>/', views.ClothingItemDetailView.as_view(), name='items-detail'),
     path('items/<int:pk>/update/', views.ItemUpdateView.as_view(), name='items-update'),
     path('items/featured/', views.FeaturedItemsView.as_view(), name='items-featured'),
     path('items/my-items/', views.MyItemsView.as_view(), name='my-items'),
     path('search/', views.search_items, name='search'),
+    path('recommendations/', views.recommendations, name='recommendations'),
     
     # Swap Requests
     path('swaps/', views.SwapRequestListView.as_view(), name='swaps-list'),
     path('swaps/create/', views.SwapRequestCreateView.as_view(), name='swaps-create'),
+    path('swaps/matches/', views.swap_matches, name='swaps-matches'),
     path('swaps/<int:pk>/', views.SwapRequestDetailView.as_view(), name='swaps-detail'),
     
     # Points
@@ -37,13 +41,22 @@ urlpatterns = [
     
     # Notifications
     path('notifications/', views.NotificationListView.as_view(), name='notifications'),
+    path('notifications/stream/', views.NotificationStreamView.as_view(), name='notifications-stream'),
     path('notifications/<int:notification_id>/read/', views.mark_notification_read, name='notification-read'),
     path('notifications/read-all/', views.mark_all_notifications_read, name='notifications-read-all'),
     
     # Admin/Moderation
     path('admin/items/pending/', views.AdminItemModerationView.as_view(), name='admin-items-pending'),
     path('admin/items/<int:item_id>/moderate/', views.moderate_item, name='admin-moderate-item'),
+    path('admin/items/moderate/', views.moderate_items_batch, name='admin-moderate-items'),
     
+    # Monitoring
+    path('metrics/', views.metrics, name='metrics'),
+
     # Test endpoint
     path('hello/', views.HelloView.as_view(), name='hello'),
 ]
+
+# Under ASGI the hot read endpoints are served by native async views, see core.async_views
+if async_views.get_config()['ENABLED']:
+    urlpatterns = async_views.urlpatterns + urlpatterns
@@ -1,29 +1,62 @@
+import time
+from functools import partial
+
 from rest_framework import generics, status, filters, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.parsers import MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
-from rest_framework.pagination import PageNumberPagination
 from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
-from django.db.models import Q, Count
+from django.db import transaction
+from django.db.models import Q, Count, Max
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
 
 from .models import (
-    UserProfile, Category, ClothingItem, ItemImage, SwapRequest,
-    PointsTransaction, PointsRedemption, Notification, UserInteraction
+    UserProfile, Category, ClothingItem, ItemImage, SwapRequest, PointsRedemption, Notification
 )
 from .serializers import (
     UserSerializer, UserProfileSerializer, UserRegistrationSerializer,
     UserLoginSerializer, CategorySerializer, ClothingItemSerializer,
-    ClothingItemCreateSerializer, SwapRequestSerializer,
-    PointsTransactionSerializer, PointsRedemptionSerializer,
+    ClothingItemCreateSerializer, SwapRequestSerializer, SwapRequestListSerializer, SwapRequestUpdateSerializer,
+    PointsTransactionListSerializer, PointsRedemptionSerializer, PointsRedemptionListSerializer,
     NotificationSerializer, UserInteractionSerializer,
-    DashboardStatsSerializer
+    DashboardStatsSerializer, BatchModerationSerializer, ModerationItemSerializer, select_fields
+)
+from .authentication import QueryTokenAuthentication, get_config as get_auth_config, issue_signed_token
+from .bulk import ImageArchive, InvalidArchive, detect_format, export_rows, import_items
+from .cache import PublicResponseCacheMixin, get_category_catalogue
+from .fastpath import FastItemListMixin, item_rows
+from .events import (
+    EventStreamRenderer, ThreadSubscription, get_broker, get_config as get_events_config, last_event_id,
+    notification_messages, sse
 )
+from .interactions import record_interaction
+from .matching import get_match_index
+from .metrics import get_config as get_metrics_config, registry as metrics_registry
+from .moderation import moderate_items, moderation_notification
+from .notifications import item_summary, notify, send_notifications, swap_summary
+from .pagination import ItemPagination
+from .points import LISTING_POINTS, InsufficientPoints, apply_points
+from .recommendations import recommend_items
+from .stats import apply_stats_changes, count_swap, get_dashboard_stats
+from .search import FullTextSearchFilter, search_queryset, order_by_relevance
+from .triage import enqueue_triage
+
+
+def with_item_relations(queryset, *paths):
+    """Join or prefetch what item serializers and cards read for items reached through paths"""
+    for path in paths:
+        queryset = queryset.select_related(
+            f'{path}__owner', f'{path}__category'
+        ).prefetch_related(f'{path}__images')
+    return queryset
 
 
 class HelloView(APIView):
@@ -49,11 +82,14 @@ class RegisterView(generics.CreateAPIView):
         # Create token for the user
         token, created = Token.objects.get_or_create(user=user)
         
-        return Response({
+        data = {
             'user': UserSerializer(user).data,
             'token': token.key,
             'message': 'Registration successful'
-        }, status=status.HTTP_201_CREATED)
+        }
+        if get_auth_config()['SIGNED_TOKENS']:
+            data['signed_token'] = issue_signed_token(user, token)
+        return Response(data, status=status.HTTP_201_CREATED)
 
 
 class LoginView(APIView):
@@ -69,12 +105,15 @@ class LoginView(APIView):
         
         login(request, user)
         
-        return Response({
+        data = {
             'user': UserSerializer(user).data,
             'profile': UserProfileSerializer(user.profile).data,
             'token': token.key,
             'message': 'Login successful'
-        })
+        }
+        if get_auth_config()['SIGNED_TOKENS']:
+            data['signed_token'] = issue_signed_token(user, token)
+        return Response(data)
 
 
 class LogoutView(APIView):
@@ -105,47 +144,36 @@ class DashboardStatsView(APIView):
     """Dashboard statistics for the user"""
     
     def get(self, request):
-        user = request.user
-        
-        # Get user statistics
-        stats = {
-            'total_items': user.owned_items.count(),
-            'available_items': user.owned_items.filter(status='available').count(),
-            'pending_items': user.owned_items.filter(status='pending').count(),
-            'points_balance': user.profile.points_balance,
-            'pending_swap_requests': user.received_swap_requests.filter(status='pending').count(),
-            'ongoing_swaps': user.sent_swap_requests.filter(status='accepted').count() + 
-                           user.received_swap_requests.filter(status='accepted').count(),
-            'completed_swaps': user.sent_swap_requests.filter(status='completed').count() + 
-                             user.received_swap_requests.filter(status='completed').count(),
-            'unread_notifications': user.notifications.filter(is_read=False).count(),
-        }
+        # One aggregate per table, or the materialized stats row when enabled
+        stats = get_dashboard_stats(request.user)
         
         serializer = DashboardStatsSerializer(stats)
         return Response(serializer.data)
 
 
 # Category Views
-class CategoryListView(generics.ListAPIView):
+class CategoryListView(PublicResponseCacheMixin, generics.ListAPIView):
     """List all categories"""
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
-
-# Item Views
-class ItemPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+    def list(self, request, *args, **kwargs):
+        # Served from the catalogue cache, invalidated whenever a count changes
+        catalogue = select_fields(get_category_catalogue(), request)
+        page = self.paginate_queryset(catalogue)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(catalogue)
 
 
-class ClothingItemListView(generics.ListAPIView):
+# Item Views
+class ClothingItemListView(PublicResponseCacheMixin, FastItemListMixin, generics.ListAPIView):
     """List clothing items with filtering and search"""
     serializer_class = ClothingItemSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = ItemPagination
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, FullTextSearchFilter]
     filterset_fields = ['category', 'type', 'size', 'condition', 'status']
     search_fields = ['title', 'description', 'tags']
     ordering_fields = ['created_at', 'points_value', 'title']
@@ -175,25 +203,20 @@ class ClothingItemListView(generics.ListAPIView):
         return queryset
 
 
-class ClothingItemDetailView(generics.RetrieveAPIView):
+class ClothingItemDetailView(PublicResponseCacheMixin, generics.RetrieveAPIView):
     """Get detailed view of a clothing item"""
     queryset = ClothingItem.objects.all()
     serializer_class = ClothingItemSerializer
     permission_classes = [permissions.AllowAny]
 
-    def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
         
-        # Track user interaction if authenticated
-        if request.user.is_authenticated:
-            UserInteraction.objects.create(
-                user=request.user,
-                interaction_type='view',
-                item=instance
-            )
+        # Track user interaction if authenticated, cached and 304 responses included
+        if request.user.is_authenticated and response.status_code in (200, 304):
+            record_interaction(request.user, 'view', item_id=kwargs['pk'])
         
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        return response
 
 
 class ClothingItemCreateView(generics.CreateAPIView):
@@ -203,28 +226,61 @@ class ClothingItemCreateView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        item = serializer.save()
-        
-        # Award points for listing an item
-        PointsTransaction.objects.create(
-            user=request.user,
-            transaction_type='earned',
-            amount=5,
-            description='Points earned for listing an item',
-            related_item=item
-        )
-        
-        # Update user's points balance
-        request.user.profile.points_balance += 5
-        request.user.profile.save()
-        
+        with transaction.atomic():
+            item = serializer.save()
+            # Award points for listing an item
+            apply_points(
+                request.user, LISTING_POINTS, 'earned', 'Points earned for listing an item',
+                related_item=item
+            )
+            transaction.on_commit(partial(enqueue_triage, item.pk))
+
         return Response(
             ClothingItemSerializer(item, context={'request': request}).data,
             status=status.HTTP_201_CREATED
         )
 
 
-class MyItemsView(generics.ListAPIView):
+class ItemImportView(APIView):
+    """Create many items from a CSV or JSONL file plus an optional zip of images"""
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'A CSV or JSONL file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = detect_format(upload.name, request.data.get('format'))
+        if file_format is None:
+            return Response({'error': 'Unsupported format, use csv or jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+
+        archive = None
+        if 'images' in request.FILES:
+            try:
+                archive = ImageArchive(request.FILES['images'])
+            except InvalidArchive:
+                return Response({'error': 'images must be a zip archive'}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = import_items(request.user, upload, file_format, archive=archive)
+        return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST)
+
+
+class ItemExportView(APIView):
+    """Stream the user's items as CSV (default) or JSONL (?as=jsonl)"""
+
+    def get(self, request):
+        file_format = request.query_params.get('as', 'csv')
+        if file_format not in ('csv', 'jsonl'):
+            return Response({'error': 'Unsupported format, use csv or jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            export_rows(request.user.owned_items.all(), file_format), content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="items.{file_format}"'
+        return response
+
+
+class MyItemsView(FastItemListMixin, generics.ListAPIView):
     """List user's own items"""
     serializer_class = ClothingItemSerializer
     pagination_class = ItemPagination
@@ -234,7 +290,7 @@ class MyItemsView(generics.ListAPIView):
 
     def get_queryset(self):
         return self.request.user.owned_items.all().select_related(
-            'category'
+            'owner', 'category'
         ).prefetch_related('images')
 
 
@@ -254,7 +310,7 @@ class SwapRequestCreateView(generics.CreateAPIView):
 
 class SwapRequestListView(generics.ListAPIView):
     """List swap requests (sent and received)"""
-    serializer_class = SwapRequestSerializer
+    serializer_class = SwapRequestListSerializer
     pagination_class = ItemPagination
     filter_backends = [filters.OrderingFilter]
     ordering = ['-created_at']
@@ -264,28 +320,39 @@ class SwapRequestListView(generics.ListAPIView):
         request_type = self.request.query_params.get('type', 'all')
         
         if request_type == 'sent':
-            return user.sent_swap_requests.all()
+            queryset = user.sent_swap_requests.all()
         elif request_type == 'received':
-            return user.received_swap_requests.all()
+            queryset = user.received_swap_requests.all()
         else:
-            return SwapRequest.objects.filter(
+            queryset = SwapRequest.objects.filter(
                 Q(requester=user) | Q(owner=user)
-            ).select_related(
-                'requester', 'owner', 'requester_item', 'requested_item'
             )
+        
+        return with_item_relations(
+            queryset.select_related('requester', 'owner'),
+            'requester_item', 'requested_item'
+        )
 
 
 class SwapRequestDetailView(generics.RetrieveUpdateAPIView):
     """View and update swap request"""
     serializer_class = SwapRequestSerializer
 
+    def get_serializer_class(self):
+        if self.request.method in ('PUT', 'PATCH'):
+            return SwapRequestUpdateSerializer
+        return SwapRequestSerializer
+
     def get_queryset(self):
         user = self.request.user
         return SwapRequest.objects.filter(
             Q(requester=user) | Q(owner=user)
         )
 
+    # Side effects roll back with the request if validation fails
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
         instance = self.get_object()
         
         # Only the owner can accept/reject
@@ -295,7 +362,10 @@ class SwapRequestDetailView(generics.RetrieveUpdateAPIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        new_status = request.data.get('status')
+        # Refuses transitions outside SwapRequest.STATUS_TRANSITIONS before any side effect
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        new_status = serializer.validated_data.get('status')
         
         if new_status == 'accepted':
             # Mark both items as in_swap
@@ -305,47 +375,98 @@ class SwapRequestDetailView(generics.RetrieveUpdateAPIView):
             instance.requested_item.save()
             
             # Create notifications
-            Notification.objects.create(
-                user=instance.requester,
-                notification_type='swap_accepted',
-                title='Swap Request Accepted',
-                message=f'Your swap request for {instance.requested_item.title} has been accepted!',
-                related_swap=instance
+            notify(
+                instance.requester_id, 'swap_accepted', 'Swap Request Accepted',
+                f'Your swap request for {instance.requested_item.title} has been accepted!',
+                swap=swap_summary(instance)
             )
             
         elif new_status == 'completed':
+            # Claim the transition with a conditional UPDATE so concurrent
+            # requests cannot complete the same swap (and pay out) twice
+            completed_at = timezone.now()
+            claimed = SwapRequest.objects.filter(pk=instance.pk, status='accepted').update(
+                status='completed', completed_at=completed_at
+            )
+            if not claimed:
+                return Response(
+                    {'error': 'This swap request has already been completed'}, status=status.HTTP_409_CONFLICT
+                )
+
+            # update() skips the signals that move the swap's stats
+            changes = count_swap({}, instance.requester_id, instance.owner_id, instance.status, -1)
+            apply_stats_changes(count_swap(changes, instance.requester_id, instance.owner_id, 'completed'))
+
             # Mark both items as swapped and award points
             instance.requester_item.status = 'swapped'
             instance.requested_item.status = 'swapped'
             instance.requester_item.save()
             instance.requested_item.save()
-            
-            instance.completed_at = timezone.now()
-            
+
+            instance.completed_at = completed_at
+
             # Award completion points to both users
-            for user in [instance.requester, instance.owner]:
-                PointsTransaction.objects.create(
-                    user=user,
-                    transaction_type='earned',
-                    amount=10,
-                    description='Points earned for completing a swap',
-                    related_item=instance.requester_item if user == instance.requester else instance.requested_item
-                )
-                user.profile.points_balance += 10
-                user.profile.save()
-        
-        return super().update(request, *args, **kwargs)
+            apply_points(
+                instance.requester, 10, 'earned', 'Points earned for completing a swap',
+                related_item=instance.requester_item
+            )
+            apply_points(
+                instance.owner, 10, 'earned', 'Points earned for completing a swap',
+                related_item=instance.requested_item
+            )
+
+        serializer.save()
+        return Response(serializer.data)
+
+
+@api_view(['GET'])
+def swap_matches(request):
+    """Proposed two-way swaps and three-way swap cycles for the user's available items"""
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        limit = 10
+
+    # No proposals until the process has built its first index
+    index = get_match_index()
+    matches = index.matches_for(request.user.id, limit=limit) if index is not None else []
+    item_ids = {leg.item_id for match in matches for leg in match.legs}
+    items = ClothingItem.objects.filter(pk__in=item_ids, status='available').select_related(
+        'owner', 'category'
+    ).prefetch_related('images')
+    serialized = {
+        item['id']: item
+        for item in ClothingItemSerializer(items, many=True, context={'request': request}).data
+    }
+
+    results = []
+    for match in matches:
+        # Skip proposals whose items changed hands since the index was built
+        if any(leg.item_id not in serialized for leg in match.legs):
+            continue
+        results.append({
+            'type': match.kind,
+            'score': match.score,
+            'legs': [
+                {'giver': leg.giver, 'receiver': leg.receiver, 'item': serialized[leg.item_id]}
+                for leg in match.legs
+            ],
+        })
+    return Response({'results': results})
 
 
 # Points Views
 class PointsTransactionListView(generics.ListAPIView):
     """List user's points transactions"""
-    serializer_class = PointsTransactionSerializer
+    serializer_class = PointsTransactionListSerializer
     pagination_class = ItemPagination
     ordering = ['-created_at']
 
     def get_queryset(self):
-        return self.request.user.points_transactions.all()
+        return with_item_relations(
+            self.request.user.points_transactions.select_related('user'),
+            'related_item'
+        )
 
 
 class PointsRedemptionCreateView(generics.CreateAPIView):
@@ -355,29 +476,24 @@ class PointsRedemptionCreateView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        redemption = serializer.save()
-        
-        # Deduct points immediately (pending redemption)
         user = request.user
-        user.profile.points_balance -= redemption.points_used
-        user.profile.save()
-        
-        # Create transaction record
-        PointsTransaction.objects.create(
-            user=user,
-            transaction_type='redeemed',
-            amount=-redemption.points_used,
-            description=f'Points redeemed for {redemption.item.title}',
-            related_item=redemption.item
-        )
-        
-        # Notify item owner
-        Notification.objects.create(
-            user=redemption.item.owner,
-            notification_type='points_redeemed',
-            title='Item Redeemed with Points',
-            message=f'{user.username} wants to redeem your item "{redemption.item.title}" for {redemption.points_used} points',
-            related_item=redemption.item
+        try:
+            with transaction.atomic():
+                redemption = serializer.save()
+                # Deduct points immediately (pending redemption), refused if
+                # a concurrent request already spent them
+                apply_points(
+                    user, -redemption.points_used, 'redeemed',
+                    f'Points redeemed for {redemption.item.title}', related_item=redemption.item
+                )
+        except InsufficientPoints:
+            return Response({'error': 'Insufficient points'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Notify item owner, several redemptions of one item coalesce into one notification
+        notify(
+            redemption.item.owner_id, 'points_redeemed', 'Item Redeemed with Points',
+            f'{user.username} wants to redeem your item "{redemption.item.title}" for {redemption.points_used} points',
+            item=item_summary(redemption.item)
         )
         
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -385,12 +501,15 @@ class PointsRedemptionCreateView(generics.CreateAPIView):
 
 class PointsRedemptionListView(generics.ListAPIView):
     """List user's points redemptions"""
-    serializer_class = PointsRedemptionSerializer
+    serializer_class = PointsRedemptionListSerializer
     pagination_class = ItemPagination
     ordering = ['-created_at']
 
     def get_queryset(self):
-        return self.request.user.point_redemptions.all()
+        return with_item_relations(
+            self.request.user.point_redemptions.select_related('user'),
+            'item'
+        )
 
 
 # Notification Views
@@ -401,7 +520,68 @@ class NotificationListView(generics.ListAPIView):
     ordering = ['-created_at']
 
     def get_queryset(self):
-        return self.request.user.notifications.all()
+        return notifications_for(self.request.user)
+
+
+def notifications_for(user):
+    """The user's notifications, NotificationSerializer reads nothing beyond the row"""
+    return user.notifications.all()
+
+
+class NotificationStreamView(APIView):
+    """Server-Sent Events stream of the user's new notifications.
+
+    Sends every notification after Last-Event-ID (or ?last_event_id=, else
+    only new ones) with the unread count, then waits for core.events to
+    report more. Under WSGI each open stream holds a worker thread, ASGI
+    deployments get core.async_views.NotificationStreamView instead.
+    """
+    authentication_classes = [*APIView.authentication_classes, QueryTokenAuthentication]
+    renderer_classes = [EventStreamRenderer, *APIView.renderer_classes]
+
+    def get(self, request):
+        after = last_event_id(request)
+        if after is None:
+            after = request.user.notifications.aggregate(last=Max('pk'))['last'] or 0
+        return event_stream_response(self.stream(request, after))
+
+    def stream(self, request, after):
+        config = get_events_config()
+        broker = get_broker()
+        subscription = ThreadSubscription(request.user.id)
+        broker.subscribe(subscription)
+        try:
+            yield sse(retry=config['RETRY'])
+            deadline = time.monotonic() + config['MAX_DURATION']
+            woken = True
+            while True:
+                while woken:
+                    queryset = notifications_for(request.user).filter(pk__gt=after).order_by('pk')
+                    rows = list(queryset[:config['BATCH_SIZE']])
+                    if not rows:
+                        break
+                    after = rows[-1].pk
+                    unread = request.user.notifications.filter(is_read=False).count()
+                    data = NotificationSerializer(rows, many=True, context={'request': request}).data
+                    yield b''.join(notification_messages(data, unread))
+                    woken = len(rows) == config['BATCH_SIZE']
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                woken = subscription.wait(min(config['HEARTBEAT'], remaining))
+                if not woken:
+                    yield sse(comment='keep-alive')
+        finally:
+            broker.unsubscribe(subscription)
+
+
+def event_stream_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @api_view(['POST'])
@@ -422,12 +602,13 @@ def mark_notification_read(request, notification_id):
 @api_view(['POST'])
 def mark_all_notifications_read(request):
     """Mark all notifications as read"""
-    request.user.notifications.filter(is_read=False).update(is_read=True)
+    updated = request.user.notifications.filter(is_read=False).update(is_read=True)
+    apply_stats_changes({request.user.id: {'unread_notifications': -updated}})
     return Response({'message': 'All notifications marked as read'})
 
 
 # Featured Items View
-class FeaturedItemsView(generics.ListAPIView):
+class FeaturedItemsView(PublicResponseCacheMixin, FastItemListMixin, generics.ListAPIView):
     """Get featured items for the landing page"""
     serializer_class = ClothingItemSerializer
     permission_classes = [permissions.AllowAny]
@@ -442,34 +623,22 @@ class FeaturedItemsView(generics.ListAPIView):
 
 
 # Search and Recommendations
-@api_view(['GET'])
-@permission_classes([permissions.AllowAny])
-def search_items(request):
-    """Advanced search for items"""
-    query = request.GET.get('q', '')
-    category = request.GET.get('category')
-    item_type = request.GET.get('type')
-    size = request.GET.get('size')
-    condition = request.GET.get('condition')
-    min_points = request.GET.get('min_points')
-    max_points = request.GET.get('max_points')
+def get_search_queryset(params):
+    """Build the search_items queryset from query parameters"""
+    query = params.get('q', '')
+    category = params.get('category')
+    item_type = params.get('type')
+    size = params.get('size')
+    condition = params.get('condition')
+    min_points = params.get('min_points')
+    max_points = params.get('max_points')
     
-    queryset = ClothingItem.objects.filter(status='available')
+    queryset = ClothingItem.objects.filter(status='available').select_related(
+        'owner', 'category'
+    ).prefetch_related('images')
     
     if query:
-        queryset = queryset.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query) |
-            Q(tags__icontains=query)
-        )
-        
-        # Track search interaction
-        if request.user.is_authenticated:
-            UserInteraction.objects.create(
-                user=request.user,
-                interaction_type='search',
-                search_query=query
-            )
+        queryset = search_queryset(queryset, query)
     
     if category:
         queryset = queryset.filter(category_id=category)
@@ -484,27 +653,81 @@ def search_items(request):
     if max_points:
         queryset = queryset.filter(points_value__lte=max_points)
     
+    # Relevance-ranked when searching, newest first otherwise
+    if query:
+        return order_by_relevance(queryset)
+    return queryset.order_by('-created_at')
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def search_items(request):
+    """Advanced search for items"""
+    query = request.GET.get('q', '')
+    queryset = get_search_queryset(request.GET)
+    
+    # Track search interaction
+    if query and request.user.is_authenticated:
+        record_interaction(request.user, 'search', search_query=query)
+    
     # Paginate results
     paginator = ItemPagination()
-    page = paginator.paginate_queryset(queryset.order_by('-created_at'), request)
+    rows = item_rows(request)
+    if rows is not None:
+        page = paginator.paginate_queryset(rows.values(queryset), request)
+        return paginator.get_paginated_response(rows.serialize(page))
+    page = paginator.paginate_queryset(queryset, request)
     serializer = ClothingItemSerializer(page, many=True, context={'request': request})
     
     return paginator.get_paginated_response(serializer.data)
 
 
+@api_view(['GET'])
+def recommendations(request):
+    """Items recommended from the user's views and likes"""
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        limit = 10
+
+    items = recommend_items(
+        request.user, limit=limit,
+        queryset=ClothingItem.objects.select_related('owner', 'category').prefetch_related('images')
+    )
+    serializer = ClothingItemSerializer(items, many=True, context={'request': request})
+    return Response({'results': serializer.data})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def metrics(request):
+    """Request metrics of this process in the Prometheus text format"""
+    token = get_metrics_config()['TOKEN']
+    scraper = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (scraper or request.user.is_staff):
+        return Response({'error': 'Staff or the metrics token required'}, status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # Admin Views (for moderation)
 class AdminItemModerationView(generics.ListAPIView):
-    """Admin view for moderating items"""
-    serializer_class = ClothingItemSerializer
+    """Admin view for moderating items, ?triage= narrows it to one triage outcome"""
+    serializer_class = ModerationItemSerializer
     permission_classes = [permissions.IsAdminUser]
     pagination_class = ItemPagination
     filter_backends = [filters.OrderingFilter]
+    # Oldest first, which keyset pagination serves; ?ordering=-triage_priority,created_at
+    # puts the most suspicious items first
     ordering = ['created_at']
 
     def get_queryset(self):
-        return ClothingItem.objects.filter(status='pending').select_related(
+        queryset = ClothingItem.objects.filter(status='pending').select_related(
             'owner', 'category'
         ).prefetch_related('images')
+        triage = self.request.query_params.get('triage')
+        if triage is not None:
+            queryset = queryset.filter(triage_status='' if triage == 'none' else triage)
+        return queryset
 
 
 @api_view(['POST'])
@@ -526,15 +749,9 @@ def moderate_item(request, item_id):
         item.status = 'available'
         item.approved_at = timezone.now()
         item.approved_by = request.user
-        notification_type = 'item_approved'
-        notification_title = 'Item Approved'
-        notification_message = f'Your item "{item.title}" has been approved and is now available for swapping!'
         
     elif action == 'reject':
         item.status = 'rejected'
-        notification_type = 'item_rejected'
-        notification_title = 'Item Rejected'
-        notification_message = f'Your item "{item.title}" has been rejected. Reason: {message}'
         
     else:
         return Response(
@@ -545,15 +762,24 @@ def moderate_item(request, item_id):
     item.save()
     
     # Create notification for the item owner
-    Notification.objects.create(
-        user=item.owner,
-        notification_type=notification_type,
-        title=notification_title,
-        message=notification_message,
-        related_item=item
-    )
+    send_notifications([moderation_notification(action, item_summary(item), item.owner_id, message)])
     
     return Response({
         'message': f'Item {action}d successfully',
         'item': ClothingItemSerializer(item).data
     })
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def moderate_items_batch(request):
+    """Approve or reject many pending items in one transaction"""
+    serializer = BatchModerationSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    data = serializer.validated_data
+    results = moderate_items(request.user, data['ids'], data['action'], data['message'])
+    return Response({
+        'action': data['action'],
+        'updated': sum(result not in ('not_found', 'not_pending') for result in results.values()),
+        'results': results,
+    })
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wear_project.settings')
+# Serve the hot read endpoints with core.async_views, REWEAR_ASYNC_VIEWS=0 opts out
+os.environ.setdefault('REWEAR_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
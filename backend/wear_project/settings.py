@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -81,10 +83,12 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.FormParser',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        # JSONRenderer output, encoded with orjson when it is installed
+        'core.renderers.FastJSONRenderer',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
+        'core.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -126,6 +130,138 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Point this at Redis or Memcached in production so invalidations reach every worker
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'rewear',
+    }
+}
+
+
+# ReWear
+# Keep a per-user dashboard stats row up to date on writes instead of
+# aggregating on every dashboard request. Run rebuild_user_stats after enabling.
+
+REWEAR_MATERIALIZED_STATS = False
+
+# Item views and searches are recorded off the request path. 'memory' batches
+# them in process, 'spool' appends them to SPOOL_PATH for the flush_interactions
+# worker, 'sync' inserts them inline. Unflushable events fall back to the spool.
+REWEAR_INTERACTIONS = {
+    'BACKEND': 'memory',
+    'MAX_EVENTS': 500,
+    'MAX_DELAY': 2.0,
+    'SPOOL_PATH': BASE_DIR / 'interactions.spool',
+}
+
+
+# Uploaded item images are resized off the request path. 'thread' uses an
+# in-process pool, 'queue' leaves them for the process_images worker.
+REWEAR_IMAGE_PROCESSING = {
+    'BACKEND': 'thread',
+    'WORKERS': 4,
+    'MAX_SIZE': 800,
+    'VARIANT_WIDTHS': [160, 400, 800],
+    # Add 'avif' ahead of 'webp' when the Pillow build supports it
+    'VARIANT_FORMATS': ['webp', 'jpeg'],
+}
+
+
+# Public item endpoints are cached, with per-user fields recomputed on each hit
+# and entries dropped by signals when items, images or categories change.
+REWEAR_RESPONSE_CACHE = {
+    'ENABLED': True,
+    'TIMEOUT': 60 * 5,
+}
+
+
+# /api/recommendations/ serves an item co-occurrence model built from views and
+# likes. build_recommendations writes it to MODEL_PATH; processes load it and
+# fold in newer interactions every REFRESH_INTERVAL seconds.
+REWEAR_RECOMMENDATIONS = {
+    'MODEL_PATH': BASE_DIR / 'recommendations.json',
+    'HISTORY': 50,
+    'REFRESH_INTERVAL': 30,
+}
+
+
+# /api/swaps/matches/ and find_swap_matches propose swaps from an in-memory
+# interest graph of available items, rebuilt in the background every MAX_AGE seconds.
+REWEAR_MATCHING = {
+    'FANOUT': 20,
+    'MAX_AGE': 300,
+}
+
+
+# Per-request timings, query counts and response sizes, kept per process and
+# served to Prometheus from /api/metrics/ (staff, or 'Authorization: Bearer TOKEN').
+REWEAR_METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'TOKEN': None,
+}
+
+
+# Token logins are cached per process for CACHE_TTL seconds and dropped when the
+# token, user, profile or balance changes. SIGNED_TOKENS adds stateless
+# 'Authorization: Signed <token>' logins, issued at login, that never hit the DB.
+REWEAR_AUTH = {
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 60,
+    'SIGNED_TOKENS': False,
+    'SIGNED_TOKEN_MAX_AGE': 60 * 60,
+}
+
+
+# Item list/detail, featured, search, notifications and dashboard stats run as
+# native async views. wear_project.asgi sets REWEAR_ASYNC_VIEWS=1, so they are
+# used when served by an ASGI server and the sync views under WSGI.
+REWEAR_ASYNC_VIEWS = {
+    'ENABLED': os.environ.get('REWEAR_ASYNC_VIEWS') == '1',
+}
+
+
+# /api/notifications/stream/ pushes new notifications over Server-Sent Events.
+# 'memory' only wakes streams in the process that created the notification;
+# run several processes with 'database', which polls every POLL_INTERVAL.
+REWEAR_EVENTS = {
+    'BACKEND': 'memory',
+    'POLL_INTERVAL': 1.0,
+    'HEARTBEAT': 15,
+    'MAX_DURATION': 300,
+}
+
+# Notifications sent through core.notifications coalesce unread duplicates of
+# the same event; prune_notifications deletes read ones after RETENTION_DAYS.
+REWEAR_NOTIFICATIONS = {
+    'COALESCE_WINDOW': 24 * 60 * 60,
+    'RETENTION_DAYS': 90,
+}
+
+# New items are checked against the image and text hashes of every other item
+# once their images are processed, see core.triage. AUTO_APPROVE lets clean
+# items of trusted owners skip the moderation queue.
+REWEAR_TRIAGE = {
+    'ENABLED': True,
+    'IMAGE_DISTANCE': 6,
+    'TEXT_DISTANCE': 3,
+    'FLAG_PRIORITY': 20,
+    'AUTO_APPROVE': False,
+    'TRUSTED_APPROVALS': 3,
+}
+
+# Item lists (items, my items, featured, search) are built straight from value
+# tuples rather than through ClothingItemSerializer, with the same output.
+# Requests with ?fields= still go through the serializer.
+REWEAR_FAST_PATH = {
+    'ENABLED': True,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 